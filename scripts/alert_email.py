@@ -29,8 +29,8 @@ RECEIVER_EMAIL = "1657703775@qq.com"
 
 # ============================================
 
-def send_email(subject, message, severity='INFO'):
-    """发送邮件告警"""
+def build_message(subject, message, severity='INFO'):
+    """生成告警邮件（纯文本 + HTML）"""
     
     color_map = {
         'INFO': '#4444ff',
@@ -145,18 +145,31 @@ MySQL同步系统告警
     part2 = MIMEText(html_body, 'html', 'utf-8')
     msg.attach(part1)
     msg.attach(part2)
+    return msg
+
+def open_smtp():
+    """连接并登录SMTP服务器，返回可复用的连接"""
+    print(f"正在连接 {SMTP_SERVER}:{SMTP_PORT}...")
+    server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=10)
+    server.starttls()
+    
+    print(f"正在登录 {SENDER_EMAIL}...")
+    server.login(SENDER_EMAIL, SENDER_PASSWORD)
+    return server
+
+def send_email(subject, message, severity='INFO', server=None):
+    """发送邮件告警（传入 server 时复用已登录的连接，由调用方关闭）"""
+    msg = build_message(subject, message, severity)
     
     try:
-        print(f"正在连接 {SMTP_SERVER}:{SMTP_PORT}...")
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=10)
-        server.starttls()
-        
-        print(f"正在登录 {SENDER_EMAIL}...")
-        server.login(SENDER_EMAIL, SENDER_PASSWORD)
+        own_server = server is None
+        if own_server:
+            server = open_smtp()
         
         print(f"正在发送邮件到 {RECEIVER_EMAIL}...")
         server.send_message(msg)
-        server.quit()
+        if own_server:
+            server.quit()
         
         print(f"✅ 邮件告警已发送到 {RECEIVER_EMAIL}")
         return True
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+告警队列 - 进程内异步发送邮件告警，检查流程不等待邮件发送
+
+send_alert() 只把告警放入队列立即返回，由后台线程发送：
+- 按 告警类型+表 去重，同一告警 ALERT_REPEAT_MINUTES 分钟内只发一次（级别升高时立即再发）
+- 第一条告警到达后等待 ALERT_DIGEST_SECONDS 秒，期间的告警合并成一封摘要邮件
+- SMTP 连接在多封邮件间复用，空闲超过 ALERT_SMTP_IDLE_SECONDS 秒后断开
+去重状态写入 cache/alerts.json（manage.sh resume 时清空），发出的告警追加到 logs/alerts.log。
+发送失败时恢复发送前的去重状态，下次同一告警照常发送，不会因为一次失败被压制。
+进程退出时最多等待 ALERT_FLUSH_SECONDS 秒把队列中的告警发完。
+"""
+
+import atexit
+import fcntl
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import alert_email
+
+SEVERITY_ORDER = {'INFO': 0, 'WARNING': 1, 'HIGH': 2, 'CRITICAL': 3}
+
+
+def alert_key(alert):
+    """去重键：告警类型 + 表"""
+    target = alert.get('table') or ','.join(sorted(alert.get('tables', []))) or '*'
+    return f"{alert.get('type', 'ALERT')}:{target}"
+
+
+class AlertQueue:
+    def __init__(self):
+        home = Path(os.getenv('SYNC_HOME', '/opt/mysql-sync'))
+        self.state_file = home / 'cache' / 'alerts.json'
+        self.lock_file = home / 'cache' / 'alerts.lock'
+        self.log_file = home / 'logs' / 'alerts.log'
+        self.repeat_seconds = float(os.getenv('ALERT_REPEAT_MINUTES', 60)) * 60
+        self.digest_seconds = float(os.getenv('ALERT_DIGEST_SECONDS', 30))
+        self.smtp_idle = float(os.getenv('ALERT_SMTP_IDLE_SECONDS', 60))
+        self.flush_seconds = float(os.getenv('ALERT_FLUSH_SECONDS', 60))
+        self.queue = queue.Queue()
+        self.closing = threading.Event()
+        self.smtp = None
+        self.smtp_used = 0
+        self.worker = threading.Thread(target=self.run, name='alert-queue', daemon=True)
+        self.worker.start()
+
+    def update_state(self, func):
+        """在文件锁内读取、修改、写回去重状态（同步常驻进程和 CDC 进程共用）"""
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_file, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            state = {}
+            if self.state_file.exists():
+                with open(self.state_file, 'r') as f:
+                    state = json.load(f)
+            result = func(state.setdefault('alerts', {}))
+            tmp = self.state_file.with_suffix('.tmp')
+            with open(tmp, 'w') as f:
+                json.dump(state, f, indent=2, ensure_ascii=False)
+            tmp.replace(self.state_file)
+        return result
+
+    def put(self, message, severity='CRITICAL', alerts=None):
+        """登记告警并放入发送队列，重复的告警只计数；返回是否会发送"""
+        if alerts:
+            keys = sorted({alert_key(a) for a in alerts})
+        else:
+            keys = [f"MESSAGE:{hashlib.md5(message.encode()).hexdigest()[:12]}"]
+        now = time.time()
+        previous = {}
+
+        def register(entries):
+            due = False
+            for key in keys:
+                entry = entries.setdefault(key, {'severity': severity, 'first_seen': now, 'last_sent': 0,
+                                                 'count': 0, 'suppressed': 0})
+                entry['count'] += 1
+                entry['last_seen'] = now
+                escalated = SEVERITY_ORDER.get(severity, 0) > SEVERITY_ORDER.get(entry['severity'], 0)
+                if escalated or now - entry['last_sent'] >= self.repeat_seconds:
+                    due = True
+            for key in keys:
+                entry = entries[key]
+                if due:
+                    previous[key] = (entry['last_sent'], entry['severity'])
+                    entry['last_sent'] = now
+                    entry['severity'] = severity
+                else:
+                    entry['suppressed'] += 1
+            return due
+
+        try:
+            due = self.update_state(register)
+        except Exception as e:
+            # 状态文件不可用时宁可重复发送也不漏发
+            print(f"  ⚠️  告警状态读写失败: {e}")
+            due = True
+        if not due:
+            print(f"  🔕 告警 {', '.join(keys)} 在 {self.repeat_seconds / 60:.0f} 分钟内已发送过，本次不再发送")
+            return False
+        self.queue.put({'message': message, 'severity': severity, 'time': datetime.now(),
+                        'sent_at': now, 'previous': previous})
+        return True
+
+    def unregister(self, batch):
+        """发送失败：把这批告警的去重状态恢复为发送前（之后又登记过的不动）"""
+        def restore(entries):
+            for item in batch:
+                for key, (last_sent, severity) in item.get('previous', {}).items():
+                    entry = entries.get(key)
+                    if entry and entry['last_sent'] == item['sent_at']:
+                        entry['last_sent'] = last_sent
+                        entry['severity'] = severity
+        try:
+            self.update_state(restore)
+        except Exception as e:
+            print(f"  ⚠️  告警状态读写失败: {e}")
+
+    def run(self):
+        """后台线程：收集一个摘要窗口内的告警后一起发送"""
+        stop = False
+        while not stop:
+            try:
+                item = self.queue.get(timeout=self.smtp_idle)
+            except queue.Empty:
+                self.close_smtp()
+                continue
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.time() + self.digest_seconds
+            while not self.closing.is_set() and time.time() < deadline:
+                try:
+                    item = self.queue.get(timeout=min(1, max(0.01, deadline - time.time())))
+                except queue.Empty:
+                    continue
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            # 进程退出时不再等待摘要窗口，把剩余告警一起发出
+            while self.closing.is_set():
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                else:
+                    batch.append(item)
+            self.deliver(batch)
+        self.close_smtp()
+
+    def digest(self, batch):
+        """合并成一封邮件：(标题, 正文, 最高级别)"""
+        severity = max((item['severity'] for item in batch), key=lambda s: SEVERITY_ORDER.get(s, 0))
+        if len(batch) == 1:
+            return "系统告警", batch[0]['message'], severity
+        parts = [f"[{item['time'].strftime('%H:%M:%S')}] [{item['severity']}]\n{item['message'].strip()}"
+                 for item in batch]
+        return f"{len(batch)} 条告警汇总", '\n\n'.join(parts), severity
+
+    def deliver(self, batch):
+        subject, message, severity = self.digest(batch)
+        sent = False
+        for attempt in range(2):
+            try:
+                if self.smtp is None or time.time() - self.smtp_used > self.smtp_idle or self.smtp.noop()[0] != 250:
+                    self.close_smtp()
+                    self.smtp = alert_email.open_smtp()
+                sent = alert_email.send_email(subject, message, severity, server=self.smtp)
+            except Exception as e:
+                print(f"  ⚠️  邮件发送失败: {e}")
+            if sent:
+                self.smtp_used = time.time()
+                break
+            # 连接可能已失效，重新登录后再试一次
+            self.close_smtp()
+        if not sent:
+            self.unregister(batch)
+        try:
+            self.log_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.log_file, 'a') as f:
+                for item in batch:
+                    line = item['message'].strip().replace('\n', ' | ')
+                    f.write(f"[{item['time'].strftime('%Y-%m-%d %H:%M:%S')}] [{item['severity']}] "
+                            f"{'' if sent else '(发送失败) '}{line}\n")
+        except Exception:
+            pass
+
+    def close_smtp(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except Exception:
+                pass
+            self.smtp = None
+
+    def close(self):
+        """发送剩余告警并停止后台线程"""
+        self.closing.set()
+        self.queue.put(None)
+        self.worker.join(self.flush_seconds)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = AlertQueue()
+            atexit.register(_queue.close)
+        return _queue
+
+
+def send_alert(message, severity='CRITICAL', alerts=None):
+    """异步发送告警，立即返回；alerts 为告警字典列表（用于去重）"""
+    if get_queue().put(message, severity, alerts):
+        print("  📧 告警已加入发送队列")
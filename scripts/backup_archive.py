@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地备份归档 - 把 MIDDLE 的数据按表、按主键区间写成压缩文件，未变化的区间在多次备份间复用
+
+用法:
+  python3 backup_archive.py                创建一次备份（之后按保留策略清理）
+  python3 backup_archive.py list           列出所有备份
+  python3 backup_archive.py verify [ID|all]
+                                           校验备份文件完整性（默认最新一次）
+  python3 backup_archive.py prune          只按保留策略清理
+
+目录结构（BACKUP_DIR，默认 backups/）:
+  manifests/<ID>.json    每次备份的清单：快照的 binlog 位置、各表结构和区间文件列表
+  chunks/<表>/<键>.sql.gz 区间数据，每行一条 INSERT 语句（可直接 zcat | mysql 导入）
+所有表从同一个一致性快照读取（见 snapshot.PassSnapshot）。
+单列整数主键的表按 BACKUP_CHUNK_SIZE 个主键分块，先计算每块的 "行数:摘要"，
+文件名由表、列、区间和摘要决定，摘要没变的块直接引用已有文件，每天只写变化的块；
+其他表整表一个文件。
+保留最近 BACKUP_KEEP_DAYS 天、至少 BACKUP_KEEP_COUNT 次备份，不再被任何清单引用的文件随之删除。
+备份超过 BACKUP_MAX_MINUTES 分钟或失败时发送告警。
+"""
+
+import fcntl
+import gzip
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+import sys
+import os
+
+import pymysql
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dotenv import load_dotenv
+
+load_dotenv('/opt/mysql-sync/.env')
+
+# 部署目录，可用 SYNC_HOME 指向其他目录（本地测试/基准测试）
+SYNC_HOME = Path(os.getenv('SYNC_HOME', '/opt/mysql-sync'))
+
+from alert_queue import send_alert
+from chunk_checksum import get_int_pk, get_columns, chunk_digests, row_hash_sql
+from db_pool import connect_db
+from row_copy import quote_ident
+from snapshot import PassSnapshot
+from stream_sync import iter_batches
+from table_metadata import fetch_table_metadata
+
+
+def table_digest(cursor, table, columns):
+    """整表的 "行数:摘要" """
+    cursor.execute(
+        f"SELECT COUNT(*) AS cnt, COALESCE(BIT_XOR({row_hash_sql(columns)}), 0) AS digest "
+        f"FROM {quote_ident(table)}"
+    )
+    row = cursor.fetchone()
+    return f"{row['cnt']}:{row['digest']}"
+
+
+def insert_prefix(table, columns):
+    """备份文件中每条语句的前缀，恢复到其他表名时按此替换"""
+    return f"INSERT INTO {quote_ident(table)} ({', '.join(quote_ident(c) for c in columns)}) VALUES "
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class BackupArchive:
+    def __init__(self):
+        self.root = Path(os.getenv('BACKUP_DIR', SYNC_HOME / 'backups'))
+        self.manifest_dir = self.root / 'manifests'
+        self.chunk_dir = self.root / 'chunks'
+        self.chunk_size = int(os.getenv('BACKUP_CHUNK_SIZE', 100000))
+        self.workers = max(1, int(os.getenv('BACKUP_WORKERS', 4)))
+        self.level = int(os.getenv('BACKUP_COMPRESS_LEVEL', 6))
+        self.batch_bytes = int(os.getenv('BACKUP_BATCH_BYTES', 1024 * 1024))
+        self.keep_days = float(os.getenv('BACKUP_KEEP_DAYS', 14))
+        self.keep_count = max(1, int(os.getenv('BACKUP_KEEP_COUNT', 3)))
+        self.max_seconds = float(os.getenv('BACKUP_MAX_MINUTES', 30)) * 60
+        self.manifest_dir.mkdir(parents=True, exist_ok=True)
+        self.chunk_dir.mkdir(parents=True, exist_ok=True)
+
+    def lock(self):
+        """备份和清理互斥，清理不会删掉正在写的文件"""
+        fd = open(self.root / 'backup.lock', 'w')
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            fd.close()
+            return None
+        return fd
+
+    def manifests(self):
+        """所有备份清单的 ID，按时间从旧到新"""
+        return sorted(p.stem for p in self.manifest_dir.glob('*.json'))
+
+    def load_manifest(self, backup_id=None):
+        """读取备份清单，不指定 ID 时读取最新一次"""
+        if backup_id is None:
+            ids = self.manifests()
+            if not ids:
+                return None
+            backup_id = ids[-1]
+        path = self.manifest_dir / f"{backup_id}.json"
+        if not path.exists():
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def chunk_path(self, entry):
+        return self.root / entry['file']
+
+    def known_files(self):
+        """已有清单中的文件 {file: 区间记录}，用于复用未变化的块"""
+        known = {}
+        for backup_id in self.manifests():
+            manifest = self.load_manifest(backup_id)
+            for info in manifest['tables'].values():
+                for entry in info['chunks']:
+                    known[entry['file']] = entry
+        return known
+
+    def chunk_file(self, table, columns, lo, hi, digest):
+        """区间文件的相对路径，由内容决定（相同内容的块得到相同文件名）"""
+        key = hashlib.md5(json.dumps([table, columns, lo, hi, digest]).encode()).hexdigest()
+        return f"chunks/{table}/{key}.sql.gz"
+
+    def scan_table(self, snapshot, table):
+        """计算表的分块摘要，返回清单中的表记录（文件尚未写入）"""
+        conn = snapshot.acquire()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"SHOW CREATE TABLE {quote_ident(table)}")
+            create = cursor.fetchone()['Create Table']
+            columns = get_columns(cursor, table)
+            pk = get_int_pk(cursor, table)
+            chunks = []
+            if pk:
+                digests = chunk_digests(cursor, table, pk, columns, self.chunk_size)
+                for chunk in sorted(digests, key=int):
+                    lo = int(chunk) * self.chunk_size
+                    hi = lo + self.chunk_size
+                    chunks.append({'lo': lo, 'hi': hi, 'digest': digests[chunk],
+                                   'rows': int(digests[chunk].split(':')[0])})
+            else:
+                digest = table_digest(cursor, table, columns)
+                chunks.append({'lo': None, 'hi': None, 'digest': digest, 'rows': int(digest.split(':')[0])})
+        finally:
+            cursor.close()
+            conn.close()
+        for entry in chunks:
+            entry['file'] = self.chunk_file(table, columns, entry['lo'], entry['hi'], entry['digest'])
+        return {'create': create, 'columns': columns, 'pk': pk,
+                'chunk_size': self.chunk_size if pk else None,
+                'rows': sum(entry['rows'] for entry in chunks), 'chunks': chunks}
+
+    def write_chunk(self, snapshot, table, info, entry):
+        """把一个区间写成压缩文件（先写临时文件再改名），返回写入的字节数"""
+        path = self.chunk_path(entry)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + '.tmp')
+        conn = snapshot.acquire()
+        src = conn.cursor(pymysql.cursors.SSCursor)
+        prefix = insert_prefix(table, info['columns'])
+        cols = ', '.join(quote_ident(c) for c in info['columns'])
+        try:
+            src.execute("SET SESSION net_write_timeout = 600")
+            if entry['lo'] is None:
+                src.execute(f"SELECT {cols} FROM {quote_ident(table)}")
+            else:
+                pk = quote_ident(info['pk'])
+                src.execute(f"SELECT {cols} FROM {quote_ident(table)} WHERE {pk} >= %s AND {pk} < %s "
+                            f"ORDER BY {pk}", (entry['lo'], entry['hi']))
+            # 二进制列的字节以 surrogateescape 原样写出
+            with gzip.open(tmp, 'wt', encoding='utf-8', errors='surrogateescape', compresslevel=self.level) as out:
+                for batch, _ in iter_batches(src, conn.escape, self.batch_bytes):
+                    # escape 会转义换行，每条语句恰好一行
+                    out.write(prefix + ','.join(batch) + ';\n')
+            src.close()
+            conn.close()
+        except Exception:
+            # 服务端游标可能没读完，连接不能再用
+            conn.discard()
+            tmp.unlink(missing_ok=True)
+            raise
+        tmp.replace(path)
+        entry['bytes'] = path.stat().st_size
+        entry['sha256'] = file_sha256(path)
+        return entry['bytes']
+
+    def run(self):
+        """创建一次备份，返回清单"""
+        lock = self.lock()
+        if lock is None:
+            print("⚠️  已有备份或清理在运行，退出")
+            return None
+        start = time.time()
+        backup_id = datetime.now().strftime('%Y%m%d-%H%M%S')
+        print("=" * 70)
+        print(f"💾 备份归档 {backup_id} → {self.root}")
+        print("=" * 70)
+        try:
+            conn = connect_db('MIDDLE')
+            cursor = conn.cursor()
+            try:
+                tables = sorted(t for t in fetch_table_metadata(cursor) if not t.startswith('_'))
+            finally:
+                cursor.close()
+                conn.close()
+
+            snapshot = PassSnapshot('MIDDLE', self.workers, tables)
+            print(f"📸 一致性快照: {snapshot.describe()}")
+            try:
+                with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                    infos = dict(zip(tables, pool.map(lambda t: self.scan_table(snapshot, t), tables)))
+                scanned = time.time() - start
+                print(f"🔍 计算分块摘要: {len(tables)} 个表, "
+                      f"{sum(len(i['chunks']) for i in infos.values())} 个块 ({scanned:.1f}s)")
+
+                known = self.known_files()
+                todo, reused_bytes = [], 0
+                for table, info in infos.items():
+                    for entry in info['chunks']:
+                        previous = known.get(entry['file'])
+                        path = self.chunk_path(entry)
+                        if previous and previous.get('sha256') and path.exists() \
+                                and path.stat().st_size == previous['bytes']:
+                            entry['bytes'], entry['sha256'] = previous['bytes'], previous['sha256']
+                            reused_bytes += entry['bytes']
+                        else:
+                            todo.append((table, info, entry))
+                print(f"✍️  写入 {len(todo)} 个变化的块，复用 {sum(len(i['chunks']) for i in infos.values()) - len(todo)} 个")
+
+                # 大块先写，避免最后只剩一个线程在写大文件
+                todo.sort(key=lambda item: item[2]['rows'], reverse=True)
+                with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                    written = sum(pool.map(lambda item: self.write_chunk(snapshot, *item), todo))
+            finally:
+                snapshot.close()
+
+            seconds = time.time() - start
+            manifest = {
+                'id': backup_id,
+                'time': datetime.now().isoformat(),
+                'snapshot': snapshot.coordinates,
+                'seconds': round(seconds, 1),
+                'chunks_written': len(todo),
+                'bytes_written': written,
+                'bytes_reused': reused_bytes,
+                'tables': infos,
+            }
+            tmp = self.manifest_dir / f"{backup_id}.json.tmp"
+            with open(tmp, 'w') as f:
+                json.dump(manifest, f, indent=1, default=str)
+            tmp.replace(self.manifest_dir / f"{backup_id}.json")
+
+            rows = sum(info['rows'] for info in infos.values())
+            print(f"\n✅ 备份完成: {len(infos)} 个表, {rows:,} 行, 新写入 {written / 1024 / 1024:.1f} MB, "
+                  f"复用 {reused_bytes / 1024 / 1024:.1f} MB ({seconds:.1f}s)")
+            if seconds > self.max_seconds:
+                send_alert(f"备份 {backup_id} 耗时 {seconds / 60:.1f} 分钟，超过 {self.max_seconds / 60:.0f} 分钟的窗口",
+                           'WARNING', [{'type': 'BACKUP_SLOW'}])
+            self.prune(locked=True)
+            return manifest
+        except Exception as e:
+            print(f"❌ 备份失败: {e}")
+            send_alert(f"备份 {backup_id} 失败: {e}", 'HIGH', [{'type': 'BACKUP_FAILED'}])
+            return None
+        finally:
+            lock.close()
+
+    def prune(self, locked=False):
+        """删除超出保留期的备份清单，再删除不再被引用的区间文件"""
+        lock = None
+        if not locked:
+            lock = self.lock()
+            if lock is None:
+                print("⚠️  已有备份或清理在运行，退出")
+                return
+        try:
+            ids = self.manifests()
+            cutoff = time.time() - self.keep_days * 86400
+            removed = 0
+            for backup_id in ids[:-self.keep_count]:
+                path = self.manifest_dir / f"{backup_id}.json"
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    removed += 1
+
+            referenced = set(self.known_files())
+            freed, files = 0, 0
+            for path in self.chunk_dir.rglob('*'):
+                if not path.is_file():
+                    continue
+                if str(path.relative_to(self.root)) not in referenced:
+                    freed += path.stat().st_size
+                    files += 1
+                    path.unlink()
+            for directory in self.chunk_dir.iterdir():
+                if directory.is_dir() and not any(directory.iterdir()):
+                    directory.rmdir()
+            print(f"🧹 清理: 删除 {removed} 个过期备份, {files} 个无引用文件 ({freed / 1024 / 1024:.1f} MB)")
+        finally:
+            if lock is not None:
+                lock.close()
+
+    def verify(self, backup_id=None):
+        """校验备份：每个区间文件存在、大小和 SHA-256 与清单一致、能完整解压"""
+        ids = self.manifests() if backup_id == 'all' else [backup_id or (self.manifests() or [None])[-1]]
+        if not ids or ids == [None]:
+            print("暂无备份")
+            return False
+        ok = True
+        for bid in ids:
+            manifest = self.load_manifest(bid)
+            if manifest is None:
+                print(f"❌ 备份 {bid} 不存在")
+                return False
+            checked, bad = 0, []
+            for table, info in manifest['tables'].items():
+                for entry in info['chunks']:
+                    checked += 1
+                    path = self.chunk_path(entry)
+                    try:
+                        if not path.exists():
+                            raise ValueError("文件不存在")
+                        if path.stat().st_size != entry['bytes'] or file_sha256(path) != entry['sha256']:
+                            raise ValueError("大小或 SHA-256 不一致")
+                        with gzip.open(path, 'rb') as f:
+                            while f.read(1024 * 1024):
+                                pass
+                    except Exception as e:
+                        bad.append(f"{table} [{entry['lo']}, {entry['hi']}) {entry['file']}: {e}")
+            if bad:
+                ok = False
+                print(f"❌ 备份 {bid}: {len(bad)}/{checked} 个文件损坏")
+                for line in bad[:20]:
+                    print(f"   {line}")
+            else:
+                print(f"✅ 备份 {bid}: {checked} 个文件完整")
+        return ok
+
+    def list_backups(self):
+        ids = self.manifests()
+        if not ids:
+            print("暂无备份")
+            return
+        print(f"{'ID':<17} {'表':>4} {'行数':>14} {'新写入':>10} {'复用':>10} {'耗时':>8}  binlog")
+        for backup_id in ids:
+            m = self.load_manifest(backup_id)
+            coords = m.get('snapshot') or {}
+            where = coords.get('source') or coords.get('binlog')
+            rows = sum(info['rows'] for info in m['tables'].values())
+            print(f"{backup_id:<17} {len(m['tables']):>4} {rows:>14,} "
+                  f"{m['bytes_written'] / 1024 / 1024:>8.1f}MB {m['bytes_reused'] / 1024 / 1024:>8.1f}MB "
+                  f"{m['seconds']:>7.1f}s  {where['file'] + ':' + str(where['position']) if where else '-'}")
+        total = sum(p.stat().st_size for p in self.chunk_dir.rglob('*') if p.is_file())
+        print(f"\n占用空间: {total / 1024 / 1024:.1f} MB")
+
+
+if __name__ == '__main__':
+    archive = BackupArchive()
+    command = sys.argv[1] if len(sys.argv) > 1 else 'run'
+    if command == 'list':
+        archive.list_backups()
+        result = True
+    elif command == 'verify':
+        result = archive.verify(sys.argv[2] if len(sys.argv) > 2 else None)
+    elif command == 'prune':
+        archive.prune()
+        result = True
+    else:
+        result = archive.run() is not None
+    sys.exit(0 if result else 1)
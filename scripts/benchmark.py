@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试 - 在本地 MySQL 上生成测试表，测量变更检测、同步和数据保护检查的耗时
+
+用法:
+  python3 benchmark.py                          按 BENCH_SIZES × BENCH_TABLE_COUNTS 运行所有场景
+  python3 benchmark.py --compare 旧.json 新.json  比较两次结果（如两个版本）
+
+测试库 BENCH_SOURCE_DB / BENCH_TARGET_DB 分别充当 MIDDLE 和 CLOUD（库名必须含 bench，
+每次运行会重建这两个库）。同步状态写在临时 SYNC_HOME 中，不影响线上缓存和指标。
+每个场景依次测量：冷启动检测 → 全量同步 → 创建基线 → 无变化检测 →
+按 BENCH_CHANGE_RATE 等比例修改数据 → 变化检测 → 增量同步 → 删除/结构检查，
+最后用 CHECKSUM TABLE 确认两端一致。结果（含 git 版本和同步配置）写成 JSON，
+默认 logs/benchmark_<时间>.json。SYNC_MODE、SYNC_WORKERS 等同步配置照常生效。
+"""
+
+import contextlib
+import json
+import os
+import random
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dotenv import load_dotenv
+
+load_dotenv('/opt/mysql-sync/.env')
+
+import pymysql
+
+OUTPUT_DIR = Path(os.getenv('SYNC_HOME', '/opt/mysql-sync')) / 'logs'
+HOST = os.getenv('BENCH_HOST', '127.0.0.1')
+PORT = int(os.getenv('BENCH_PORT', 3306))
+USER = os.getenv('BENCH_USER', 'root')
+PASSWORD = os.getenv('BENCH_PASS', '')
+SOURCE_DB = os.getenv('BENCH_SOURCE_DB', 'mysql_sync_bench_src')
+TARGET_DB = os.getenv('BENCH_TARGET_DB', 'mysql_sync_bench_dst')
+
+# 同步引擎在导入时读取 SYNC_HOME，必须在导入前指向临时目录
+BENCH_HOME = Path(tempfile.mkdtemp(prefix='mysql-sync-bench-'))
+os.environ['SYNC_HOME'] = str(BENCH_HOME)
+os.environ['METRICS_TEXTFILE'] = str(BENCH_HOME / 'metrics' / 'mysql_sync.prom')
+for _prefix, _db in (('MIDDLE', SOURCE_DB), ('CLOUD', TARGET_DB)):
+    os.environ.update({f'{_prefix}_HOST': HOST, f'{_prefix}_PORT': str(PORT), f'{_prefix}_USER': USER,
+                       f'{_prefix}_PASS': PASSWORD, f'{_prefix}_DB': _db})
+
+from smart_sync import SmartSyncEngine
+from data_protection import SmartDataProtector
+
+# 修改后等待超过 UPDATE_TIME 防抖窗口（smart_sync 中为5秒），让元数据预筛选正常生效
+SETTLE_SECONDS = 6
+CONFIG_KEYS = ('SYNC_MODE', 'SYNC_WORKERS', 'SYNC_PIPELINE', 'SYNC_LOAD_MODE', 'SYNC_COMPRESSION',
+               'SYNC_BATCH_BYTES', 'SYNC_LOAD_BATCH_BYTES', 'SYNC_TABLE_WORKERS', 'CHUNK_SIZE')
+# 比较结果时越小越好的指标，其余（吞吐量）越大越好
+LOWER_IS_BETTER = ('_seconds',)
+
+
+def parse_list(name, default):
+    return [int(v) for v in os.getenv(name, default).split(',') if v.strip()]
+
+
+def git_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or 'unknown'
+    except Exception:
+        return 'unknown'
+
+
+class Benchmark:
+    def __init__(self):
+        self.sizes = parse_list('BENCH_SIZES', '10000,100000')
+        self.table_counts = parse_list('BENCH_TABLE_COUNTS', '1,10')
+        self.change_rate = float(os.getenv('BENCH_CHANGE_RATE', 1)) / 100
+        self.insert_rate = float(os.getenv('BENCH_INSERT_RATE', 1)) / 100
+        self.delete_rate = float(os.getenv('BENCH_DELETE_RATE', 0.1)) / 100
+        self.changed_tables = float(os.getenv('BENCH_CHANGED_TABLES_PERCENT', 20)) / 100
+        self.row_bytes = int(os.getenv('BENCH_ROW_BYTES', 100))
+        self.verbose = os.getenv('BENCH_VERBOSE', '0') == '1'
+        self.rng = random.Random(int(os.getenv('BENCH_SEED', 42)))
+        # 预生成的随机备注，数据的可压缩性接近真实业务数据
+        self.notes = [''.join(self.rng.choices(string.ascii_letters + string.digits, k=self.row_bytes))
+                      for _ in range(4096)]
+        self.admin = pymysql.connect(host=HOST, port=PORT, user=USER, password=PASSWORD,
+                                     charset='utf8mb4', autocommit=True)
+
+    def execute(self, sql, args=None, db=None):
+        cursor = self.admin.cursor()
+        try:
+            if db:
+                cursor.execute(f"USE `{db}`")
+            cursor.execute(sql, args)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def reset(self):
+        """清空测试库和临时同步目录"""
+        for db in (SOURCE_DB, TARGET_DB):
+            for (table,) in self.execute("SELECT TABLE_NAME FROM information_schema.TABLES "
+                                         "WHERE TABLE_SCHEMA = %s", (db,)):
+                self.execute(f"DROP TABLE `{table}`", db=db)
+        for name in ('cache', 'logs', 'metrics'):
+            shutil.rmtree(BENCH_HOME / name, ignore_errors=True)
+            (BENCH_HOME / name).mkdir()
+
+    def populate(self, table, rows):
+        self.execute(
+            f"CREATE TABLE `{table}` ("
+            "id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY, "
+            "user_id INT NOT NULL, "
+            "amount DECIMAL(12,2) NOT NULL, "
+            "note VARCHAR(255) NULL, "
+            "created_at DATETIME NOT NULL, "
+            "updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP, "
+            "KEY idx_user (user_id)"
+            ") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4", db=SOURCE_DB)
+        self.insert_rows(table, rows)
+
+    def insert_rows(self, table, rows, batch=5000):
+        cursor = self.admin.cursor()
+        try:
+            cursor.execute(f"USE `{SOURCE_DB}`")
+            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            for start in range(0, rows, batch):
+                cursor.executemany(
+                    f"INSERT INTO `{table}` (user_id, amount, note, created_at) VALUES (%s, %s, %s, %s)",
+                    [(self.rng.randint(1, 100000), round(self.rng.uniform(0, 10000), 2),
+                      self.rng.choice(self.notes), now) for _ in range(min(batch, rows - start))])
+        finally:
+            cursor.close()
+
+    def modify(self, table, rows):
+        """按比例更新、插入和删除行（删除比例应低于保护阈值）"""
+        def pick(rate):
+            return self.rng.sample(range(1, rows + 1), min(rows, int(rows * rate)))
+
+        updates = pick(self.change_rate)
+        for start in range(0, len(updates), 1000):
+            self.execute(f"UPDATE `{table}` SET amount = amount + 1, note = %s WHERE id IN %s",
+                         (self.rng.choice(self.notes), updates[start:start + 1000]), db=SOURCE_DB)
+        deletes = pick(self.delete_rate)
+        for start in range(0, len(deletes), 1000):
+            self.execute(f"DELETE FROM `{table}` WHERE id IN %s", (deletes[start:start + 1000],), db=SOURCE_DB)
+        self.insert_rows(table, int(rows * self.insert_rate))
+
+    def consistent(self, tables):
+        for table in tables:
+            checksums = [self.execute(f"CHECKSUM TABLE `{table}`", db=db)[0][1] for db in (SOURCE_DB, TARGET_DB)]
+            if checksums[0] != checksums[1]:
+                return False
+        return True
+
+    def timed(self, func, *args):
+        """计时执行，默认屏蔽被测代码的输出"""
+        start = time.time()
+        if self.verbose:
+            result = func(*args)
+        else:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                result = func(*args)
+        return result, round(time.time() - start, 3)
+
+    def sync_totals(self, sync):
+        stats = sync['table_stats'].values()
+        rows = sum(s.get('rows') or 0 for s in stats)
+        nbytes = sum(s.get('raw_bytes', s.get('bytes')) or 0 for s in stats)
+        return rows, nbytes
+
+    def run_scenario(self, table_count, rows):
+        self.reset()
+        tables = [f"bench_{i:03d}" for i in range(table_count)]
+        result = {'tables': table_count, 'rows_per_table': rows}
+
+        start = time.time()
+        for table in tables:
+            self.populate(table, rows)
+        result['populate_seconds'] = round(time.time() - start, 3)
+        time.sleep(SETTLE_SECONDS)
+
+        engine = SmartSyncEngine()
+        protector = SmartDataProtector()
+
+        changed, result['detect_cold_seconds'] = self.timed(engine.find_changed_tables)
+        sync, result['sync_full_seconds'] = self.timed(engine.sync_tables, changed)
+        rows_synced, bytes_synced = self.sync_totals(sync)
+        result.update(self.throughput('sync_full', rows_synced, bytes_synced, result['sync_full_seconds']))
+        result['sync_full_failed'] = len(sync['failed'])
+
+        _, result['baseline_seconds'] = self.timed(protector.create_baseline)
+        _, result['detect_idle_seconds'] = self.timed(engine.find_changed_tables)
+
+        modified = tables[:max(1, round(table_count * self.changed_tables))]
+        for table in modified:
+            self.modify(table, rows)
+        changed, result['detect_changed_seconds'] = self.timed(engine.find_changed_tables)
+        result['tables_modified'] = len(modified)
+        result['tables_detected'] = len(changed)
+        sync, result['sync_incremental_seconds'] = self.timed(engine.sync_tables, changed)
+        rows_synced, bytes_synced = self.sync_totals(sync)
+        result.update(self.throughput('sync_incremental', rows_synced, bytes_synced,
+                                      result['sync_incremental_seconds']))
+        result['sync_incremental_failed'] = len(sync['failed'])
+
+        delete_alerts, result['delete_check_seconds'] = self.timed(protector.check_delete_anomaly)
+        schema_alerts, result['schema_check_seconds'] = self.timed(protector.check_schema_change)
+        result['protection_alerts'] = len(delete_alerts) + len(schema_alerts)
+        result['consistent'] = self.consistent(tables)
+        return result
+
+    @staticmethod
+    def throughput(name, rows, nbytes, seconds):
+        seconds = max(seconds, 0.001)
+        return {f'{name}_rows': rows, f'{name}_bytes': nbytes,
+                f'{name}_rows_per_sec': round(rows / seconds, 1),
+                f'{name}_mb_per_sec': round(nbytes / 1024 / 1024 / seconds, 2)}
+
+    def run(self):
+        print("="*70)
+        print(f"⏱️  同步基准测试 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        print("="*70)
+        for db in (SOURCE_DB, TARGET_DB):
+            self.execute(f"DROP DATABASE IF EXISTS `{db}`")
+            self.execute(f"CREATE DATABASE `{db}` DEFAULT CHARSET utf8mb4")
+
+        report = {
+            'time': datetime.now().isoformat(),
+            'version': git_version(),
+            'mysql': self.execute("SELECT VERSION()")[0][0],
+            'config': {key: os.getenv(key) for key in CONFIG_KEYS if os.getenv(key) is not None},
+            'change_rate_percent': self.change_rate * 100,
+            'scenarios': [],
+        }
+        for table_count in self.table_counts:
+            for rows in self.sizes:
+                print(f"\n▶ {table_count} 个表 × {rows:,} 行 ...")
+                result = self.run_scenario(table_count, rows)
+                report['scenarios'].append(result)
+                print(f"  检测: 冷 {result['detect_cold_seconds']:.2f}s / 无变化 {result['detect_idle_seconds']:.2f}s"
+                      f" / 有变化 {result['detect_changed_seconds']:.2f}s"
+                      f" ({result['tables_detected']}/{result['tables_modified']} 个表)")
+                print(f"  全量同步: {result['sync_full_seconds']:.2f}s  {result['sync_full_rows_per_sec']:,.0f} 行/s"
+                      f"  {result['sync_full_mb_per_sec']:.1f} MB/s")
+                print(f"  增量同步: {result['sync_incremental_seconds']:.2f}s"
+                      f"  {result['sync_incremental_rows']:,} 行")
+                print(f"  保护检查: 删除 {result['delete_check_seconds']:.2f}s / 结构 {result['schema_check_seconds']:.2f}s"
+                      f"  基线 {result['baseline_seconds']:.2f}s  告警 {result['protection_alerts']}")
+                print(f"  {'✅ 两端一致' if result['consistent'] else '❌ 两端不一致'}")
+
+        output = Path(os.getenv('BENCH_OUTPUT', OUTPUT_DIR / f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json"))
+        output.parent.mkdir(parents=True, exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n{'='*70}")
+        print(f"📄 结果: {output}  (版本 {report['version']})")
+        print("="*70)
+        return all(s['consistent'] and not s['sync_full_failed'] and not s['sync_incremental_failed']
+                   for s in report['scenarios'])
+
+    def close(self):
+        self.admin.close()
+        shutil.rmtree(BENCH_HOME, ignore_errors=True)
+
+
+def compare(old_file, new_file):
+    """按场景逐项比较两次基准测试结果"""
+    with open(old_file) as f:
+        old = json.load(f)
+    with open(new_file) as f:
+        new = json.load(f)
+    print(f"旧: {old['version']} ({old['time'][:19]})  新: {new['version']} ({new['time'][:19]})")
+    old_scenarios = {(s['tables'], s['rows_per_table']): s for s in old['scenarios']}
+    for scenario in new['scenarios']:
+        key = (scenario['tables'], scenario['rows_per_table'])
+        before = old_scenarios.get(key)
+        print(f"\n▶ {key[0]} 个表 × {key[1]:,} 行")
+        if before is None:
+            print("  （旧结果中没有该场景）")
+            continue
+        for metric, value in scenario.items():
+            if not metric.endswith(('_seconds', '_per_sec')) or not before.get(metric):
+                continue
+            change = (value - before[metric]) / before[metric] * 100
+            better = change < 0 if metric.endswith(LOWER_IS_BETTER) else change > 0
+            mark = '  ' if abs(change) < 5 else ('✅' if better else '⚠️ ')
+            print(f"  {mark} {metric:<32} {before[metric]:>12,.2f} → {value:>12,.2f} ({change:+.1f}%)")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--compare':
+        if len(sys.argv) != 4:
+            print("用法: python3 benchmark.py --compare 旧.json 新.json")
+            sys.exit(1)
+        shutil.rmtree(BENCH_HOME, ignore_errors=True)
+        compare(sys.argv[2], sys.argv[3])
+        sys.exit(0)
+
+    if 'bench' not in SOURCE_DB or 'bench' not in TARGET_DB or SOURCE_DB == TARGET_DB:
+        print("❌ BENCH_SOURCE_DB / BENCH_TARGET_DB 必须是两个不同的、名称含 bench 的测试库（会被重建）")
+        sys.exit(1)
+
+    bench = Benchmark()
+    try:
+        ok = bench.run()
+    finally:
+        bench.close()
+    sys.exit(0 if ok else 1)
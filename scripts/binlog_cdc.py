@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Binlog实时同步（CDC）- 常驻进程，读取中间服务器的行事件并批量应用到Cloud SQL
+
+前提：中间服务器开启 log_slave_updates=1、binlog_format=ROW、binlog_row_image=FULL，
+复制过来的变更才会写入中间服务器自己的binlog。
+依赖：pip install mysql-replication
+
+位置保存在 cache/binlog_position.json，只在目标库事务提交后更新，
+重启后从该位置继续；提交与保存之间崩溃只会重放幂等的upsert/delete。
+首次启动没有位置时从最近一轮同步的一致性快照位置（cache/sync_snapshot.json）开始，
+快照之后的变更都会应用；没有快照位置时拒绝启动（应先执行一次全量同步 manage.sh sync），
+确实要从当前位置开始（之前的变更不补）可设置 CDC_START_FROM_CURRENT=1。
+
+每批应用期间持有与 safe_sync.sh / smart_sync 相同的 cache/sync.lock，同步进程整表重载或换表时
+CDC 等待，不会与之交错；常驻同步进程（sync_daemon.py）一直持有该锁，不能与 CDC 同时使用。
+
+源/目标库前缀可用 CDC_SOURCE_PREFIX / CDC_TARGET_PREFIX 指向本地测试库。
+
+没有主键的表按整行匹配修改和删除（每行 DELETE ... LIMIT 1），新增的行直接插入，
+重放时可能产生重复行，这类表建议定期执行 manage.sh sync。
+
+单批删除超过 CDC_DELETE_GUARD_ROWS 行时回滚并暂停，被拦截的区间（保存位置 → 批次结束位置）记在
+cache/binlog_guard.json。确认后恢复同步前需要决定如何处理这段 binlog，否则恢复后重放会再次拦截：
+  python3 binlog_cdc.py confirm   确认删除，放行这一段一次（只放行到拦截时的结束位置）
+  python3 binlog_cdc.py skip      跳过这一段（其中的其他变更也不应用，之后请执行 manage.sh sync）
+"""
+
+import fcntl
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dotenv import load_dotenv
+
+load_dotenv('/opt/mysql-sync/.env')
+
+# 部署目录，可用 SYNC_HOME 指向其他目录（本地测试/基准测试）
+SYNC_HOME = Path(os.getenv('SYNC_HOME', '/opt/mysql-sync'))
+
+from db_pool import connect_db
+from row_copy import quote_ident, build_upsert
+from alert_queue import send_alert
+from snapshot import binlog_position
+
+try:
+    from pymysqlreplication import BinLogStreamReader
+    from pymysqlreplication.event import XidEvent, QueryEvent, HeartbeatLogEvent
+    from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+except ImportError:
+    BinLogStreamReader = None
+
+
+class BinlogCDC:
+    def __init__(self):
+        self.cache_dir = SYNC_HOME / 'cache'
+        self.position_file = self.cache_dir / 'binlog_position.json'
+        self.guard_file = self.cache_dir / 'binlog_guard.json'
+        self.snapshot_file = self.cache_dir / 'sync_snapshot.json'
+        self.lock_file = self.cache_dir / 'sync.lock'
+        self.lock_fd = None
+        self.pause_file = SYNC_HOME / 'PAUSE_SYNC'
+
+        self.source = os.getenv('CDC_SOURCE_PREFIX', 'MIDDLE')
+        self.target = os.getenv('CDC_TARGET_PREFIX', 'CLOUD')
+        self.server_id = int(os.getenv('CDC_SERVER_ID', 1003))
+        self.batch_events = int(os.getenv('CDC_BATCH_EVENTS', 500))
+        self.batch_seconds = float(os.getenv('CDC_BATCH_SECONDS', 2))
+        # 单批删除行数超过此值时不提交、暂停同步，防止误删在保护检查之前被同步出去
+        self.delete_guard = int(os.getenv('CDC_DELETE_GUARD_ROWS', 1000))
+
+        self.target_conn = None
+        self.pending_events = 0
+        self.pending_deletes = {}
+        self.batch_started = None
+        self.guard = None
+        # 已提示过没有主键的表
+        self.keyless_tables = set()
+
+    def connect_db(self, prefix):
+        """从共享连接池获取连接"""
+        return connect_db(prefix)
+
+    def load_position(self):
+        """读取上次提交的binlog位置，没有则取最近一轮同步的快照位置"""
+        if self.position_file.exists():
+            with open(self.position_file, 'r') as f:
+                position = json.load(f)
+            return position['log_file'], position['log_pos']
+
+        if self.snapshot_file.exists():
+            with open(self.snapshot_file, 'r') as f:
+                snapshot = json.load(f)
+            binlog = snapshot.get('binlog')
+            if binlog:
+                print(f"  ℹ️  无已保存位置，从最近一轮同步的快照位置开始: {binlog['file']}:{binlog['position']}"
+                      f"（{snapshot.get('time', '时间未知')}）")
+                return binlog['file'], binlog['position']
+
+        if os.getenv('CDC_START_FROM_CURRENT', '').lower() not in ('1', 'true', 'yes'):
+            raise RuntimeError("没有已保存的位置，也没有同步快照位置（cache/sync_snapshot.json），"
+                               "请先执行一次全量同步（SYNC_SNAPSHOT=pass），或设置 CDC_START_FROM_CURRENT=1")
+        conn = self.connect_db(self.source)
+        cursor = conn.cursor()
+        try:
+            # MySQL 8.4 起只有 SHOW BINARY LOG STATUS
+            status = binlog_position(cursor)
+        finally:
+            cursor.close()
+            conn.close()
+        if status is None:
+            raise RuntimeError(f"{self.source} 未开启 binlog")
+        print(f"  ⚠️  CDC_START_FROM_CURRENT: 从当前位置开始，之前未同步的变更不会应用: "
+              f"{status['file']}:{status['position']}")
+        return status['file'], status['position']
+
+    def save_position(self, log_file, log_pos):
+        """保存binlog位置（先写临时文件再替换，避免写一半）"""
+        tmp = self.position_file.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'log_file': log_file, 'log_pos': log_pos,
+                       'updated': datetime.now().isoformat()}, f, indent=2)
+        tmp.replace(self.position_file)
+
+    def load_guard(self):
+        """上次被删除保护拦截的区间，没有返回 None"""
+        if self.guard_file.exists():
+            with open(self.guard_file, 'r') as f:
+                return json.load(f)
+        return None
+
+    def save_guard(self, guard):
+        with open(self.guard_file, 'w') as f:
+            json.dump(guard, f, indent=2)
+
+    def decide_guard(self, decision):
+        """confirm/skip 命令：记录对被拦截区间的处理方式"""
+        guard = self.load_guard()
+        if guard is None:
+            print("ℹ️  没有被删除保护拦截的 binlog 区间")
+            return False
+        end = guard['end']
+        if decision == 'skip':
+            # 直接把位置推进到区间结束，恢复后从之后继续
+            self.save_position(end[0], end[1])
+            self.guard_file.unlink()
+            print(f"⏭️  已跳过 {guard['start'][0]}:{guard['start'][1]} → {end[0]}:{end[1]}，"
+                  f"其中的变更未应用，请执行 manage.sh sync 补齐")
+        else:
+            guard['decision'] = 'apply'
+            guard['confirmed'] = datetime.now().isoformat()
+            self.save_guard(guard)
+            print(f"✅ 已确认，恢复同步后放行到 {end[0]}:{end[1]} 为止的删除（一次）")
+        print("   恢复同步: manage.sh resume")
+        return True
+
+    def guard_allowed(self, start):
+        """从已确认的拦截区间内开始的批次不再检查删除行数（这样的批次在区间结束处就会提交）"""
+        guard = self.guard
+        if not guard or guard.get('decision') != 'apply' or start is None:
+            return False
+        return tuple(start) < tuple(guard['end'])
+
+    def guard_reached(self, log_file, log_pos):
+        """重放已确认的区间时到达结束位置，需要在这里单独提交"""
+        return bool(self.guard and self.guard.get('decision') == 'apply'
+                    and (log_file, log_pos) >= tuple(self.guard['end']))
+
+    def lock_sync(self):
+        """批次开始时取得 sync.lock，同步进程运行中则等它结束"""
+        if self.lock_fd is not None:
+            return
+        fd = open(self.lock_file, 'a')
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print("  ⏳ 同步进程正在运行（sync.lock），等待其结束后再应用binlog")
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        self.lock_fd = fd
+
+    def unlock_sync(self):
+        if self.lock_fd is not None:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+            self.lock_fd.close()
+            self.lock_fd = None
+
+    def apply_event(self, event):
+        """把一个行事件转换成目标库语句（在未提交的事务中执行）"""
+        table = event.table
+        if table.startswith('_'):
+            return
+        self.lock_sync()
+
+        pk = self.row_key(event)
+        cursor = self.target_conn.cursor()
+        try:
+            if isinstance(event, WriteRowsEvent):
+                rows = [row['values'] for row in event.rows]
+                cursor.execute(build_upsert(self.target_conn, table, list(rows[0].keys()), rows))
+            elif isinstance(event, UpdateRowsEvent):
+                rows = [row['after_values'] for row in event.rows]
+                # 没有主键时按整行匹配，先删除修改前的行再插入修改后的行
+                moved = [row['before_values'] for row in event.rows
+                         if not pk or any(row['before_values'][k] != row['after_values'][k] for k in pk)]
+                if moved:
+                    self.delete_rows(cursor, table, pk, moved)
+                cursor.execute(build_upsert(self.target_conn, table, list(rows[0].keys()), rows))
+            elif isinstance(event, DeleteRowsEvent):
+                rows = [row['values'] for row in event.rows]
+                self.delete_rows(cursor, table, pk, rows)
+                self.pending_deletes[table] = self.pending_deletes.get(table, 0) + len(rows)
+        finally:
+            cursor.close()
+
+        self.pending_events += 1
+        if self.batch_started is None:
+            self.batch_started = time.time()
+
+    def row_key(self, event):
+        """行事件的主键列；没有主键的表返回空列表（第一次遇到时提示）"""
+        pk = event.primary_key
+        if isinstance(pk, (list, tuple)):
+            pk = [k for k in pk if k]
+        else:
+            pk = [pk] if pk else []
+        if not pk and event.table not in self.keyless_tables:
+            self.keyless_tables.add(event.table)
+            print(f"  ⚠️  {event.table} 没有主键，修改和删除按整行匹配")
+        return pk
+
+    def delete_rows(self, cursor, table, pk, rows):
+        """按主键批量删除；没有主键时按整行逐行删除（NULL 用 <=> 比较，重复行只删一行）"""
+        if not pk:
+            for row in rows:
+                where = ' AND '.join(f"{quote_ident(c)} <=> %s" for c in row)
+                cursor.execute(f"DELETE FROM {quote_ident(table)} WHERE {where} LIMIT 1", tuple(row.values()))
+            return
+        cols = ', '.join(quote_ident(k) for k in pk)
+        keys = ', '.join(self.target_conn.escape(tuple(row[k] for k in pk)) for row in rows)
+        cursor.execute(f"DELETE FROM {quote_ident(table)} WHERE ({cols}) IN ({keys})")
+
+    def should_flush(self):
+        if not self.pending_events:
+            return False
+        return (self.pending_events >= self.batch_events
+                or time.time() - self.batch_started >= self.batch_seconds)
+
+    def flush(self, log_file, log_pos, start=None):
+        """提交目标库事务，成功后保存位置；触发删除保护时回滚并暂停（start 为本批开始的位置）"""
+        suspicious = {t: n for t, n in self.pending_deletes.items() if n > self.delete_guard}
+        if suspicious and self.guard_allowed(start):
+            print(f"  ⚠️  放行已确认的批量删除: {', '.join(f'{t} {n:,} 行' for t, n in suspicious.items())}")
+        elif suspicious:
+            self.target_conn.rollback()
+            alerts = [{'type': 'CDC_MASSIVE_DELETE', 'severity': 'CRITICAL', 'table': t, 'rows': n}
+                      for t, n in suspicious.items()]
+            guard = {'start': list(start) if start else None, 'end': [log_file, log_pos],
+                     'tables': suspicious, 'time': datetime.now().isoformat()}
+            self.save_guard(guard)
+            with open(self.pause_file, 'w') as f:
+                json.dump({'reason': 'CDC mass delete guard', 'alerts': alerts,
+                           'binlog': f'{log_file}:{log_pos}', 'guard': guard,
+                           'resolve': 'python3 binlog_cdc.py confirm|skip, 然后 manage.sh resume'}, f, indent=2)
+            msg = "CDC检测到批量删除，未应用并已暂停同步:\n"
+            msg += ''.join(f"- {t}: {n:,} 行\n" for t, n in suspicious.items())
+            msg += "确认后执行 binlog_cdc.py confirm（放行）或 skip（跳过），再恢复同步\n"
+            print(f"  🚨 {msg}")
+            send_alert(msg, 'CRITICAL', alerts)
+            self.reset_batch()
+            return False
+
+        self.target_conn.commit()
+        self.save_position(log_file, log_pos)
+        if self.guard_reached(log_file, log_pos):
+            # 已确认的区间只放行一次
+            self.guard_file.unlink(missing_ok=True)
+            self.guard = None
+        print(f"  ✓ {datetime.now().strftime('%H:%M:%S')} 提交 {self.pending_events} 个事件 → {log_file}:{log_pos}")
+        self.reset_batch()
+        return True
+
+    def reset_batch(self):
+        self.pending_events = 0
+        self.pending_deletes = {}
+        self.batch_started = None
+        self.unlock_sync()
+
+    def stream_once(self):
+        """从保存的位置读取直到暂停或出错；正常返回表示需要等待后重连"""
+        log_file, log_pos = self.load_position()
+        self.guard = self.load_guard()
+        if self.guard and self.guard.get('decision') != 'apply':
+            print(f"  ⚠️  上次拦截的区间未处理（binlog_cdc.py confirm|skip），重放时会再次拦截")
+        batch_start = (log_file, log_pos)
+        settings = {
+            'host': os.getenv(f'{self.source}_HOST'),
+            'port': int(os.getenv(f'{self.source}_PORT', 3306)),
+            'user': os.getenv(f'{self.source}_USER'),
+            'passwd': os.getenv(f'{self.source}_PASS'),
+        }
+        stream = BinLogStreamReader(
+            connection_settings=settings,
+            server_id=self.server_id,
+            resume_stream=True,
+            log_file=log_file,
+            log_pos=log_pos,
+            blocking=True,
+            slave_heartbeat=self.batch_seconds,
+            only_schemas=[os.getenv(f'{self.source}_DB')],
+            only_events=[WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent,
+                         XidEvent, QueryEvent, HeartbeatLogEvent]
+        )
+        self.target_conn = self.connect_db(self.target)
+        print(f"▶️  从 {log_file}:{log_pos} 开始读取 ({self.source} → {self.target})")
+
+        try:
+            for event in stream:
+                if self.pause_file.exists():
+                    # 未提交的事件全部丢弃，恢复后从已保存位置重放
+                    self.target_conn.rollback()
+                    self.reset_batch()
+                    print("🚫 同步已暂停（数据保护告警），停止应用binlog")
+                    return
+
+                if isinstance(event, (WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent)):
+                    self.apply_event(event)
+                elif isinstance(event, QueryEvent):
+                    query = event.query.strip().upper()
+                    if query not in ('BEGIN', 'COMMIT'):
+                        print(f"  ⚠️  DDL不会自动应用，请执行 manage.sh sync: {event.query[:100]}")
+
+                # 只在事务边界提交，保证保存的位置不落在事务中间；
+                # 已确认的拦截区间在其结束位置单独提交，之后的批次照常检查
+                if isinstance(event, (XidEvent, HeartbeatLogEvent)) and self.pending_events and (
+                        self.should_flush() or self.guard_reached(stream.log_file, stream.log_pos)):
+                    if not self.flush(stream.log_file, stream.log_pos, batch_start):
+                        return
+                    batch_start = (stream.log_file, stream.log_pos)
+        finally:
+            stream.close()
+            self.target_conn.close()
+
+    def run(self):
+        """常驻运行，出错后等待重连"""
+        if BinLogStreamReader is None:
+            print("❌ 缺少依赖: pip install mysql-replication")
+            return False
+
+        print("="*70)
+        print(f"📡 Binlog实时同步 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        print("="*70)
+
+        while True:
+            if self.pause_file.exists():
+                time.sleep(10)
+                continue
+            try:
+                self.stream_once()
+            except KeyboardInterrupt:
+                print("\n⏹️  已停止")
+                return True
+            except Exception as e:
+                print(f"  ⚠️  {e}，10秒后重连")
+                self.reset_batch()
+            time.sleep(10)
+
+if __name__ == '__main__':
+    cdc = BinlogCDC()
+    if len(sys.argv) > 1 and sys.argv[1] in ('confirm', 'skip'):
+        result = cdc.decide_guard(sys.argv[1])
+    else:
+        result = cdc.run()
+    sys.exit(0 if result else 1)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LOAD DATA 批量导入 - SYNC_PIPELINE=loaddata 时全量同步的写入方式
+
+MIDDLE 的行转成制表符分隔的文本（NULL 为 \\N，反斜杠/制表符/换行等转义），每 SYNC_LOAD_BATCH_BYTES
+字节一批，通过临时目录中的命名管道（FIFO，不落盘）交给目标库的 LOAD DATA LOCAL INFILE。
+每批一条语句、一次提交，并行区间、断点续传和多目标分发与 INSERT 方式相同。
+目标库需要开启 local_infile；写入连接单独开启客户端的 local_infile，连接池中的连接不开启。
+LOCAL 导入时数据错误只产生警告，每批检查导入行数和警告，有问题即按失败处理（回退 mysqldump）。
+BIT 和空间类型列的文本形式不能直接导入，含这些列的表仍用多行 INSERT。
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+
+from row_copy import quote_ident
+
+# 不能按文本导入的列类型
+UNSUPPORTED_TYPES = {'bit', 'geometry', 'point', 'linestring', 'polygon', 'multipoint',
+                     'multilinestring', 'multipolygon', 'geometrycollection', 'geomcollection'}
+
+ESCAPES = ((b'\\', b'\\\\'), (b'\0', b'\\0'), (b'\t', b'\\t'), (b'\n', b'\\n'), (b'\r', b'\\r'))
+
+
+def bulk_supported(cursor, table):
+    """表的所有列都能按文本导入"""
+    cursor.execute("SELECT DATA_TYPE FROM information_schema.COLUMNS "
+                   "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", (table,))
+    return not any(row['DATA_TYPE'] in UNSUPPORTED_TYPES for row in cursor.fetchall())
+
+
+def format_time(delta):
+    """TIME 列（PyMySQL 返回 timedelta）转成 [-]H:MM:SS[.ffffff]，小时可超过 24"""
+    sign = '-' if delta < timedelta(0) else ''
+    delta = abs(delta)
+    hours, rest = divmod(delta.days * 86400 + delta.seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    text = f"{sign}{hours}:{minutes:02d}:{seconds:02d}"
+    if delta.microseconds:
+        text += f".{delta.microseconds:06d}"
+    return text
+
+
+def tsv_field(value):
+    """单个值转成 LOAD DATA 默认格式的字段"""
+    if value is None:
+        return b'\\N'
+    if isinstance(value, (bytes, bytearray)):
+        data = bytes(value)
+    elif isinstance(value, str):
+        data = value.encode(errors='surrogateescape')
+    elif isinstance(value, timedelta):
+        data = format_time(value).encode()
+    elif isinstance(value, float):
+        data = repr(value).encode()
+    else:
+        data = str(value).encode()
+    for char, escaped in ESCAPES:
+        if char in data:
+            data = data.replace(char, escaped)
+    return data
+
+
+def iter_tsv_batches(cursor, batch_bytes):
+    """把游标中的行转成 (文本, 行数) 批次，单批不超过 batch_bytes"""
+    lines, size = [], 0
+    for row in cursor:
+        line = b'\t'.join(tsv_field(value) for value in row) + b'\n'
+        lines.append(line)
+        size += len(line)
+        if size >= batch_bytes:
+            yield b''.join(lines), len(lines)
+            lines, size = [], 0
+    if lines:
+        yield b''.join(lines), len(lines)
+
+
+def feed(path, data):
+    """打开命名管道的写端写入一批数据（LOAD DATA 打开读端后才会返回）"""
+    try:
+        with open(path, 'wb') as pipe:
+            pipe.write(data)
+    except OSError:
+        # LOAD DATA 中途失败，读端已关闭
+        pass
+
+
+def release(path, feeder):
+    """LOAD DATA 没有读完管道（如语句被拒绝）时，自己打开读端读空，让写入线程退出"""
+    if feeder.is_alive():
+        fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        try:
+            while feeder.is_alive():
+                try:
+                    if not os.read(fd, 1024 * 1024):
+                        feeder.join(0.05)
+                except BlockingIOError:
+                    feeder.join(0.05)
+        finally:
+            os.close(fd)
+    feeder.join()
+
+
+def load_data(target_table, columns, data, rows):
+    """返回写入线程执行的操作：把一批文本通过命名管道 LOAD DATA 到 target_table 并提交"""
+    cols = ', '.join(quote_ident(c) for c in columns)
+
+    def op(conn, target):
+        workdir = tempfile.mkdtemp(prefix='sync_load_')
+        path = os.path.join(workdir, 'rows.tsv')
+        os.mkfifo(path, 0o600)
+        feeder = threading.Thread(target=feed, args=(path, data), daemon=True)
+        feeder.start()
+        cursor = conn.cursor()
+        try:
+            # 与 mysqldump --replace 相同，已存在的主键整行替换
+            cursor.execute(
+                f"LOAD DATA LOCAL INFILE {conn.escape(path)} REPLACE INTO TABLE {quote_ident(target_table)} "
+                f"CHARACTER SET utf8mb4 FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' "
+                f"LINES TERMINATED BY '\\n' ({cols})")
+            loaded = cursor.rowcount
+            cursor.execute("SHOW WARNINGS LIMIT 1")
+            warning = cursor.fetchone()
+            if warning:
+                raise RuntimeError(f"LOAD DATA 警告: {warning['Message']}")
+            # REPLACE 替换的行计 2，少于本批行数说明有行被跳过
+            if loaded < rows:
+                raise RuntimeError(f"LOAD DATA 只导入了 {loaded}/{rows} 行")
+        finally:
+            cursor.close()
+            release(path, feeder)
+            shutil.rmtree(workdir, ignore_errors=True)
+        conn.commit()
+
+    return op
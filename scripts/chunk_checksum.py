@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分块校验和 - 按主键区间计算摘要，只同步摘要变化的区间
+
+索引保存在 cache/chunk_checksums.json，记录的是Cloud SQL上一次同步后的状态：
+  {table: {'pk', 'chunk_size', 'columns', 'root', 'chunks': {块号: "行数:摘要"}}}
+root 是所有块摘要的哈希，root相同即整表无变化。
+只支持单列整数主键的表，其余表回退全量同步。
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+from row_copy import quote_ident, get_primary_key, upsert_rows
+
+INT_TYPES = {'int', 'bigint', 'mediumint', 'smallint', 'tinyint'}
+
+
+def get_columns(cursor, table):
+    """按顺序返回表的列名"""
+    cursor.execute(
+        "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s ORDER BY ORDINAL_POSITION",
+        (table,)
+    )
+    return [row['COLUMN_NAME'] for row in cursor.fetchall()]
+
+
+def get_int_pk(cursor, table):
+    """单列整数主键返回列名，否则返回None"""
+    pk = get_primary_key(cursor, table)
+    if len(pk) != 1:
+        return None
+    cursor.execute(
+        "SELECT DATA_TYPE FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+        (table, pk[0])
+    )
+    row = cursor.fetchone()
+    return pk[0] if row and row['DATA_TYPE'] in INT_TYPES else None
+
+
+def row_hash_sql(columns):
+    """单行64位哈希表达式（NULL和空串通过ISNULL区分）"""
+    parts = ', '.join(f"{quote_ident(c)}, ISNULL({quote_ident(c)})" for c in columns)
+    return f"CAST(CONV(SUBSTRING(MD5(CONCAT_WS('#', {parts})), 1, 16), 16, 10) AS UNSIGNED)"
+
+
+def chunk_digests(cursor, table, pk, columns, chunk_size):
+    """一次扫描返回每个主键区间的 "行数:摘要" """
+    cursor.execute(
+        f"SELECT FLOOR({quote_ident(pk)} / {int(chunk_size)}) AS chunk, COUNT(*) AS cnt, "
+        f"BIT_XOR({row_hash_sql(columns)}) AS digest "
+        f"FROM {quote_ident(table)} GROUP BY chunk"
+    )
+    return {str(int(row['chunk'])): f"{row['cnt']}:{row['digest']}" for row in cursor.fetchall()}
+
+
+def range_digest(cursor, table, pk, columns, lo, hi):
+    """单个区间 [lo, hi) 的 "行数:摘要" """
+    cursor.execute(
+        f"SELECT COUNT(*) AS cnt, COALESCE(BIT_XOR({row_hash_sql(columns)}), 0) AS digest "
+        f"FROM {quote_ident(table)} WHERE {quote_ident(pk)} >= %s AND {quote_ident(pk)} < %s",
+        (lo, hi)
+    )
+    row = cursor.fetchone()
+    return f"{row['cnt']}:{row['digest']}"
+
+
+def root_digest(chunks):
+    """所有块摘要的根哈希"""
+    payload = json.dumps(sorted(chunks.items()))
+    return hashlib.md5(payload.encode()).hexdigest()
+
+
+def copy_range(src_conn, dst_conn, table, pk, lo, hi, batch_rows=5000):
+    """用源库 [lo, hi) 区间的行替换目标库同一区间，返回复制行数"""
+    src = src_conn.cursor()
+    dst = dst_conn.cursor()
+    total = 0
+    try:
+        dst.execute(
+            f"DELETE FROM {quote_ident(table)} WHERE {quote_ident(pk)} >= %s AND {quote_ident(pk)} < %s",
+            (lo, hi)
+        )
+        last = lo - 1
+        while True:
+            src.execute(
+                f"SELECT * FROM {quote_ident(table)} WHERE {quote_ident(pk)} > %s AND {quote_ident(pk)} < %s "
+                f"ORDER BY {quote_ident(pk)} LIMIT {int(batch_rows)}",
+                (last, hi)
+            )
+            rows = src.fetchall()
+            if not rows:
+                break
+            # 删除随第一批upsert一起提交；中途失败时该块摘要不更新，下次整块重传
+            total += upsert_rows(dst_conn, table, list(rows[0].keys()), rows)
+            last = rows[-1][pk]
+        dst_conn.commit()
+    except Exception:
+        dst_conn.rollback()
+        raise
+    finally:
+        src.close()
+        dst.close()
+    return total
+
+
+class ChunkSyncer:
+    def __init__(self, engine, target=None):
+        """target 为同步目标（sync_targets.SyncTarget），默认 CLOUD；非主目标的状态存在带后缀的文件中"""
+        self.engine = engine
+        self.target = target.name if target else 'CLOUD'
+        self.primary = target.primary if target else True
+        self.label = target.label if target else ''
+        self.index_file = engine.cache_dir / f'chunk_checksums{target.suffix if target else ""}.json'
+        self.chunk_size = int(os.getenv('CHUNK_SIZE', 10000))
+        self.lock = threading.Lock()
+        self.load_index()
+
+    def load_index(self):
+        """加载分块索引"""
+        if self.index_file.exists():
+            with open(self.index_file, 'r') as f:
+                self.index = json.load(f)
+        else:
+            self.index = {}
+
+    def save_index(self):
+        """保存分块索引"""
+        with self.lock:
+            with open(self.index_file, 'w') as f:
+                json.dump(self.index, f, indent=2)
+
+    def build_entry(self, cursor, table):
+        """计算表的当前分块摘要，不支持的表返回None"""
+        pk = get_int_pk(cursor, table)
+        if pk is None:
+            return None
+        columns = get_columns(cursor, table)
+        chunks = chunk_digests(cursor, table, pk, columns, self.chunk_size)
+        return {'pk': pk, 'chunk_size': self.chunk_size, 'columns': columns,
+                'root': root_digest(chunks), 'chunks': chunks}
+
+    def begin_full(self, table):
+        """全量同步前计算摘要，同步成功后作为Cloud SQL的状态"""
+        conn = self.engine.read_conn(table)
+        cursor = conn.cursor()
+        try:
+            return self.build_entry(cursor, table)
+        except Exception as e:
+            self.engine.log(f"  ⚠️  {table}: 计算分块摘要失败: {e}")
+            return None
+        finally:
+            cursor.close()
+            conn.close()
+
+    def finish_full(self, table, entry):
+        """全量同步成功后保存分块索引"""
+        with self.lock:
+            if entry is None:
+                self.index.pop(table, None)
+            else:
+                self.index[table] = entry
+        self.save_index()
+
+    def sync_table(self, table):
+        """只同步摘要变化的区间；返回 None 表示需要走全量同步"""
+        old = self.index.get(table)
+        if not old or old['chunk_size'] != self.chunk_size:
+            return None
+
+        middle = self.engine.read_conn(table)
+        cloud = self.engine.connect_db(self.target)
+        cursor = middle.cursor()
+        try:
+            new = self.build_entry(cursor, table)
+            if new is None or new['pk'] != old['pk'] or new['columns'] != old['columns']:
+                return None
+
+            changed = sorted(
+                (int(c) for c in set(old['chunks']) | set(new['chunks'])
+                 if old['chunks'].get(c) != new['chunks'].get(c))
+            )
+            rows = 0
+            for chunk in changed:
+                lo = chunk * self.chunk_size
+                rows += copy_range(middle, cloud, table, new['pk'], lo, lo + self.chunk_size)
+                # 每完成一个块就记录，失败时已完成的块不会重复传输
+                with self.lock:
+                    entry = self.index[table]
+                    if str(chunk) in new['chunks']:
+                        entry['chunks'][str(chunk)] = new['chunks'][str(chunk)]
+                    else:
+                        entry['chunks'].pop(str(chunk), None)
+
+            with self.lock:
+                self.index[table] = new
+            if self.primary:
+                self.engine.table_stats[table] = {'rows': rows, 'chunks_changed': len(changed),
+                                                  'chunks_total': max(1, len(new['chunks']))}
+            self.engine.log(f"  同步表: {table}{self.label} ✅ 分块 {len(changed)}/{len(new['chunks'])} 块, {rows:,} 行")
+            return True
+        except Exception as e:
+            self.engine.log(f"  同步表: {table}{self.label} ❌ 分块同步失败: {e}")
+            return False
+        finally:
+            self.save_index()
+            cursor.close()
+            middle.close()
+            cloud.close()
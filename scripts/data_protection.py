@@ -4,55 +4,47 @@
 智能数据保护 - 白名单模式 - 防重复告警
 """
 
-import pymysql
 import json
-import hashlib
 from datetime import datetime
 from pathlib import Path
 import sys
 import os
-import subprocess
+import time
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from dotenv import load_dotenv
 
 load_dotenv('/opt/mysql-sync/.env')
 
+# 部署目录，可用 SYNC_HOME 指向其他目录（本地测试/基准测试）
+SYNC_HOME = Path(os.getenv('SYNC_HOME', '/opt/mysql-sync'))
+
+from alert_queue import send_alert
+from db_pool import connect_db
+from row_counter import RowCounter
+from schema_fingerprint import fetch_schemas, schema_fingerprint, diff_schema, legacy_fingerprint, LEGACY_KEYS
+from table_metadata import fetch_table_metadata
+import sync_metrics
+
 # 允许结构变更的表
 ALLOWED_SCHEMA_CHANGE_TABLES = {'quota_data', 'tokens', 'users'}
 # 关键表
 CRITICAL_TABLES = {'redemptions', 'top_ups'}
-
-def send_alert(message, severity='CRITICAL'):
-    """发送邮件告警"""
-    try:
-        subprocess.run(
-            ['python3', '/opt/mysql-sync/scripts/alert_email.py', message, severity],
-            timeout=30, check=False
-        )
-        print("  📧 邮件告警已发送")
-    except Exception as e:
-        print(f"  ⚠️  邮件发送失败: {e}")
+# 本检查写入 PAUSE_SYNC 的 reason，只有这个原因的暂停会在检查通过后自动恢复
+PAUSE_REASON = 'Critical data protection alert'
 
 class SmartDataProtector:
     def __init__(self):
-        self.cache_dir = Path('/opt/mysql-sync/cache')
+        self.cache_dir = SYNC_HOME / 'cache'
         self.cache_dir.mkdir(exist_ok=True)
         self.baseline_file = self.cache_dir / 'baseline.json'
         self.alert_file = self.cache_dir / 'alerts.json'
-        self.pause_file = Path('/opt/mysql-sync/PAUSE_SYNC') # 新增：暂停文件路径
+        self.pause_file = SYNC_HOME / 'PAUSE_SYNC' # 新增：暂停文件路径
+        self.counter = RowCounter(self.cache_dir)
         self.load_baseline()
         
     def connect_db(self, prefix='MIDDLE'):
-        return pymysql.connect(
-            host=os.getenv(f'{prefix}_HOST'),
-            port=int(os.getenv(f'{prefix}_PORT', 3306)),
-            user=os.getenv(f'{prefix}_USER'),
-            password=os.getenv(f'{prefix}_PASS'),
-            database=os.getenv(f'{prefix}_DB'),
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor
-        )
+        return connect_db(prefix)
     
     def load_baseline(self):
         if self.baseline_file.exists():
@@ -76,89 +68,139 @@ class SmartDataProtector:
         print("📸 创建数据基线快照...")
         conn = self.connect_db('MIDDLE')
         cursor = conn.cursor()
-        cursor.execute("SHOW TABLES")
-        tables = [list(row.values())[0] for row in cursor.fetchall()]
-        for table in tables:
+        schemas = fetch_schemas(cursor)
+        metadata = fetch_table_metadata(cursor)
+        for table in sorted(schemas):
             if table.startswith('_'): continue
             try:
-                cursor.execute(f"SHOW CREATE TABLE `{table}`")
-                schema_hash = hashlib.md5(str(cursor.fetchone()).encode()).hexdigest()
-                self.baseline['table_schemas'][table] = schema_hash
-                cursor.execute(f"SELECT COUNT(*) as cnt FROM `{table}`")
-                self.baseline['row_counts'][table] = cursor.fetchone()['cnt']
+                self.baseline['table_schemas'][table] = self.schema_entry(schemas[table])
+                self.baseline['row_counts'][table] = self.counter.exact_count(cursor, table)
+                # 记为精确样本并校准 TABLE_ROWS，之后每次检查都有估算值兜底
+                self.counter.record(table, self.baseline['row_counts'][table], 'exact', metadata.get(table))
                 print(f"  ✓ {table}: {self.baseline['row_counts'][table]:,} rows")
             except Exception as e: print(f"  ✗ {table}: {e}")
         cursor.close()
         conn.close()
+        self.counter.save()
         self.save_baseline()
         print("\n✅ 基线已保存")
 
-    def check_delete_anomaly(self):
+    def check_delete_anomaly(self, metadata=None):
         print("\n🔍 检查数据删除异常...")
         conn = self.connect_db('MIDDLE')
         cursor = conn.cursor()
         alerts = []
         delete_threshold = float(os.getenv('DELETE_THRESHOLD_PERCENT', 10))
+        # 删除速率：窗口内下降超过该比例同样视为严重问题
+        rate_threshold = float(os.getenv('DELETE_RATE_THRESHOLD_PERCENT', 5))
+        rate_window = float(os.getenv('DELETE_RATE_WINDOW_MINUTES', 30)) * 60
+        if metadata is None:
+            metadata = fetch_table_metadata(cursor)
         for table, baseline_count in self.baseline.get('row_counts', {}).items():
             try:
-                cursor.execute(f"SELECT COUNT(*) as cnt FROM `{table}`")
-                current_count = cursor.fetchone()['cnt']
+                recent_count, recent_age = self.counter.reference_count(table, rate_window)
+                current_count, method = self.counter.count(
+                    cursor, table, metadata.get(table),
+                    [(baseline_count, delete_threshold), (recent_count, rate_threshold)])
+                self.counter.record(table, current_count, method, metadata.get(table))
                 if baseline_count > 0:
                     decrease_percent = ((baseline_count - current_count) / baseline_count) * 100
                     if decrease_percent > delete_threshold:
                         alerts.append({'type': 'MASSIVE_DELETE', 'severity': 'CRITICAL', 'table': table})
                         print(f"  🚨 {table}: {baseline_count:,} → {current_count:,} (-{decrease_percent:.1f}%)")
-                    else:
-                        print(f"  ✓ {table}: {current_count:,} rows")
+                        continue
+                if recent_count:
+                    rate_percent = ((recent_count - current_count) / recent_count) * 100
+                    if rate_percent > rate_threshold:
+                        alerts.append({'type': 'RAPID_DELETE', 'severity': 'CRITICAL', 'table': table})
+                        print(f"  🚨 {table}: {recent_age / 60:.0f}分钟内 {recent_count:,} → {current_count:,} (-{rate_percent:.1f}%)")
+                        continue
+                print(f"  ✓ {table}: {current_count:,} rows ({method})")
             except Exception as e: print(f"  ⚠️  {table}: {e}")
         cursor.close()
         conn.close()
+        self.counter.save()
         return alerts
 
-    def check_schema_change(self):
+    def schema_entry(self, schema):
+        """基线中保存的结构：指纹 + 规范化结构（用于给出具体差异）"""
+        return {'fingerprint': schema_fingerprint(schema), 'schema': schema}
+
+    def check_schema_change(self, metadata=None):
         print("\n🔍 检查表结构变更（智能模式）...")
         conn = self.connect_db('MIDDLE')
         cursor = conn.cursor()
         alerts = []
         try:
-            cursor.execute("SHOW TABLES")
-            current_tables = {list(row.values())[0] for row in cursor.fetchall()}
+            schemas = fetch_schemas(cursor)
+            current_tables = set(metadata) if metadata is not None else set(schemas)
             baseline_tables = set(self.baseline.get('table_schemas', {}).keys())
             dropped_tables = baseline_tables - current_tables
             if dropped_tables:
                 alerts.append({'type': 'TABLE_DROPPED', 'severity': 'CRITICAL', 'tables': list(dropped_tables)})
                 print(f"  🚨 表被删除: {dropped_tables}")
             
-            for table in current_tables:
-                if table.startswith('_') or table not in baseline_tables: continue
-                cursor.execute(f"SHOW CREATE TABLE `{table}`")
-                current_hash = hashlib.md5(str(cursor.fetchone()).encode()).hexdigest()
-                baseline_hash = self.baseline['table_schemas'][table]
-                if current_hash != baseline_hash:
-                    if table in ALLOWED_SCHEMA_CHANGE_TABLES:
-                        print(f"  ℹ️  {table}: 结构已变更（允许，自动更新）")
-                        self.baseline['table_schemas'][table] = current_hash
-                    elif table in CRITICAL_TABLES:
-                        alerts.append({'type': 'CRITICAL_TABLE_SCHEMA_CHANGED', 'severity': 'CRITICAL', 'table': table})
-                        print(f"  🚨🚨 {table}: 关键表结构被修改！")
-                    else:
-                        alerts.append({'type': 'SCHEMA_CHANGED', 'severity': 'HIGH', 'table': table})
-                        print(f"  🚨 {table}: 结构已变更")
-                else:
+            for table in sorted(current_tables):
+                if table.startswith('_') or table not in baseline_tables or table not in schemas: continue
+                current = self.schema_entry(schemas[table])
+                baseline = self.baseline['table_schemas'][table]
+                if not isinstance(baseline, dict):
+                    # 旧版基线只有 SHOW CREATE TABLE 的哈希（含 AUTO_INCREMENT，无法比较），直接转换为新格式
+                    print(f"  ℹ️  {table}: 旧版结构基线，已转换")
+                    self.baseline['table_schemas'][table] = current
+                    continue
+                if current['fingerprint'] == baseline['fingerprint']:
                     print(f"  ✓ {table}: 结构正常")
+                    continue
+                if (set(baseline['schema']) <= set(LEGACY_KEYS)
+                        and legacy_fingerprint(current['schema']) == baseline['fingerprint']):
+                    # 旧版基线没有外键/约束/分区，其余部分未变时补全基线
+                    print(f"  ℹ️  {table}: 结构基线已补充外键/约束/分区")
+                    self.baseline['table_schemas'][table] = current
+                    continue
+                changes = diff_schema(baseline['schema'], current['schema'])
+                if table in ALLOWED_SCHEMA_CHANGE_TABLES:
+                    print(f"  ℹ️  {table}: 结构已变更（允许，自动更新）")
+                    self.baseline['table_schemas'][table] = current
+                elif table in CRITICAL_TABLES:
+                    alerts.append({'type': 'CRITICAL_TABLE_SCHEMA_CHANGED', 'severity': 'CRITICAL', 'table': table,
+                                   'changes': changes})
+                    print(f"  🚨🚨 {table}: 关键表结构被修改！")
+                else:
+                    alerts.append({'type': 'SCHEMA_CHANGED', 'severity': 'HIGH', 'table': table, 'changes': changes})
+                    print(f"  🚨 {table}: 结构已变更")
+                for change in changes:
+                    print(f"      · {change}")
         except Exception as e: print(f"  ⚠️  {e}")
         finally:
             cursor.close()
             conn.close()
         return alerts
 
-    def run_full_check(self):
+    def record_metrics(self, check_seconds, critical_count):
+        """记录复制延迟和检查耗时，失败不影响检查"""
+        try:
+            conn = self.connect_db('MIDDLE')
+            cursor = conn.cursor()
+            try:
+                replication = sync_metrics.replication_status(cursor)
+            finally:
+                cursor.close()
+                conn.close()
+            sync_metrics.record_protection(replication, check_seconds, critical_count,
+                                           self.pause_file.exists())
+        except Exception as e:
+            print(f"  ⚠️  写入指标失败: {e}")
+
+    def run_full_check(self, metadata=None):
         print("="*70)
         print(f"🛡️  智能数据保护检查 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         print("="*70)
         
-        all_alerts = self.check_delete_anomaly() + self.check_schema_change()
+        start = time.time()
+        all_alerts = self.check_delete_anomaly(metadata) + self.check_schema_change(metadata)
         critical_alerts = [a for a in all_alerts if a.get('severity') == 'CRITICAL']
+        self.record_metrics(time.time() - start, len(critical_alerts))
         
         # 核心逻辑修改：如果已暂停，则不重复发送告警
         if self.pause_file.exists() and critical_alerts:
@@ -168,23 +210,38 @@ class SmartDataProtector:
         if critical_alerts:
             print(f"\n🚨 发现 {len(critical_alerts)} 个严重问题，暂停同步并发送告警。")
             with open(self.pause_file, 'w') as f:
-                report = {'reason': 'Critical data protection alert', 'alerts': critical_alerts}
+                report = {'reason': PAUSE_REASON, 'alerts': critical_alerts}
                 json.dump(report, f, indent=2)
             
             alert_msg = f"检测到 {len(critical_alerts)} 个严重问题，同步已暂停:\n"
             for alert in critical_alerts:
                 alert_msg += f"- {alert['type']}: {alert.get('table', alert.get('tables', 'N/A'))}\n"
+                alert_msg += ''.join(f"    · {change}\n" for change in alert.get('changes', []))
             
-            send_alert(alert_msg, 'CRITICAL')
+            send_alert(alert_msg, 'CRITICAL', critical_alerts)
             return False
         else:
             print("\n✅ 所有检查通过")
-            if self.pause_file.exists():
-                self.pause_file.unlink() # 如果之前是暂停的，现在问题解决了就自动恢复
+            reason = self.pause_reason()
+            if reason == PAUSE_REASON:
+                self.pause_file.unlink() # 如果之前是本检查暂停的，现在问题解决了就自动恢复
                 send_alert("✅ 数据保护问题已解决，同步已自动恢复。", "INFO")
+            elif reason is not None:
+                # CDC 批量删除保护、手动暂停等由各自的命令解除（binlog_cdc.py confirm|skip、manage.sh resume）
+                print(f"🚫 同步仍暂停（{reason}），不是数据保护检查设置的，不自动恢复")
             self.save_baseline()
             return True
 
+    def pause_reason(self):
+        """PAUSE_SYNC 的 reason（谁设置的暂停），没有暂停时为 None"""
+        if not self.pause_file.exists():
+            return None
+        try:
+            with open(self.pause_file, 'r') as f:
+                return json.load(f).get('reason') or 'unknown'
+        except (OSError, ValueError):
+            return 'unknown'
+
 if __name__ == '__main__':
     protector = SmartDataProtector()
     if len(sys.argv) > 1 and sys.argv[1] == 'init':
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+共享数据库连接池 - MIDDLE / CLOUD 等前缀各一个池，同步和数据保护共用
+
+connect_db(prefix) 返回池中的连接，调用方照常 conn.close()，连接会归还到池里。
+池大小用 {PREFIX}_POOL_SIZE 配置（默认 SYNC_WORKERS+SYNC_TABLE_WORKERS+1，至少4），空闲超过 POOL_PING_SECONDS 的连接
+取出时先 ping（断线自动重连），归还时回滚未提交事务，出错的连接直接丢弃。
+修改过会话变量的连接应调用 conn.discard()，不要放回池中。
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+
+import pymysql
+
+
+class PooledConnection:
+    """连接代理：close() 归还到池，其余属性转发给 pymysql 连接"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool.release(self._conn)
+
+    def discard(self):
+        """关闭底层连接，不放回池中"""
+        if not self._released:
+            self._released = True
+            self._pool.release(self._conn, broken=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class ConnectionPool:
+    def __init__(self, prefix, size=None):
+        self.prefix = prefix
+        # 并发同步的表各一个连接，并行全量的大表再多 SYNC_TABLE_WORKERS-1 个，另留两个给校验等
+        default_size = max(4, int(os.getenv('SYNC_WORKERS', 1)) + int(os.getenv('SYNC_TABLE_WORKERS', 4)) + 1)
+        self.size = max(1, int(size or os.getenv(f'{prefix}_POOL_SIZE', default_size)))
+        self.timeout = float(os.getenv('POOL_TIMEOUT', 60))
+        self.ping_interval = float(os.getenv('POOL_PING_SECONDS', 30))
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+        self.stats = {'created': 0, 'reused': 0, 'pinged': 0, 'discarded': 0}
+
+    def create(self, **options):
+        """新建连接（options 为额外的 pymysql.connect 参数，如 local_infile）"""
+        prefix = self.prefix
+        return pymysql.connect(
+            host=os.getenv(f'{prefix}_HOST'),
+            port=int(os.getenv(f'{prefix}_PORT', 3306)),
+            user=os.getenv(f'{prefix}_USER'),
+            password=os.getenv(f'{prefix}_PASS'),
+            database=os.getenv(f'{prefix}_DB'),
+            charset='utf8mb4',
+            cursorclass=pymysql.cursors.DictCursor,
+            **options
+        )
+
+    def acquire(self):
+        """取出一个可用连接，池满时最多等待 POOL_TIMEOUT 秒"""
+        try:
+            conn, last_used = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                can_create = self.created < self.size
+                if can_create:
+                    self.created += 1
+            if can_create:
+                try:
+                    conn = self.create()
+                except Exception:
+                    with self.lock:
+                        self.created -= 1
+                    raise
+                self.stats['created'] += 1
+                return PooledConnection(self, conn)
+            try:
+                conn, last_used = self.idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise TimeoutError(f"{self.prefix} 连接池已满（{self.size}），等待超时")
+
+        if time.time() - last_used > self.ping_interval:
+            try:
+                conn.ping(reconnect=True)
+                self.stats['pinged'] += 1
+            except Exception:
+                self.release(conn, broken=True)
+                return self.acquire()
+        self.stats['reused'] += 1
+        return PooledConnection(self, conn)
+
+    def release(self, conn, broken=False):
+        """归还连接；未提交事务回滚，失败则丢弃"""
+        if not broken:
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+        if broken:
+            try:
+                conn.close()
+            except Exception:
+                pass
+            with self.lock:
+                self.created -= 1
+            self.stats['discarded'] += 1
+            return
+        self.idle.put((conn, time.time()))
+
+    def close_all(self):
+        """关闭所有空闲连接"""
+        while True:
+            try:
+                conn, _ = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.close()
+            except Exception:
+                pass
+            with self.lock:
+                self.created -= 1
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(prefix):
+    """按前缀获取（或创建）连接池"""
+    with _pools_lock:
+        if prefix not in _pools:
+            _pools[prefix] = ConnectionPool(prefix)
+        return _pools[prefix]
+
+
+def connect_db(prefix='MIDDLE'):
+    """从共享池取连接，用法与 pymysql.connect 返回值相同"""
+    return get_pool(prefix).acquire()
+
+
+def close_all_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close_all()
+
+
+atexit.register(close_all_pools)
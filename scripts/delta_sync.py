@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+增量行同步 - 按水位线（自增主键 / updated_at 列）只同步新增和修改的行
+
+水位线保存在 cache/delta_watermarks.json：
+  - timestamp: 表有 updated_at 类列时使用，可捕获新增和修改
+  - pk: 自增主键，只能捕获新增，仅用于 DELTA_APPEND_TABLES 中的追加型表
+两者都无法捕获删除，因此每隔 DELTA_FULL_EVERY_HOURS 小时强制全量同步一次。
+自增主键水位捕获不到修改，时间列为 NULL 的行也会漏掉；同步计划在连续 DELTA_VERIFY_EVERY 次增量
+或距上次全量/校验 DELTA_VERIFY_HOURS 小时后安排一次校验（verify）：按主键分块比较 MIDDLE 和目标的摘要，
+只重传不一致的块，修复漂移（需要单列整数主键，否则改为全量）。
+"""
+
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+from chunk_checksum import get_int_pk, get_columns, chunk_digests, copy_range
+from row_copy import quote_ident, get_primary_key, upsert_rows
+
+TIMESTAMP_TYPES = {'timestamp', 'datetime', 'bigint', 'int'}
+PK_TYPES = {'int', 'bigint', 'mediumint', 'smallint', 'tinyint'}
+
+
+class DeltaSyncer:
+    def __init__(self, engine, target=None):
+        """target 为同步目标（sync_targets.SyncTarget），默认 CLOUD；非主目标的状态存在带后缀的文件中"""
+        self.engine = engine
+        self.target = target.name if target else 'CLOUD'
+        self.primary = target.primary if target else True
+        self.label = target.label if target else ''
+        self.watermark_file = engine.cache_dir / f'delta_watermarks{target.suffix if target else ""}.json'
+        self.lock = threading.Lock()
+
+        self.timestamp_columns = [c.strip() for c in os.getenv(
+            'DELTA_WATERMARK_COLUMNS', 'updated_at,update_time,modified_at').split(',') if c.strip()]
+        self.append_tables = {t.strip() for t in os.getenv(
+            'DELTA_APPEND_TABLES', 'quota_data').split(',') if t.strip()}
+        self.batch_rows = int(os.getenv('DELTA_BATCH_ROWS', 5000))
+        self.full_every = timedelta(hours=float(os.getenv('DELTA_FULL_EVERY_HOURS', 24)))
+        # 0 为不按次数/时间校验
+        self.verify_every = int(os.getenv('DELTA_VERIFY_EVERY', 20))
+        self.verify_interval = timedelta(hours=float(os.getenv('DELTA_VERIFY_HOURS', 6)))
+        self.chunk_size = int(os.getenv('CHUNK_SIZE', 10000))
+        self.load_watermarks()
+
+    def load_watermarks(self):
+        """加载水位线"""
+        if self.watermark_file.exists():
+            with open(self.watermark_file, 'r') as f:
+                self.watermarks = json.load(f)
+        else:
+            self.watermarks = {}
+
+    def save_watermarks(self):
+        """保存水位线"""
+        with self.lock:
+            with open(self.watermark_file, 'w') as f:
+                json.dump(self.watermarks, f, indent=2, default=str)
+
+    def find_watermark(self, cursor, table):
+        """选择可用的水位线列，返回 (kind, column, pk) 或 None"""
+        pk = get_primary_key(cursor, table)
+        if len(pk) != 1:
+            return None
+
+        cursor.execute(
+            "SELECT COLUMN_NAME, DATA_TYPE, EXTRA FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+            (table,)
+        )
+        columns = {row['COLUMN_NAME']: row for row in cursor.fetchall()}
+
+        for name in self.timestamp_columns:
+            if name in columns and columns[name]['DATA_TYPE'] in TIMESTAMP_TYPES:
+                return 'timestamp', name, pk[0]
+
+        pk_col = columns.get(pk[0])
+        if (table in self.append_tables and pk_col
+                and pk_col['DATA_TYPE'] in PK_TYPES and 'auto_increment' in pk_col['EXTRA']):
+            return 'pk', pk[0], pk[0]
+        return None
+
+    def needs_full(self, table):
+        """没有水位线或距离上次全量太久时需要全量同步"""
+        state = self.watermarks.get(table)
+        if not state or state.get('mark') is None:
+            return True
+        last_full = datetime.fromisoformat(state['last_full'])
+        return datetime.now() - last_full > self.full_every
+
+    def needs_verify(self, table):
+        """连续增量次数或距上次全量/校验的时间到期时需要校验"""
+        state = self.watermarks.get(table)
+        if not state or state.get('mark') is None:
+            return False
+        if self.verify_every > 0 and state.get('deltas', 0) >= self.verify_every:
+            return True
+        last = datetime.fromisoformat(state.get('verified') or state['last_full'])
+        return self.verify_interval > timedelta(0) and datetime.now() - last >= self.verify_interval
+
+    def verify_table(self, table):
+        """分块比较 MIDDLE 和目标的摘要，重传不一致的块并推进水位线；返回 None 表示需要走全量同步"""
+        state = self.watermarks.get(table)
+        if not state or state.get('mark') is None:
+            return None
+        column = state['column']
+        middle = self.engine.read_conn(table)
+        cloud = self.engine.connect_db(self.target)
+        src = middle.cursor()
+        dst = cloud.cursor()
+        try:
+            pk = get_int_pk(src, table)
+            columns = get_columns(src, table)
+            if pk is None or columns != get_columns(dst, table):
+                return None
+            # 先取当前最大水位再比较，比较期间的新改动下次增量仍会覆盖（宁可重复，不可遗漏）
+            src.execute(f"SELECT MAX({quote_ident(column)}) AS mark FROM {quote_ident(table)}")
+            mark = src.fetchone()['mark']
+            source = chunk_digests(src, table, pk, columns, self.chunk_size)
+            target = chunk_digests(dst, table, pk, columns, self.chunk_size)
+            changed = sorted(int(c) for c in set(source) | set(target) if source.get(c) != target.get(c))
+            rows = 0
+            for chunk in changed:
+                lo = chunk * self.chunk_size
+                rows += copy_range(middle, cloud, table, pk, lo, lo + self.chunk_size, self.batch_rows)
+        except Exception as e:
+            self.engine.log(f"  同步表: {table}{self.label} ❌ 校验失败: {e}")
+            return False
+        finally:
+            src.close()
+            dst.close()
+            middle.close()
+            cloud.close()
+
+        with self.lock:
+            self.watermarks[table] = dict(state, mark=mark if mark is not None else state['mark'],
+                                          deltas=0, verified=datetime.now().isoformat())
+        self.save_watermarks()
+        if self.primary:
+            self.engine.table_stats[table] = {'rows': rows, 'chunks_changed': len(changed),
+                                              'chunks_total': max(1, len(source))}
+        self.engine.log(f"  同步表: {table}{self.label} ✅ 校验 {len(changed)}/{len(source)} 块不一致, "
+                        f"重传 {rows:,} 行")
+        return True
+
+    def begin_full(self, table):
+        """全量同步前记录当前最大水位，全量成功后作为起点（宁可重复，不可遗漏）"""
+        conn = self.engine.read_conn(table)
+        cursor = conn.cursor()
+        try:
+            found = self.find_watermark(cursor, table)
+            if not found:
+                return None
+            kind, column, pk = found
+            cursor.execute(f"SELECT MAX({quote_ident(column)}) AS mark FROM {quote_ident(table)}")
+            mark = cursor.fetchone()['mark']
+            return {'kind': kind, 'column': column, 'pk': pk, 'mark': mark}
+        except Exception as e:
+            self.engine.log(f"  ⚠️  {table}: 读取水位线失败: {e}")
+            return None
+        finally:
+            cursor.close()
+            conn.close()
+
+    def finish_full(self, table, state):
+        """全量同步成功后保存水位线"""
+        if state is None:
+            with self.lock:
+                self.watermarks.pop(table, None)
+        else:
+            state = dict(state, last_full=datetime.now().isoformat())
+            with self.lock:
+                self.watermarks[table] = state
+        self.save_watermarks()
+
+    def sync_table(self, table):
+        """增量同步；返回 True/False，返回 None 表示需要走全量同步"""
+        if self.needs_full(table):
+            return None
+
+        state = self.watermarks[table]
+        column, pk, kind = state['column'], state['pk'], state['kind']
+        middle = self.engine.read_conn(table)
+        cloud = self.engine.connect_db(self.target)
+        cursor = middle.cursor()
+
+        total = 0
+        mark = state['mark']
+        # 时间戳水位从 >= mark 开始（同一秒内的修改不会漏掉），批内用 (列, 主键) 做键集分页
+        last_value, last_pk = mark, None
+        try:
+            while True:
+                if kind == 'pk':
+                    where, args = f"{quote_ident(pk)} > %s", (last_value,)
+                elif last_pk is None:
+                    where, args = f"{quote_ident(column)} >= %s", (last_value,)
+                else:
+                    where = (f"({quote_ident(column)} > %s OR "
+                             f"({quote_ident(column)} = %s AND {quote_ident(pk)} > %s))")
+                    args = (last_value, last_value, last_pk)
+
+                cursor.execute(
+                    f"SELECT * FROM {quote_ident(table)} WHERE {where} "
+                    f"ORDER BY {quote_ident(column)}, {quote_ident(pk)} LIMIT {self.batch_rows}",
+                    args
+                )
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+
+                columns = list(rows[0].keys())
+                total += upsert_rows(cloud, table, columns, rows)
+                last_value, last_pk = rows[-1][column], rows[-1][pk]
+                with self.lock:
+                    self.watermarks[table]['mark'] = last_value
+
+                if len(rows) < self.batch_rows:
+                    break
+        except Exception as e:
+            self.engine.log(f"  同步表: {table}{self.label} ❌ 增量失败: {e}")
+            return False
+        finally:
+            self.save_watermarks()
+            cursor.close()
+            middle.close()
+            cloud.close()
+
+        if str(last_value) == str(mark):
+            # 校验和变了水位却没前进，说明是删除（或自增表的修改），水位线覆盖不到
+            return None
+
+        with self.lock:
+            self.watermarks[table]['deltas'] = self.watermarks[table].get('deltas', 0) + 1
+        self.save_watermarks()
+        if self.primary:
+            self.engine.table_stats[table] = {'rows': total}
+        self.engine.log(f"  同步表: {table}{self.label} ✅ 增量 {total:,} 行 ({kind}: {column})")
+        return True
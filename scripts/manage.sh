@@ -28,14 +28,7 @@ case "$1" in
         
         echo ""
         echo "4️⃣ 最近同步："
-        if [ -f /opt/mysql-sync/logs/sync.log ]; then
-            LAST_SYNC=$(grep "智能同步" /opt/mysql-sync/logs/sync.log | tail -1 | cut -d'-' -f2-)
-            echo "   $LAST_SYNC"
-            LAST_RESULT=$(grep "成功:" /opt/mysql-sync/logs/sync.log | tail -1)
-            echo "   $LAST_RESULT"
-        else
-            echo "   暂无日志"
-        fi
+        python3 /opt/mysql-sync/scripts/sync_metrics.py status
         
         echo ""
         echo "5️⃣ 数据对比："
@@ -57,7 +50,20 @@ case "$1" in
     sync)
         echo "🔄 手动执行同步..."
         cd /opt/mysql-sync/scripts
-        python3 smart_sync.py
+        flock -n /opt/mysql-sync/cache/sync.lock python3 smart_sync.py || echo "⚠️  已有同步进程在运行"
+        ;;
+    
+    plan)
+        echo "📋 同步计划预览（只检测变化并估算，不同步）..."
+        cd /opt/mysql-sync/scripts
+        python3 smart_sync.py --dry-run
+        ;;
+    
+    daemon)
+        echo "🚀 启动同步常驻进程（代替 cron 中的 safe_sync.sh 和 data_protection.py）..."
+        cd /opt/mysql-sync/scripts
+        python3 -u sync_daemon.py >> /opt/mysql-sync/logs/sync.log 2>&1 &
+        echo "✅ 已启动 (pid $!)，日志: /opt/mysql-sync/logs/sync.log"
         ;;
     
     check)
@@ -66,15 +72,43 @@ case "$1" in
         python3 data_protection.py
         ;;
     
+    cdc)
+        cd /opt/mysql-sync/scripts
+        if [ "$2" = "confirm" ] || [ "$2" = "skip" ]; then
+            # 处理被批量删除保护拦截的 binlog 区间
+            python3 binlog_cdc.py "$2" 2>&1 | tee -a /opt/mysql-sync/logs/cdc.log
+        else
+            echo "📡 启动Binlog实时同步（Ctrl+C 停止）..."
+            python3 binlog_cdc.py 2>&1 | tee -a /opt/mysql-sync/logs/cdc.log
+        fi
+        ;;
+    
     verify)
-        echo "🔍 验证数据一致性..."
-        echo ""
-        echo "主要表对比："
-        for table in quota_data tokens abilities users tasks; do
-            MIDDLE=$(mysql -uroot -p'Middle@Server#2024Pass' bynewapi -N -e "SELECT COUNT(*) FROM $table;" 2>/dev/null)
-            CLOUD=$(mysql -h 35.220.220.225 -uroot -p'cGd4mQmiAyps6zsmQy@' -D bf-bynewapi -N -e "SELECT COUNT(*) FROM $table;" 2>/dev/null)
-            printf "%-15s  中间: %8s  Cloud: %8s  差异: %5s\n" "$table" "$MIDDLE" "$CLOUD" "$((MIDDLE - CLOUD))"
-        done
+        echo "🔍 验证数据一致性（按主键区间比较所有同步表）..."
+        cd /opt/mysql-sync/scripts
+        shift
+        python3 verify_sync.py "$@"
+        ;;
+    
+    bench)
+        echo "⏱️  运行基准测试（BENCH_* 配置测试库和数据规模）..."
+        cd /opt/mysql-sync/scripts
+        shift
+        python3 benchmark.py "$@"
+        ;;
+    
+    backup)
+        echo "💾 本地备份归档（list / verify [ID|all] / prune）..."
+        cd /opt/mysql-sync/scripts
+        shift
+        python3 backup_archive.py "$@" 2>&1 | tee -a /opt/mysql-sync/logs/backup.log
+        ;;
+    
+    restore)
+        echo "♻️  灾难恢复：并行导入到目标库（--target 前缀 [--source 前缀 | --archive [ID]]）..."
+        cd /opt/mysql-sync/scripts
+        shift
+        python3 restore.py "$@" 2>&1 | tee -a /opt/mysql-sync/logs/restore.log
         ;;
     
     logs)
@@ -114,9 +148,19 @@ MySQL同步系统管理工具
 命令列表：
   status        查看系统状态
   sync          手动执行同步
+  plan          预览同步计划（各表同步方式、预计传输量和耗时）
   check         执行数据保护检查
-  verify        验证数据一致性
-  logs [type]   查看日志（sync/protection/baseline）
+  cdc           启动Binlog实时同步（常驻）；cdc confirm|skip 处理被删除保护拦截的区间
+  daemon        启动同步常驻进程（内置调度）
+  verify [--repair] [表名...]
+                验证数据一致性（--repair 重新同步不一致区间）
+  bench [--compare 旧.json 新.json]
+                在测试库上运行基准测试 / 比较两次结果
+  backup [list|verify [ID|all]|prune]
+                创建增量备份归档 / 列出 / 校验 / 清理
+  restore --target 前缀 [--source 前缀 | --archive [ID]] [--replace] [--verify] [表名...]
+                灾难恢复：并行恢复到目标库（推迟建二级索引）
+  logs [type]   查看日志（sync/protection/baseline/backup）
   pause         暂停自动同步
   resume        恢复自动同步
   baseline      创建新的数据基线
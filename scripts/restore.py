@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+并行恢复 - 灾难恢复时把数据从任意源（默认 Cloud SQL）或本地备份归档并行导入任意目标库
+
+用法:
+  python3 restore.py --target PROD [--source CLOUD] [--replace] [--verify] [表名 ...]
+  python3 restore.py --target PROD --archive [备份ID] [--replace] [表名 ...]
+
+源和目标都是 .env 中的连接前缀（{前缀}_HOST/_PORT/_USER/_PASS/_DB），例如新生产服务器配置为 PROD_*。
+流程（与同步相反的方向，用同一套快照/流式读取/分批写入）：
+  1. 在目标库建表，只保留主键（以及自增列所在的索引），二级索引和外键推迟
+  2. 大于 RESTORE_CHUNK_BYTES 的表按主键切成区间，所有表的区间放在一个队列里，
+     由 RESTORE_WORKERS 个线程从同一个一致性快照（或归档文件）并行读取、各自写入目标库
+  3. 每个表的数据导入完成后立即在 RESTORE_INDEX_WORKERS 个线程中一次性补建二级索引和外键，
+     与其他表的数据导入重叠
+每 RESTORE_PROGRESS_SECONDS 秒输出进度和预计剩余时间，报告写入 logs/restore_report.json。
+目标库已有同名表时默认拒绝执行，--replace 才会删除重建。
+--verify 在导入完成后按主键区间比较源和目标（见 verify_sync.py，仅数据库源）。
+"""
+
+import gzip
+import json
+import math
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+import sys
+import os
+
+import pymysql
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dotenv import load_dotenv
+
+load_dotenv('/opt/mysql-sync/.env')
+
+# 部署目录，可用 SYNC_HOME 指向其他目录（本地测试/基准测试）
+SYNC_HOME = Path(os.getenv('SYNC_HOME', '/opt/mysql-sync'))
+
+from backup_archive import BackupArchive, insert_prefix, file_sha256
+from chunk_checksum import get_int_pk, get_columns
+from db_pool import connect_db, get_pool
+from row_copy import quote_ident
+from snapshot import PassSnapshot
+from stream_sync import iter_batches, pk_ranges
+from table_metadata import fetch_table_metadata
+
+INDEX_LINE = re.compile(r'^\s*(UNIQUE |FULLTEXT |SPATIAL )?KEY `')
+FOREIGN_LINE = re.compile(r'^\s*CONSTRAINT `.*FOREIGN KEY')
+COLUMN_LINE = re.compile(r'^\s*`((?:[^`]|``)+)` ')
+
+
+def split_indexes(ddl):
+    """拆出二级索引和外键：返回 (只含主键的建表语句, 之后补建用的 ALTER 子句列表)。
+    自增列必须在某个索引中，以自增列开头的索引保留在建表语句里。
+    列定义在第一行和第一个以 ) 开头的行之间，其后（表选项、分区定义等）原样保留。"""
+    lines = ddl.split('\n')
+    end = next((i for i, line in enumerate(lines) if i > 0 and line.startswith(')')), None)
+    if end is None:
+        return ddl, []
+    head, body, tail = lines[0], lines[1:end], '\n'.join(lines[end:])
+    auto_columns = {COLUMN_LINE.match(line).group(1) for line in body
+                    if COLUMN_LINE.match(line) and 'AUTO_INCREMENT' in line}
+    kept, deferred = [], []
+    for line in body:
+        item = line.strip().rstrip(',')
+        if INDEX_LINE.match(line):
+            first = re.search(r'\(`((?:[^`]|``)+)`', item)
+            if first and first.group(1) in auto_columns:
+                kept.append(item)
+            else:
+                deferred.append(f"ADD {item}")
+        elif FOREIGN_LINE.match(line):
+            deferred.append(f"ADD {item}")
+        else:
+            kept.append(item)
+    return '\n'.join([head, ',\n'.join(f"  {item}" for item in kept), tail]), deferred
+
+
+class RestoreProgress:
+    """全局进度：行数、表和索引的完成情况，定期输出预计剩余时间"""
+
+    def __init__(self, total_rows, tables):
+        self.total_rows = max(1, total_rows)
+        self.tables = tables
+        self.rows = 0
+        self.bytes = 0
+        self.tables_done = 0
+        self.indexes_done = 0
+        self.start = time.time()
+        self.lock = threading.Lock()
+
+    def add(self, rows, nbytes=0):
+        with self.lock:
+            self.rows += rows
+            self.bytes += nbytes
+
+    def line(self):
+        elapsed = max(time.time() - self.start, 0.001)
+        rate = self.rows / elapsed
+        # 表的行数是估算值，实际可能超过
+        percent = min(99.9, self.rows * 100 / self.total_rows)
+        remaining = max(0, self.total_rows - self.rows) / rate if rate else None
+        eta = f"{remaining / 60:.1f} 分钟" if remaining is not None else '未知'
+        return (f"    … {percent:5.1f}%  {self.rows:,}/{self.total_rows:,} 行, "
+                f"{self.bytes / 1024 / 1024:.0f} MB, {rate:,.0f} 行/s, "
+                f"数据 {self.tables_done}/{self.tables} 表, 索引 {self.indexes_done}/{self.tables} 表, "
+                f"预计剩余 {eta}")
+
+
+class RestoreEngine:
+    def __init__(self, target, source='CLOUD', archive_id=None, replace=False):
+        self.target = target
+        self.source = source
+        self.archive = BackupArchive() if archive_id is not None else None
+        self.archive_id = archive_id or None
+        self.replace = replace
+        self.workers = max(1, int(os.getenv('RESTORE_WORKERS', os.cpu_count() or 4)))
+        self.index_workers = max(1, int(os.getenv('RESTORE_INDEX_WORKERS', 2)))
+        self.chunk_bytes = int(os.getenv('RESTORE_CHUNK_BYTES', 64 * 1024 * 1024))
+        self.batch_bytes = int(os.getenv('RESTORE_BATCH_BYTES', 4 * 1024 * 1024))
+        self.progress_seconds = float(os.getenv('RESTORE_PROGRESS_SECONDS', 10))
+        self.report_file = SYNC_HOME / 'logs/restore_report.json'
+        self.print_lock = threading.Lock()
+        self.snapshot = None
+
+    def log(self, message):
+        with self.print_lock:
+            print(message, flush=True)
+
+    def target_conn(self):
+        """导入用的目标连接：关闭唯一性和外键检查，改过会话变量，不放回连接池"""
+        conn = get_pool(self.target).create()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SET SESSION unique_checks = 0, foreign_key_checks = 0")
+        finally:
+            cursor.close()
+        return conn
+
+    def source_tables(self, tables):
+        """数据库源的表元数据 {table: meta}，不指定表时为所有表"""
+        conn = connect_db(self.source)
+        cursor = conn.cursor()
+        try:
+            metadata = fetch_table_metadata(cursor)
+        finally:
+            cursor.close()
+            conn.close()
+        tables = tables or sorted(t for t in metadata if not t.startswith('_'))
+        missing = [t for t in tables if t not in metadata]
+        if missing:
+            raise ValueError(f"源 {self.source} 中没有表: {', '.join(missing)}")
+        return {table: metadata[table] for table in tables}
+
+    def plan_database(self, metadata):
+        """从数据库源生成任务：{table: 表记录}，大表按主键切成多个区间"""
+        plan = {}
+        conn = self.snapshot.acquire()
+        cursor = conn.cursor()
+        try:
+            for table, meta in metadata.items():
+                cursor.execute(f"SHOW CREATE TABLE {quote_ident(table)}")
+                ddl = cursor.fetchone()['Create Table']
+                columns = get_columns(cursor, table)
+                size = meta['data_length']
+                pk = get_int_pk(cursor, table)
+                parts = math.ceil(size / self.chunk_bytes) if pk and size > self.chunk_bytes else 1
+                ranges = pk_ranges(conn, table, pk, parts) if parts > 1 else []
+                if ranges:
+                    jobs = [{'lo': lo, 'hi': hi, 'rows': meta['table_rows'] // len(ranges),
+                             'bytes': size // len(ranges)} for lo, hi in ranges]
+                else:
+                    jobs = [{'lo': None, 'hi': None, 'rows': meta['table_rows'], 'bytes': size}]
+                plan[table] = {'create': ddl, 'columns': columns, 'pk': pk,
+                               'rows': meta['table_rows'], 'jobs': jobs}
+        finally:
+            cursor.close()
+            conn.close()
+        return plan
+
+    def plan_archive(self, tables):
+        """从备份归档生成任务：每个区间文件一个任务"""
+        manifest = self.archive.load_manifest(self.archive_id)
+        if manifest is None:
+            raise ValueError(f"备份 {self.archive_id or '(最新)'} 不存在")
+        self.archive_id = manifest['id']
+        tables = tables or sorted(manifest['tables'])
+        missing = [t for t in tables if t not in manifest['tables']]
+        if missing:
+            raise ValueError(f"备份 {self.archive_id} 中没有表: {', '.join(missing)}")
+        plan = {}
+        for table in tables:
+            info = manifest['tables'][table]
+            jobs = [{'lo': e['lo'], 'hi': e['hi'], 'rows': e['rows'], 'bytes': e['bytes'], 'entry': e}
+                    for e in info['chunks']]
+            plan[table] = {'create': info['create'], 'columns': info['columns'], 'pk': info['pk'],
+                           'rows': info['rows'], 'jobs': jobs}
+        return plan
+
+    def create_tables(self, plan):
+        """在目标库建表（只含主键），返回每个表推迟的 ALTER 子句"""
+        conn = connect_db(self.target)
+        cursor = conn.cursor()
+        deferred = {}
+        try:
+            cursor.execute("SELECT TABLE_NAME FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE()")
+            existing = {row['TABLE_NAME'] for row in cursor.fetchall()} & set(plan)
+            if existing and not self.replace:
+                raise ValueError(f"目标 {self.target} 已有表: {', '.join(sorted(existing))}（确认覆盖请加 --replace）")
+            cursor.execute("SET SESSION foreign_key_checks = 0")
+            for table, info in plan.items():
+                ddl, deferred[table] = split_indexes(info['create'])
+                cursor.execute(f"DROP TABLE IF EXISTS {quote_ident(table)}")
+                cursor.execute(ddl)
+        finally:
+            cursor.close()
+            # 改过会话变量
+            conn.discard()
+        return deferred
+
+    def load_from_database(self, conn, table, info, job, progress):
+        """从快照读取一个区间写入目标库，返回行数"""
+        src = self.snapshot.acquire()
+        cursor = src.cursor(pymysql.cursors.SSCursor)
+        dst = conn.cursor()
+        prefix = insert_prefix(table, info['columns'])
+        cols = ', '.join(quote_ident(c) for c in info['columns'])
+        rows = 0
+        try:
+            cursor.execute("SET SESSION net_write_timeout = 600")
+            if job['lo'] is None:
+                cursor.execute(f"SELECT {cols} FROM {quote_ident(table)}")
+            else:
+                pk = quote_ident(info['pk'])
+                cursor.execute(f"SELECT {cols} FROM {quote_ident(table)} WHERE {pk} >= %s AND {pk} < %s",
+                               (job['lo'], job['hi']))
+            for batch, size in iter_batches(cursor, conn.escape, self.batch_bytes):
+                dst.execute(prefix + ','.join(batch))
+                conn.commit()
+                rows += len(batch)
+                progress.add(len(batch), size)
+            cursor.close()
+            src.close()
+        except Exception:
+            src.discard()
+            raise
+        finally:
+            dst.close()
+        return rows
+
+    def load_from_archive(self, conn, table, info, job, progress):
+        """导入一个归档文件（先核对 SHA-256），返回行数"""
+        entry = job['entry']
+        path = self.archive.chunk_path(entry)
+        if file_sha256(path) != entry['sha256']:
+            raise ValueError(f"归档文件 {entry['file']} 校验失败")
+        dst = conn.cursor()
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8', errors='surrogateescape') as f:
+                for line in f:
+                    line = line.rstrip('\n')
+                    if line:
+                        dst.execute(line.rstrip(';'))
+                        conn.commit()
+                        progress.add(0, len(line))
+        finally:
+            dst.close()
+        progress.add(entry['rows'])
+        return entry['rows']
+
+    def build_indexes(self, table, clauses, progress):
+        """数据导入完成后一次性补建二级索引和外键（一条 ALTER，每个索引只排序一次）"""
+        start = time.time()
+        if clauses:
+            conn = self.target_conn()
+            cursor = conn.cursor()
+            try:
+                cursor.execute(f"ALTER TABLE {quote_ident(table)} {', '.join(clauses)}")
+            finally:
+                cursor.close()
+                conn.close()
+            self.log(f"  🔑 {table}: 补建 {len(clauses)} 个索引/外键 ({time.time() - start:.1f}s)")
+        with progress.lock:
+            progress.indexes_done += 1
+
+    def same_database(self):
+        """源和目标是同一个库（同一前缀，或主机、端口、库名都相同）"""
+        if self.source.upper() == self.target.upper():
+            return True
+        return os.getenv(f"{self.source}_HOST") is not None and all(os.getenv(f"{self.source}_{key}", default) == os.getenv(f"{self.target}_{key}", default)
+                   for key, default in (('HOST', None), ('PORT', '3306'), ('DB', None)))
+
+    def run(self, tables=None):
+        start = time.time()
+        if not self.archive and self.same_database():
+            raise ValueError(f"源 {self.source} 和目标 {self.target} 是同一个库，拒绝恢复")
+        source = f"归档 {self.archive_id or '(最新)'}" if self.archive else self.source
+        print("=" * 70)
+        print(f"♻️  并行恢复 {source} → {self.target} - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        print("=" * 70)
+
+        if self.archive:
+            plan = self.plan_archive(tables)
+        else:
+            metadata = self.source_tables(tables)
+            names = list(metadata)
+            try:
+                self.snapshot = PassSnapshot(self.source, self.workers, names)
+            except Exception as e:
+                # 托管数据库（如 Cloud SQL）没有 RELOAD 权限，不能加读锁；恢复时源库应已停止写入
+                print(f"  ⚠️  无法冻结 {self.source}（{e}），直接打开快照（请确认源库已停止写入）")
+                self.snapshot = PassSnapshot(self.source, self.workers, names, freeze='none')
+            print(f"📸 一致性快照: {self.snapshot.describe()}")
+
+        try:
+            if not self.archive:
+                plan = self.plan_database(metadata)
+            deferred = self.create_tables(plan)
+            jobs = [(table, job) for table, info in plan.items() for job in info['jobs']]
+            # 大区间先导入，最后不会只剩一个线程在导入大表
+            jobs.sort(key=lambda item: item[1]['bytes'], reverse=True)
+            total_rows = sum(info['rows'] for info in plan.values())
+            print(f"📋 {len(plan)} 个表, {len(jobs)} 个导入任务, 约 {total_rows:,} 行, "
+                  f"{self.workers} 个导入线程, {self.index_workers} 个索引线程")
+            results = self.execute(plan, jobs, deferred, total_rows)
+        finally:
+            if self.snapshot is not None:
+                self.snapshot.close()
+
+        failed = sorted(t for t, r in results.items() if r['status'] != 'ok')
+        report = {
+            'time': datetime.now().isoformat(),
+            'source': source,
+            'target': self.target,
+            'snapshot': self.snapshot.coordinates if self.snapshot else None,
+            'seconds': round(time.time() - start, 1),
+            'tables': results,
+        }
+        self.report_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.report_file, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+
+        rows = sum(r['rows'] for r in results.values())
+        print(f"\n{'=' * 70}")
+        print(f"✅ 恢复完成: {len(results) - len(failed)}/{len(results)} 个表, {rows:,} 行 "
+              f"(耗时 {report['seconds'] / 60:.1f} 分钟)  报告: {self.report_file}")
+        if failed:
+            print(f"❌ 失败: {', '.join(failed)}（修复后用 --replace 只重新恢复这些表）")
+        print("=" * 70)
+        return not failed
+
+    def execute(self, plan, jobs, deferred, total_rows):
+        """并行导入所有区间，每个表导入完成后提交索引补建任务"""
+        progress = RestoreProgress(total_rows, len(plan))
+        remaining = {table: len(info['jobs']) for table, info in plan.items()}
+        results = {table: {'status': 'ok', 'rows': 0, 'error': None} for table in plan}
+        lock = threading.Lock()
+        pending = queue.Queue()
+        for item in jobs:
+            pending.put(item)
+        index_pool = ThreadPoolExecutor(max_workers=self.index_workers)
+        index_futures = {}
+        stop = threading.Event()
+        load = self.load_from_archive if self.archive else self.load_from_database
+
+        def table_loaded(table):
+            with progress.lock:
+                progress.tables_done += 1
+            if results[table]['status'] == 'ok':
+                index_futures[table] = index_pool.submit(self.build_indexes, table, deferred[table], progress)
+            else:
+                with progress.lock:
+                    progress.indexes_done += 1
+
+        # 没有数据的表（空表没有区间）直接补建索引
+        for table, count in remaining.items():
+            if count == 0:
+                table_loaded(table)
+
+        def worker():
+            conn = self.target_conn()
+            try:
+                while True:
+                    try:
+                        table, job = pending.get_nowait()
+                    except queue.Empty:
+                        break
+                    try:
+                        rows = 0
+                        if results[table]['status'] == 'ok':
+                            rows = load(conn, table, plan[table], job, progress)
+                    except Exception as e:
+                        self.log(f"  ❌ {table} [{job['lo']}, {job['hi']}): {e}")
+                        with lock:
+                            results[table].update(status='failed', error=str(e))
+                        try:
+                            conn.close()
+                        except Exception:
+                            pass
+                        conn = self.target_conn()
+                    with lock:
+                        results[table]['rows'] += rows
+                        remaining[table] -= 1
+                        finished = remaining[table] == 0
+                    if finished:
+                        if results[table]['status'] == 'ok':
+                            self.log(f"  ✓ {table}: {results[table]['rows']:,} 行")
+                        table_loaded(table)
+            finally:
+                conn.close()
+
+        def reporter():
+            while not stop.wait(self.progress_seconds):
+                self.log(progress.line())
+
+        monitor = threading.Thread(target=reporter, daemon=True)
+        monitor.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for future in [pool.submit(worker) for _ in range(self.workers)]:
+                    future.result()
+            for table, future in index_futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    self.log(f"  ❌ {table}: 补建索引失败: {e}")
+                    results[table].update(status='index_failed', error=str(e))
+        finally:
+            stop.set()
+            index_pool.shutdown(wait=True)
+        self.log(progress.line())
+        return results
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    options = {'--source': os.getenv('RESTORE_SOURCE', 'CLOUD'), '--target': os.getenv('RESTORE_TARGET')}
+    archive_id = None
+    tables = []
+    usage = "用法: restore.py --target 前缀 [--source 前缀 | --archive [ID]] [--replace] [--verify] [表名 ...]"
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg in options:
+            if i + 1 >= len(args) or args[i + 1].startswith('--'):
+                print(usage)
+                sys.exit(2)
+            options[arg] = args[i + 1]
+            i += 1
+        elif arg == '--archive':
+            # 备份 ID 可省略（使用最新一次）
+            archive_id = ''
+            if i + 1 < len(args) and not args[i + 1].startswith('--') and (
+                    BackupArchive().manifest_dir / f"{args[i + 1]}.json").exists():
+                archive_id = args[i + 1]
+                i += 1
+        elif not arg.startswith('--'):
+            tables.append(arg)
+        i += 1
+
+    if not options['--target']:
+        print(usage)
+        sys.exit(2)
+    engine = RestoreEngine(options['--target'], options['--source'], archive_id, '--replace' in args)
+    try:
+        result = engine.run(tables or None)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    if result and '--verify' in args and archive_id is None:
+        from verify_sync import SyncVerifier
+        result = SyncVerifier(options['--source'], options['--target']).run(tables or None)
+    sys.exit(0 if result else 1)
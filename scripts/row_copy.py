@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+行数据复制工具 - 从源库读取行，批量写入目标库
+"""
+
+
+def quote_ident(name):
+    """反引号转义标识符"""
+    return '`' + str(name).replace('`', '``') + '`'
+
+
+def get_primary_key(cursor, table):
+    """返回主键列列表（按顺序），无主键返回空列表"""
+    cursor.execute(
+        "SELECT COLUMN_NAME FROM information_schema.KEY_COLUMN_USAGE "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND CONSTRAINT_NAME = 'PRIMARY' "
+        "ORDER BY ORDINAL_POSITION",
+        (table,)
+    )
+    return [row['COLUMN_NAME'] for row in cursor.fetchall()]
+
+
+def build_upsert(conn, table, columns, rows):
+    """生成多行 INSERT ... ON DUPLICATE KEY UPDATE 语句"""
+    cols = ', '.join(quote_ident(c) for c in columns)
+    updates = ', '.join(f"{quote_ident(c)}=VALUES({quote_ident(c)})" for c in columns)
+    values = ', '.join(conn.escape(tuple(row[c] for c in columns)) for row in rows)
+    return f"INSERT INTO {quote_ident(table)} ({cols}) VALUES {values} ON DUPLICATE KEY UPDATE {updates}"
+
+
+def upsert_rows(conn, table, columns, rows):
+    """批量upsert并提交，返回写入行数"""
+    if not rows:
+        return 0
+    cursor = conn.cursor()
+    try:
+        cursor.execute(build_upsert(conn, table, columns, rows))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return len(rows)
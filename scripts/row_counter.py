@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+行数统计引擎 - 代替每次对所有表做 SELECT COUNT(*)
+
+三级计数：
+  1. 估算：information_schema.TABLE_ROWS，按最近一次精确计数校准（校准值单独保存，不随历史滚动丢失）
+  2. 维护计数：按主键区间缓存分段计数，每次只重数尾部新块和 COUNT_REFRESH_CHUNKS 个最久未核对的块
+  3. 精确计数：估算和维护计数每次都计算，任一个接近告警阈值（COUNT_ESCALATE_MARGIN_PERCENT 以内）时全量重数
+维护计数要很多轮才能轮到旧块，删除旧数据时由估算先发现并升级为精确计数。
+另外保存每个表最近的行数历史，用于判断删除速率。
+"""
+
+import json
+import os
+import time
+
+from row_copy import quote_ident
+from chunk_checksum import get_int_pk
+
+
+class RowCounter:
+    def __init__(self, cache_dir):
+        self.partials_file = cache_dir / 'row_count_partials.json'
+        self.history_file = cache_dir / 'row_count_history.json'
+        self.calibration_file = cache_dir / 'row_count_calibration.json'
+        self.chunk_size = int(os.getenv('COUNT_CHUNK_SIZE', 100000))
+        self.refresh_chunks = int(os.getenv('COUNT_REFRESH_CHUNKS', 20))
+        self.margin = float(os.getenv('COUNT_ESCALATE_MARGIN_PERCENT', 3))
+        self.history_size = int(os.getenv('ROW_HISTORY_SIZE', 48))
+        self.partials = self.load(self.partials_file)
+        self.history = self.load(self.history_file)
+        # {table: [精确行数, 当时的 TABLE_ROWS, 时间]}
+        self.calibration = self.load(self.calibration_file)
+
+    def load(self, path):
+        if path.exists():
+            with open(path, 'r') as f:
+                return json.load(f)
+        return {}
+
+    def save(self):
+        """保存分段计数和历史"""
+        with open(self.partials_file, 'w') as f:
+            json.dump(self.partials, f, indent=2)
+        with open(self.history_file, 'w') as f:
+            json.dump(self.history, f, indent=2)
+        with open(self.calibration_file, 'w') as f:
+            json.dump(self.calibration, f, indent=2)
+
+    def exact_count(self, cursor, table):
+        """精确计数；整数主键的表同时重建分段计数"""
+        pk = get_int_pk(cursor, table)
+        if pk is None:
+            cursor.execute(f"SELECT COUNT(*) AS cnt FROM {quote_ident(table)}")
+            self.partials.pop(table, None)
+            return cursor.fetchone()['cnt']
+
+        cursor.execute(
+            f"SELECT FLOOR({quote_ident(pk)} / {self.chunk_size}) AS chunk, COUNT(*) AS cnt "
+            f"FROM {quote_ident(table)} GROUP BY chunk"
+        )
+        now = time.time()
+        chunks = {str(int(row['chunk'])): [row['cnt'], now] for row in cursor.fetchall()}
+        self.partials[table] = {'pk': pk, 'chunk_size': self.chunk_size, 'chunks': chunks}
+        return sum(cnt for cnt, _ in chunks.values())
+
+    def maintained_count(self, cursor, table):
+        """增量维护的计数：重数尾部块和一批最久未核对的块，没有分段缓存时返回None"""
+        state = self.partials.get(table)
+        if not state or state['chunk_size'] != self.chunk_size:
+            return None
+        pk, size, chunks = state['pk'], state['chunk_size'], state['chunks']
+        now = time.time()
+
+        tail = max((int(c) for c in chunks), default=0)
+        cursor.execute(
+            f"SELECT FLOOR({quote_ident(pk)} / {size}) AS chunk, COUNT(*) AS cnt "
+            f"FROM {quote_ident(table)} WHERE {quote_ident(pk)} >= %s GROUP BY chunk",
+            (tail * size,)
+        )
+        for c in [c for c in chunks if int(c) >= tail]:
+            chunks.pop(c)
+        for row in cursor.fetchall():
+            chunks[str(int(row['chunk']))] = [row['cnt'], now]
+
+        stale = sorted((c for c in chunks if int(c) < tail), key=lambda c: chunks[c][1])
+        for c in stale[:self.refresh_chunks]:
+            lo = int(c) * size
+            cursor.execute(
+                f"SELECT COUNT(*) AS cnt FROM {quote_ident(table)} "
+                f"WHERE {quote_ident(pk)} >= %s AND {quote_ident(pk)} < %s",
+                (lo, lo + size)
+            )
+            cnt = cursor.fetchone()['cnt']
+            if cnt:
+                chunks[c] = [cnt, now]
+            else:
+                chunks.pop(c)
+
+        return sum(cnt for cnt, _ in chunks.values())
+
+    def calibrate(self, table, count, meta):
+        """记录精确计数与当时 TABLE_ROWS 的对应关系"""
+        rows_estimate = meta.get('table_rows') if meta else None
+        if rows_estimate:
+            self.calibration[table] = [count, rows_estimate, time.time()]
+
+    def estimated_count(self, table, meta):
+        """按上次精确计数时的比例校准 TABLE_ROWS"""
+        if not meta:
+            return None
+        table_rows = meta.get('table_rows', 0)
+        calibration = self.calibration.get(table)
+        if calibration:
+            count, rows_estimate, _ = calibration
+            return int(table_rows * count / rows_estimate)
+        # 兼容没有校准文件时的旧历史
+        for ts, count, method, rows_estimate in reversed(self.history.get(table, [])):
+            if method == 'exact' and rows_estimate:
+                return int(table_rows * count / rows_estimate)
+        return None
+
+    def near_threshold(self, count, checks):
+        """任一参考值的下降比例达到 (阈值 - 余量) 即视为接近告警边界"""
+        for reference, threshold in checks:
+            if reference and reference > 0:
+                decrease = (reference - count) / reference * 100
+                if decrease > threshold - self.margin:
+                    return True
+        return False
+
+    def count(self, cursor, table, meta, checks):
+        """返回 (行数, 方式)；checks 为 [(参考行数, 下降阈值%)]，接近阈值时升级为精确计数"""
+        candidates = []
+        maintained = self.maintained_count(cursor, table)
+        if maintained is not None:
+            candidates.append((maintained, 'maintained'))
+        estimated = self.estimated_count(table, meta)
+        if estimated is not None:
+            candidates.append((estimated, 'estimate'))
+
+        # 维护计数可能还没轮到被删空的旧块，估算只要接近阈值同样升级
+        if candidates and not any(self.near_threshold(c, checks) for c, _ in candidates):
+            return candidates[0]
+        exact = self.exact_count(cursor, table)
+        self.calibrate(table, exact, meta)
+        return exact, 'exact'
+
+    def record(self, table, count, method, meta=None):
+        """记录行数历史（精确计数同时更新估算的校准值）"""
+        rows_estimate = meta.get('table_rows') if meta else None
+        if method == 'exact':
+            self.calibrate(table, count, meta)
+        samples = self.history.setdefault(table, [])
+        samples.append([time.time(), count, method, rows_estimate])
+        del samples[:-self.history_size]
+
+    def reference_count(self, table, window_seconds):
+        """窗口开始处（或最早）的历史行数，用于计算删除速率；只用精确/维护计数的样本，
+        估算值偏高会被误判为快速删除，没有这样的样本时返回 None（不检查速率）"""
+        samples = [s for s in self.history.get(table, []) if s[2] in ('exact', 'maintained')]
+        cutoff = time.time() - window_seconds
+        older = [s for s in samples if s[0] <= cutoff]
+        sample = older[-1] if older else (samples[0] if samples else None)
+        return (sample[1], time.time() - sample[0]) if sample else (None, 0)
@@ -4,6 +4,13 @@
 LOG_FILE="/opt/mysql-sync/logs/sync.log"
 TIMESTAMP=$(date '+%Y-%m-%d %H:%M:%S')
 
+# 与常驻进程（sync_daemon.py）和上一次未结束的 cron 任务互斥
+exec 9>/opt/mysql-sync/cache/sync.lock
+if ! flock -n 9; then
+    echo "[$TIMESTAMP] ⏭️  已有同步进程在运行，跳过本次" | tee -a $LOG_FILE
+    exit 0
+fi
+
 echo "==========================================" | tee -a $LOG_FILE
 echo "[$TIMESTAMP] 🚀 开始安全同步流程" | tee -a $LOG_FILE
 echo "==========================================" | tee -a $LOG_FILE
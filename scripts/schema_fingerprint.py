@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+表结构指纹 - 从 information_schema 一次读出所有表的列、索引、表选项、外键、CHECK 约束和分区
+
+每类一条查询覆盖整个库（代替每个表一次 SHOW CREATE TABLE），结果规范化后计算指纹：
+不包含 AUTO_INCREMENT 计数器、注释等不影响结构的内容，
+MySQL 8 在 EXTRA 中附加的 DEFAULT_GENERATED 也会去掉。
+外键包括 ON DELETE/ON UPDATE 规则（删除外键会留下其索引，只比较索引发现不了）；
+CHECK 约束需要 MySQL 8.0.16+，更早的版本没有这张表，按没有约束处理。
+diff_schema() 给出具体变更（新增/删除/修改的列、索引、外键、约束和分区，表选项）。
+"""
+
+import hashlib
+import json
+
+# 旧版基线的规范化结构只有这几项（没有外键、约束和分区）
+LEGACY_KEYS = ('columns', 'indexes', 'options')
+
+
+def fetch_schemas(cursor):
+    """返回当前库所有基础表的规范化结构
+    {table: {'columns', 'indexes', 'options', 'foreign_keys', 'checks', 'partitions'}}"""
+    cursor.execute(
+        "SELECT TABLE_NAME, ENGINE, TABLE_COLLATION, CREATE_OPTIONS "
+        "FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_TYPE = 'BASE TABLE'"
+    )
+    schemas = {}
+    for row in cursor.fetchall():
+        schemas[row['TABLE_NAME']] = {
+            'columns': {},
+            'indexes': {},
+            'options': {
+                'engine': row['ENGINE'],
+                'collation': row['TABLE_COLLATION'],
+                'create_options': ' '.join(sorted((row['CREATE_OPTIONS'] or '').split())),
+            },
+            'foreign_keys': {},
+            'checks': {},
+            'partitions': None,
+        }
+
+    cursor.execute(
+        "SELECT TABLE_NAME, COLUMN_NAME, ORDINAL_POSITION, COLUMN_TYPE, IS_NULLABLE, COLUMN_DEFAULT, "
+        "EXTRA, COLLATION_NAME, GENERATION_EXPRESSION "
+        "FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE()"
+    )
+    for row in cursor.fetchall():
+        schema = schemas.get(row['TABLE_NAME'])
+        if schema is None:
+            continue
+        extra = ' '.join(w for w in (row['EXTRA'] or '').split() if w != 'DEFAULT_GENERATED')
+        schema['columns'][row['COLUMN_NAME']] = {
+            'position': int(row['ORDINAL_POSITION']),
+            'type': row['COLUMN_TYPE'].lower(),
+            'nullable': row['IS_NULLABLE'] == 'YES',
+            'default': row['COLUMN_DEFAULT'],
+            'extra': extra.lower(),
+            'collation': row['COLLATION_NAME'],
+            'generated': row['GENERATION_EXPRESSION'] or None,
+        }
+
+    cursor.execute(
+        "SELECT TABLE_NAME, INDEX_NAME, NON_UNIQUE, SEQ_IN_INDEX, COLUMN_NAME, SUB_PART, INDEX_TYPE "
+        "FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() "
+        "ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX"
+    )
+    for row in cursor.fetchall():
+        schema = schemas.get(row['TABLE_NAME'])
+        if schema is None:
+            continue
+        index = schema['indexes'].setdefault(row['INDEX_NAME'], {
+            'unique': not int(row['NON_UNIQUE']),
+            'type': row['INDEX_TYPE'],
+            'columns': [],
+        })
+        column = row['COLUMN_NAME'] or '(expression)'
+        index['columns'].append(f"{column}({row['SUB_PART']})" if row['SUB_PART'] else column)
+
+    cursor.execute(
+        "SELECT k.TABLE_NAME, k.CONSTRAINT_NAME, k.COLUMN_NAME, k.REFERENCED_TABLE_NAME, "
+        "k.REFERENCED_COLUMN_NAME, r.UPDATE_RULE, r.DELETE_RULE "
+        "FROM information_schema.KEY_COLUMN_USAGE k "
+        "JOIN information_schema.REFERENTIAL_CONSTRAINTS r ON r.CONSTRAINT_SCHEMA = k.CONSTRAINT_SCHEMA "
+        "AND r.TABLE_NAME = k.TABLE_NAME AND r.CONSTRAINT_NAME = k.CONSTRAINT_NAME "
+        "WHERE k.TABLE_SCHEMA = DATABASE() AND k.REFERENCED_TABLE_NAME IS NOT NULL "
+        "ORDER BY k.TABLE_NAME, k.CONSTRAINT_NAME, k.ORDINAL_POSITION"
+    )
+    for row in cursor.fetchall():
+        schema = schemas.get(row['TABLE_NAME'])
+        if schema is None:
+            continue
+        fk = schema['foreign_keys'].setdefault(row['CONSTRAINT_NAME'], {
+            'columns': [],
+            'references': row['REFERENCED_TABLE_NAME'],
+            'referenced_columns': [],
+            'on_update': row['UPDATE_RULE'],
+            'on_delete': row['DELETE_RULE'],
+        })
+        fk['columns'].append(row['COLUMN_NAME'])
+        fk['referenced_columns'].append(row['REFERENCED_COLUMN_NAME'])
+
+    try:
+        cursor.execute(
+            "SELECT t.TABLE_NAME, c.CONSTRAINT_NAME, c.CHECK_CLAUSE "
+            "FROM information_schema.TABLE_CONSTRAINTS t "
+            "JOIN information_schema.CHECK_CONSTRAINTS c ON c.CONSTRAINT_SCHEMA = t.CONSTRAINT_SCHEMA "
+            "AND c.CONSTRAINT_NAME = t.CONSTRAINT_NAME "
+            "WHERE t.TABLE_SCHEMA = DATABASE() AND t.CONSTRAINT_TYPE = 'CHECK'"
+        )
+        checks = cursor.fetchall()
+    except Exception:
+        # MySQL 8.0.16 之前没有 CHECK_CONSTRAINTS
+        checks = []
+    for row in checks:
+        schema = schemas.get(row['TABLE_NAME'])
+        if schema is not None:
+            schema['checks'][row['CONSTRAINT_NAME']] = row['CHECK_CLAUSE']
+
+    cursor.execute(
+        "SELECT TABLE_NAME, PARTITION_NAME, SUBPARTITION_NAME, PARTITION_METHOD, PARTITION_EXPRESSION, "
+        "SUBPARTITION_METHOD, SUBPARTITION_EXPRESSION, PARTITION_DESCRIPTION "
+        "FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY TABLE_NAME, PARTITION_ORDINAL_POSITION, SUBPARTITION_ORDINAL_POSITION"
+    )
+    for row in cursor.fetchall():
+        schema = schemas.get(row['TABLE_NAME'])
+        if schema is None:
+            continue
+        if schema['partitions'] is None:
+            schema['partitions'] = {
+                'method': row['PARTITION_METHOD'],
+                'expression': row['PARTITION_EXPRESSION'],
+                'subpartition': (f"{row['SUBPARTITION_METHOD']}({row['SUBPARTITION_EXPRESSION']})"
+                                 if row['SUBPARTITION_METHOD'] else None),
+                'parts': {},
+            }
+        name = row['PARTITION_NAME'] + (f".{row['SUBPARTITION_NAME']}" if row['SUBPARTITION_NAME'] else '')
+        schema['partitions']['parts'][name] = row['PARTITION_DESCRIPTION']
+    return schemas
+
+
+def schema_fingerprint(schema):
+    """规范化结构的指纹"""
+    return hashlib.md5(json.dumps(schema, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def describe_column(column):
+    text = column['type']
+    if not column['nullable']:
+        text += ' NOT NULL'
+    if column['default'] is not None:
+        text += f" DEFAULT {column['default']}"
+    if column['extra']:
+        text += f" {column['extra']}"
+    return text
+
+
+def describe_index(index):
+    kind = 'UNIQUE ' if index['unique'] else ''
+    return f"{kind}({', '.join(index['columns'])})"
+
+
+def describe_foreign_key(fk):
+    return (f"({', '.join(fk['columns'])}) → {fk['references']}({', '.join(fk['referenced_columns'])}) "
+            f"ON DELETE {fk['on_delete']} ON UPDATE {fk['on_update']}")
+
+
+def describe_partitions(partitions):
+    if not partitions:
+        return '无分区'
+    text = f"{partitions['method']}({partitions['expression']})"
+    if partitions['subpartition']:
+        text += f" SUBPARTITION {partitions['subpartition']}"
+    return f"{text} {len(partitions['parts'])} 个分区"
+
+
+def legacy_fingerprint(schema):
+    """只按旧版基线包含的几项计算的指纹，用于升级旧基线"""
+    return schema_fingerprint({key: schema.get(key) for key in LEGACY_KEYS})
+
+
+def diff_named(changes, label, old, new, describe):
+    """按名称比较一组定义（索引、外键、约束）"""
+    for name in sorted(set(old) | set(new)):
+        before, after = old.get(name), new.get(name)
+        if before is None:
+            changes.append(f"新增{label} {name} {describe(after)}")
+        elif after is None:
+            changes.append(f"删除{label} {name}")
+        elif before != after:
+            changes.append(f"修改{label} {name}: {describe(before)} → {describe(after)}")
+
+
+def diff_schema(old, new):
+    """两个规范化结构的差异，返回可读的变更列表"""
+    changes = []
+    old_columns, new_columns = old.get('columns', {}), new.get('columns', {})
+    names = sorted(set(old_columns) | set(new_columns),
+                   key=lambda n: (new_columns.get(n) or old_columns[n])['position'])
+    for name in names:
+        before, after = old_columns.get(name), new_columns.get(name)
+        if before is None:
+            changes.append(f"新增列 {name} {describe_column(after)}")
+        elif after is None:
+            changes.append(f"删除列 {name}")
+        elif {k: v for k, v in before.items() if k != 'position'} != {k: v for k, v in after.items() if k != 'position'}:
+            changes.append(f"修改列 {name}: {describe_column(before)} → {describe_column(after)}")
+        elif before['position'] != after['position']:
+            changes.append(f"列 {name} 位置: {before['position']} → {after['position']}")
+
+    diff_named(changes, '索引', old.get('indexes', {}), new.get('indexes', {}), describe_index)
+    # 旧版基线没有外键/约束/分区，不比较这几项
+    if 'foreign_keys' in old:
+        diff_named(changes, '外键', old['foreign_keys'], new.get('foreign_keys', {}), describe_foreign_key)
+    if 'checks' in old:
+        diff_named(changes, 'CHECK 约束', old['checks'], new.get('checks', {}), lambda clause: clause)
+    if 'partitions' in old:
+        before, after = old['partitions'], new.get('partitions')
+        if (before and after and {k: v for k, v in before.items() if k != 'parts'}
+                == {k: v for k, v in after.items() if k != 'parts'}):
+            diff_named(changes, '分区', before['parts'], after['parts'],
+                       lambda description: f"VALUES {description}" if description is not None else '')
+        elif before != after:
+            changes.append(f"分区: {describe_partitions(before)} → {describe_partitions(after)}")
+
+    old_options, new_options = old.get('options', {}), new.get('options', {})
+    for key in sorted(set(old_options) | set(new_options)):
+        if old_options.get(key) != new_options.get(key):
+            changes.append(f"表选项 {key}: {old_options.get(key)} → {new_options.get(key)}")
+    return changes
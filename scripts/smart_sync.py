@@ -4,9 +4,13 @@
 智能同步引擎 - 增量同步到Cloud SQL
 """
 
-import pymysql
 import subprocess
+import tempfile
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
 import sys
@@ -17,44 +21,184 @@ from dotenv import load_dotenv
 
 load_dotenv('/opt/mysql-sync/.env')
 
+# 部署目录，可用 SYNC_HOME 指向其他目录（本地测试/基准测试）
+SYNC_HOME = Path(os.getenv('SYNC_HOME', '/opt/mysql-sync'))
+
+from db_pool import connect_db
+from delta_sync import DeltaSyncer
+from chunk_checksum import ChunkSyncer
+from stream_sync import StreamSyncer, LoadInterrupted
+from sync_targets import SyncTarget, target_names
+from sync_planner import SyncPlanner
+from snapshot import PassSnapshot
+from transport import Transport
+import sync_metrics
+from table_metadata import fetch_table_metadata, metadata_reliable, metadata_fingerprint
+
+# SYNC_MODE 对应的增量同步方式，full 为原来的整表同步，auto 按同步计划逐表选择
+INCREMENTAL_SYNCERS = {'delta': DeltaSyncer, 'chunk': ChunkSyncer}
+
 class SmartSyncEngine:
-    def __init__(self):
-        self.cache_dir = Path('/opt/mysql-sync/cache')
-        self.log_dir = Path('/opt/mysql-sync/logs')
+    def __init__(self, recover=True):
+        self.cache_dir = SYNC_HOME / 'cache'
+        self.log_dir = SYNC_HOME / 'logs'
         self.log_dir.mkdir(exist_ok=True)
         
-        self.checksum_file = self.cache_dir / 'table_checksums.json'
-        self.load_checksums()
+        # SYNC_TARGETS 中的每个目标有自己的已同步校验和和同步日志，第一个为主目标（沿用原文件名）
+        self.targets = [SyncTarget(self.cache_dir, name, primary=(i == 0))
+                        for i, name in enumerate(target_names())]
+        self.primary = self.targets[0]
+        self.journal = self.primary.journal
+        if recover:
+            for target in self.targets:
+                target.journal.recover()
+        # 本轮每个变化的表需要同步到的目标 {table: [SyncTarget]}
+        self.pending = {}
+        
+        # 元数据预筛选：元数据未变的表跳过 CHECKSUM TABLE，每隔一段时间强制全部校验一次
+        self.metadata_file = self.cache_dir / 'table_metadata.json'
+        self.full_check_interval = float(os.getenv('META_FULL_CHECK_MINUTES', 60)) * 60
+        self.metadata = None
+        self.load_metadata()
+        
+        # 并发配置：SYNC_WORKERS=1 时保持原来的串行同步
+        self.workers = max(1, int(os.getenv('SYNC_WORKERS', 1)))
+        # 并行全量的大表每个额外工作线程再占一对名额，默认上限为此多留 SYNC_TABLE_WORKERS-1 个，
+        # 否则默认配置下大表只能用一个线程；显式配置的 *_MAX_CONCURRENCY 不变
+        default_limit = self.workers + max(1, int(os.getenv('SYNC_TABLE_WORKERS', 4))) - 1
+        self.middle_limit = max(1, int(os.getenv('MIDDLE_MAX_CONCURRENCY', default_limit)))
+        self.middle_slots = threading.BoundedSemaphore(self.middle_limit)
+        self.cloud_slots = threading.BoundedSemaphore(
+            max(1, int(os.getenv('CLOUD_MAX_CONCURRENCY', default_limit))))
+        # 常驻进程的 critical 通道另有 CRITICAL_LANE_SLOTS 对预留名额（在上面的上限之外），
+        # 不与后台大表通道争用，大表在 CHECKSUM 或重载时关键表照常同步
+        critical_slots = max(1, int(os.getenv('CRITICAL_LANE_SLOTS', 1)))
+        self.critical_middle_slots = threading.BoundedSemaphore(critical_slots)
+        self.critical_cloud_slots = threading.BoundedSemaphore(critical_slots)
+        # 调度器通道中的表 {table: lane}
+        self.table_lanes = {}
+        self.print_lock = threading.Lock()
+        # 调度器的多个通道可能同时运行（各自的表不重叠），校验和/元数据指纹/待同步表/计划的读写需要串行；
+        # 只在读取和合并这些状态时持有，CHECKSUM TABLE 和同步期间不持有。
+        # 每轮的元数据和结果通过参数和 report 传递，不依赖引擎上的共享字段
+        self.state_lock = threading.Lock()
+        self.last_result = None
+        
+        # SYNC_MODE=delta 按水位线增量同步，chunk 按主键分块摘要同步，不适用的表回退全量；
+        # auto 两种都启用，由同步计划按估算耗时逐表选择
+        self.mode = os.getenv('SYNC_MODE', 'full')
+        for target in self.targets:
+            target.syncers = {name: cls(self, target) for name, cls in INCREMENTAL_SYNCERS.items()
+                              if self.mode in (name, 'auto')}
+        # 同步计划按主目标的增量状态估算
+        self.syncers = self.primary.syncers
+        
+        # 全量同步方式：native 为进程内流式同步（失败时回退 mysqldump），loaddata 同样流式读取、
+        # 用 LOAD DATA LOCAL INFILE 写入，mysqldump 为原管道方式
+        self.pipeline = os.getenv('SYNC_PIPELINE', 'native')
+        self.streamer = StreamSyncer(self)
+        self.transport = Transport(self.cache_dir)
+        if self.pipeline in ('native', 'loaddata') and self.transport.compressed:
+            # PyMySQL 不支持协议压缩（compress 参数直接报错），流式同步无法压缩
+            print(f"⚠️  SYNC_COMPRESSION={self.transport.mode}: PyMySQL 不支持协议压缩，"
+                  f"SYNC_PIPELINE={self.pipeline} 的全量同步全部改走 mysqldump 管道"
+                  f"（各表 method 记为 mysqldump (compression)）", flush=True)
+        self.table_stats = {}
+        self.planner = SyncPlanner(self)
+        self.plans = {}
+        
+        # SYNC_SNAPSHOT=pass 时一轮同步的所有表从同一个一致性快照读取（相关表时间点一致），
+        # table 为每个表单独读取；调度器的多个通道并发时各自有快照，按表登记
+        self.snapshot_mode = os.getenv('SYNC_SNAPSHOT', 'pass')
+        self.snapshots = {}
+    
+    def log(self, message):
+        """线程安全的输出"""
+        with self.print_lock:
+            print(message, flush=True)
     
     def load_checksums(self):
-        """加载上次的表校验和"""
-        if self.checksum_file.exists():
-            with open(self.checksum_file, 'r') as f:
-                self.last_checksums = json.load(f)
-        else:
-            self.last_checksums = {}
+        """加载各目标上次的表校验和"""
+        for target in self.targets:
+            target.load_checksums()
     
     def save_checksums(self):
-        """保存校验和"""
-        with open(self.checksum_file, 'w') as f:
-            json.dump(self.last_checksums, f, indent=2)
+        for target in self.targets:
+            target.save_checksums()
+    
+    def load_metadata(self):
+        """加载上次的元数据指纹"""
+        if self.metadata_file.exists():
+            with open(self.metadata_file, 'r') as f:
+                self.last_metadata = json.load(f)
+        else:
+            self.last_metadata = {'tables': {}, 'full_checked': {}}
+    
+    def save_metadata(self):
+        """保存元数据指纹"""
+        with open(self.metadata_file, 'w') as f:
+            json.dump(self.last_metadata, f, indent=2)
+    
+    def lane_slots(self, table):
+        """表所在通道使用的 (MIDDLE, CLOUD) 并发名额：critical 通道用预留名额"""
+        if self.table_lanes.get(table) == 'critical':
+            return self.critical_middle_slots, self.critical_cloud_slots
+        return self.middle_slots, self.cloud_slots
+    
+    @contextmanager
+    def slots(self, table):
+        """同步 table 期间占用一对名额（先占MIDDLE再占CLOUD，固定顺序避免互相等待）"""
+        middle, cloud = self.lane_slots(table)
+        with middle, cloud:
+            yield
     
     def connect_db(self, prefix='MIDDLE'):
-        """连接数据库"""
-        return pymysql.connect(
-            host=os.getenv(f'{prefix}_HOST'),
-            port=int(os.getenv(f'{prefix}_PORT', 3306)),
-            user=os.getenv(f'{prefix}_USER'),
-            password=os.getenv(f'{prefix}_PASS'),
-            database=os.getenv(f'{prefix}_DB'),
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor
-        )
-    
-    def get_table_checksum(self, table):
-        """获取表的校验和"""
-        conn = self.connect_db('MIDDLE')
-        cursor = conn.cursor()
+        """从共享连接池获取连接（close() 即归还）"""
+        return connect_db(prefix)
+    
+    def read_conn(self, table):
+        """读取表数据的 MIDDLE 连接：本轮有共享快照时取快照连接，否则从连接池取"""
+        snapshot = self.snapshots.get(table)
+        return snapshot.acquire() if snapshot else self.connect_db('MIDDLE')
+    
+    def open_pass_snapshot(self, tables, plans):
+        """为本轮同步的表打开共享快照，失败时退回每个表单独读取"""
+        if self.snapshot_mode != 'pass' or not tables:
+            return None
+        # 每个并发同步的表一个连接，并行全量的大表再多占 SYNC_TABLE_WORKERS-1 个，不超过 MIDDLE 并发上限
+        parallel = any(plan.get('strategy') == 'parallel' for plan in plans.values())
+        default = min(self.workers, len(tables)) + (self.streamer.table_workers - 1 if parallel else 0)
+        default = min(default, self.middle_limit)
+        count = max(1, int(os.getenv('SNAPSHOT_CONNECTIONS', default)))
+        try:
+            snapshot = PassSnapshot('MIDDLE', count, tables)
+        except Exception as e:
+            print(f"  ⚠️  打开一致性快照失败（{e}），各表单独读取")
+            return None
+        for table in tables:
+            self.snapshots[table] = snapshot
+        print(f"📸 一致性快照: {len(tables)} 个表, {count} 个连接, {snapshot.describe()}")
+        return snapshot
+    
+    def close_pass_snapshot(self, snapshot):
+        if snapshot is None:
+            return
+        for table in snapshot.tables:
+            if self.snapshots.get(table) is snapshot:
+                del self.snapshots[table]
+        snapshot.close()
+        try:
+            with open(self.cache_dir / 'sync_snapshot.json', 'w') as f:
+                json.dump(dict(snapshot.coordinates, tables=snapshot.tables), f, indent=2)
+        except Exception as e:
+            print(f"  ⚠️  保存快照位置失败: {e}")
+    
+    def get_table_checksum(self, table, cursor=None):
+        """获取表的校验和（可复用调用方的游标）"""
+        own_conn = cursor is None
+        if own_conn:
+            conn = self.connect_db('MIDDLE')
+            cursor = conn.cursor()
         
         try:
             cursor.execute(f"CHECKSUM TABLE `{table}`")
@@ -64,56 +208,262 @@ class SmartSyncEngine:
             print(f"  ⚠️  {table}: {e}")
             checksum = None
         finally:
-            cursor.close()
-            conn.close()
+            if own_conn:
+                cursor.close()
+                conn.close()
         
         return checksum
     
-    def find_changed_tables(self):
-        """找出变化的表"""
+    def recently_updated(self, meta, seconds=5):
+        """UPDATE_TIME 是否在最近几秒内"""
+        if not meta.get('update_time'):
+            return False
+        updated = datetime.fromisoformat(meta['update_time'])
+        return (datetime.now() - updated).total_seconds() < seconds
+    
+    def find_changed_tables(self, metadata=None, tables=None, dry_run=False):
+        """找出变化的表（先比较元数据，只对可能变化的表做 CHECKSUM）；tables 限定检查范围，
+        dry_run 时不记录待同步状态、不写缓存。
+        CHECKSUM TABLE 可能很慢（大表），期间不持有 state_lock，其他通道可以同时扫描和同步"""
         print("🔍 扫描变化的表...")
-        
         conn = self.connect_db('MIDDLE')
         cursor = conn.cursor()
         
-        cursor.execute("SHOW TABLES")
-        all_tables = [list(row.values())[0] for row in cursor.fetchall()]
-        
-        cursor.close()
-        conn.close()
+        try:
+            if metadata is None:
+                metadata = fetch_table_metadata(cursor)
+            
+            # 强制全量校验按表计时（调度器每次只检查部分表），兼容旧版的全局时间
+            now = time.time()
+            with self.state_lock:
+                self.metadata = metadata
+                full_checked = dict(self.last_metadata.get('full_checked', {}))
+                legacy_full_check = self.last_metadata.get('last_full_check', 0)
+                last_fingerprints = dict(self.last_metadata.get('tables', {}))
+                known = {t.name: set(t.last_checksums) for t in self.targets}
+            
+            candidates = []
+            unchanged_count = 0
+            for table, meta in sorted(metadata.items()):
+                if table.startswith('_') or (tables is not None and table not in tables):
+                    continue
+                
+                full_check = now - full_checked.get(table, legacy_full_check) >= self.full_check_interval
+                fingerprint = metadata_fingerprint(meta)
+                settled = all(t.journal.settled(table) for t in self.targets)
+                if (not full_check and settled and metadata_reliable(meta)
+                        and all(table in known[t.name] for t in self.targets)
+                        and last_fingerprints.get(table) == fingerprint):
+                    unchanged_count += 1
+                    continue
+                candidates.append((table, meta, full_check, fingerprint, settled))
+            
+            checksums = {table: self.get_table_checksum(table, cursor) for table, *_ in candidates}
+        finally:
+            cursor.close()
+            conn.close()
         
+        with self.state_lock:
+            return self.merge_scan(metadata, candidates, checksums, unchanged_count, now, dry_run)
+    
+    def merge_scan(self, metadata, candidates, checksums, unchanged_count, now, dry_run=False):
+        """把扫描结果合并到元数据指纹、待同步状态（调用方持有 state_lock）"""
+        full_checked = self.last_metadata.setdefault('full_checked', {})
+        self.last_metadata.pop('last_full_check', None)
+        last_fingerprints = self.last_metadata.setdefault('tables', {})
         changed_tables = []
-        unchanged_count = 0
+        full_checks = 0
         
-        for table in all_tables:
-            if table.startswith('_'):
-                continue
+        for table, meta, full_check, fingerprint, settled in candidates:
+            current_checksum = checksums[table]
+            if full_check and current_checksum is not None:
+                full_checked[table] = now
+                full_checks += 1
             
-            current_checksum = self.get_table_checksum(table)
-            last_checksum = self.last_checksums.get(table)
+            # UPDATE_TIME 精度为秒，刚刚写入的表不记录指纹，避免同一秒内的后续写入被漏掉
+            if current_checksum is not None and not self.recently_updated(meta):
+                last_fingerprints[table] = fingerprint
+            else:
+                last_fingerprints.pop(table, None)
             
-            if current_checksum != last_checksum:
+            # 每个目标分别比较；上次同步失败或中断的目标即使校验和相同也要重试（目标表可能只写了一半）
+            needed = []
+            waiting = False
+            for target in self.targets:
+                target_settled = target.journal.settled(table)
+                if current_checksum == target.last_checksums.get(table) and target_settled:
+                    continue
+                wait = target.journal.retry_wait(table)
+                if wait > 0:
+                    print(f"  ⏳ {table}{target.label} - 上次同步失败，{wait:.0f}s 后重试")
+                    waiting = True
+                    continue
+                needed.append(target)
+                # 已同步校验和在同步成功后才更新，失败的表下一轮仍会被检测到
+                if not dry_run:
+                    target.journal.mark_pending(table, current_checksum)
+            if needed:
                 changed_tables.append(table)
-                self.last_checksums[table] = current_checksum
-                print(f"  ✓ {table} - 已变化")
-            else:
+                if not dry_run:
+                    # 预演不改变待同步目标，否则同时运行的通道会按预演结果同步
+                    self.pending[table] = needed
+                names = f" → {', '.join(t.name for t in needed)}" if len(self.targets) > 1 else ''
+                print(f"  ✓ {table} - {'已变化' if settled else '重试'}{names}")
+            elif not waiting:
                 unchanged_count += 1
         
-        print(f"  变化: {len(changed_tables)} 个, 未变化: {unchanged_count} 个")
+        print(f"  变化: {len(changed_tables)} 个, 未变化: {unchanged_count} 个"
+              f" (CHECKSUM {len(candidates)} 个{f', 其中定期全量校验 {full_checks} 个' if full_checks else ''})")
+        
+        if dry_run:
+            # 合并时改动的指纹/校验时间只在内存中，恢复为磁盘上的状态
+            self.load_metadata()
+            return changed_tables
         
+        self.last_metadata['tables'] = {t: f for t, f in last_fingerprints.items() if t in metadata}
+        self.last_metadata['full_checked'] = {t: v for t, v in full_checked.items() if t in metadata}
         self.save_checksums()
+        self.save_metadata()
         
         return changed_tables
     
+    def get_table_sizes(self, tables, metadata=None):
+        """获取表大小（数据+索引字节数），用于大表优先调度；metadata 为本轮的元数据快照"""
+        if metadata is None:
+            metadata = self.metadata
+        if metadata is not None:
+            return {table: metadata.get(table, {}).get('data_length', 0)
+                    + metadata.get(table, {}).get('index_length', 0) for table in tables}
+        
+        conn = self.connect_db('MIDDLE')
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute(
+                "SELECT TABLE_NAME, DATA_LENGTH + INDEX_LENGTH AS size "
+                "FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE()"
+            )
+            sizes = {row['TABLE_NAME']: int(row['size'] or 0) for row in cursor.fetchall()}
+        except Exception as e:
+            print(f"  ⚠️  获取表大小失败: {e}")
+            sizes = {}
+        finally:
+            cursor.close()
+            conn.close()
+        
+        return {table: sizes.get(table, 0) for table in tables}
+    
+    def table_targets(self, table):
+        """本轮该表需要同步到的目标（单独调用 sync_table 时为全部目标）"""
+        return self.pending.get(table) or self.targets
+    
     def sync_table(self, table):
-        """同步单个表到Cloud SQL"""
-        print(f"  同步表: {table} ", end='', flush=True)
+        """按同步计划同步单个表到各目标（增量/分块不适用时回退全量），返回 {目标: 是否成功}"""
+        plan = self.plans.get(table) or {}
+        strategy = plan.get('strategy', 'full')
+        targets = self.table_targets(table)
+        results = {}
+        
+        # 增量/分块只读取变化的部分，各目标按自己的状态分别同步（多个目标时并发）；
+        # verify 为增量表到期的分块校验，由增量同步器执行
+        incremental = [t for t in targets
+                       if strategy in t.syncers or (strategy == 'verify' and 'delta' in t.syncers)]
+        if incremental:
+            def incremental_sync(target):
+                with self.slots(table):
+                    if strategy == 'verify':
+                        return target.syncers['delta'].verify_table(table)
+                    return target.syncers[strategy].sync_table(table)
+            if len(incremental) == 1:
+                outcomes = [incremental_sync(incremental[0])]
+            else:
+                with ThreadPoolExecutor(max_workers=len(incremental)) as pool:
+                    outcomes = list(pool.map(incremental_sync, incremental))
+            for target, result in zip(incremental, outcomes):
+                if result is not None:
+                    results[target.name] = result
+            if self.primary.name in results:
+                self.table_stats.setdefault(table, {})['strategy'] = strategy
+        
+        # 需要全量的目标共用一次读取
+        full = [t for t in targets if t.name not in results]
+        if full:
+            # 没有计划时（如单独调用）沿用 SYNC_MODE 的增量方式作为全量后的起点
+            seed = plan.get('seed', self.mode if self.mode in self.syncers else None)
+            results.update(self.journaled_full_sync(table, full, seed, strategy == 'parallel' or None))
+        return results
+    
+    def journaled_full_sync(self, table, targets, seed=None, parallel=None):
+        """全量同步到 targets，记录开始时的增量起点（seed 为 delta/chunk）；中断后续传时沿用第一次的起点。
+        返回 {目标: 是否成功}"""
+        resumed, begin = targets[0].journal.resume_state(table) if len(targets) == 1 else (False, None)
+        if resumed and not (isinstance(begin, dict) and 'seed' in begin):
+            # 旧版日志只记录了 SYNC_MODE 对应方式的起点
+            begin = {'seed': self.mode if self.mode in self.syncers else None, 'state': begin}
+        if not resumed:
+            # 起点从 MIDDLE 读一次，所有目标共用
+            syncer = targets[0].syncers.get(seed)
+            begin = {'seed': seed if syncer else None,
+                     'state': syncer.begin_full(table) if syncer else None}
+            for target in targets:
+                target.journal.begin_load(table, begin)
+        results = self.full_sync_table(table, targets, parallel)
+        for target in targets:
+            if not results.get(target.name):
+                continue
+            # 目标表已整表替换，其他方式的水位线/分块索引不再对应该目标，一并清除
+            for name, syncer in target.syncers.items():
+                syncer.finish_full(table, begin['state'] if name == begin['seed'] else None)
+            target.journal.clear_load(table)
+            if resumed:
+                # 续传后改用 mysqldump 完成时，断点留下的影子表需要清理
+                self.streamer.drop_shadow(f"_{table}_new", target.name)
+        return results
+    
+    def full_sync_table(self, table, targets=None, parallel=None):
+        """全量同步单个表到 targets（默认主目标）：优先进程内流式同步（读一次写入所有目标），
+        整体失败时回退 mysqldump；parallel 为 None 时按表大小决定是否按主键区间并行。返回 {目标: 是否成功}"""
+        targets = targets or [self.primary]
+        # PyMySQL 不支持协议压缩，开启压缩时走 mysql 客户端管道（启动时已告警，method 中注明原因）
+        if self.pipeline in ('native', 'loaddata') and self.transport.compressed:
+            return {t.name: self.dump_table(table, t, 'compression') for t in targets}
+        if self.pipeline in ('native', 'loaddata'):
+            try:
+                with self.slots(table):
+                    stats = self.streamer.sync_table(table, parallel, targets)
+                counter = self.transport.counter()
+                counter.add_size(stats.bytes * len(targets))
+                transfer = self.transport.record(table, counter)
+                if self.primary in targets:
+                    self.table_stats[table] = dict(stats.as_dict(), **transfer)
+                    self.table_stats[table]['strategy'] = 'parallel' if stats.parallel else 'full'
+                done = [t.name for t in targets if t.name not in stats.failed]
+                names = f" → {', '.join(done)}" if done != [self.primary.name] else ''
+                self.log(f"  同步表: {table} ✅ {stats.summary()} ({stats.elapsed:.1f}s){names}")
+                # 单个目标写入失败或落后时只记该目标失败，按重试间隔单独重试
+                for name, error in stats.failed.items():
+                    self.log(f"  同步表: {table} → {name} ❌ {error}")
+                return {t.name: t.name not in stats.failed for t in targets}
+            except LoadInterrupted as e:
+                # 已完成的区间保留，按重试间隔续传，不回退整表 mysqldump
+                self.log(f"  同步表: {table} ❌ {e}")
+                return {t.name: False for t in targets}
+            except Exception as e:
+                self.log(f"  ⚠️  {table}: 流式同步失败（{e}），回退 mysqldump")
+                return {t.name: self.dump_table(table, t, 'fallback') for t in targets}
+        return {t.name: self.dump_table(table, t) for t in targets}
+    
+    def dump_table(self, table, target=None, reason=None):
+        """mysqldump | mysql 全量同步单个表到 target（默认主目标）；reason 为没有走流式同步的原因，
+        记录在该表的 method 中"""
+        start = time.time()
+        target = target or self.primary
         
         middle_db = os.getenv('MIDDLE_DB')
-        cloud_host = os.getenv('CLOUD_HOST')
-        cloud_user = os.getenv('CLOUD_USER')
-        cloud_pass = os.getenv('CLOUD_PASS')
-        cloud_db = os.getenv('CLOUD_DB')
+        cloud_host = os.getenv(f'{target.name}_HOST')
+        cloud_user = os.getenv(f'{target.name}_USER')
+        cloud_pass = os.getenv(f'{target.name}_PASS')
+        cloud_db = os.getenv(f'{target.name}_DB')
         middle_pass = os.getenv('MIDDLE_PASS')
         
         dump_cmd = [
@@ -137,46 +487,211 @@ class SmartSyncEngine:
             '-h', cloud_host,
             f'-u{cloud_user}',
             f'-p{cloud_pass}',
+            *self.transport.client_args(),
             cloud_db
         ]
         
+        if table in self.snapshots:
+            self.log(f"  ⚠️  {table}: mysqldump 使用自己的事务，不在本轮一致性快照内")
+        
+        with self.slots(table):
+            dump_proc = import_proc = None
+            # stderr 都写临时文件，避免管道写满导致进程卡住
+            dump_errors = tempfile.TemporaryFile()
+            import_errors = tempfile.TemporaryFile()
+            counter = self.transport.counter()
+            try:
+                dump_proc = subprocess.Popen(
+                    dump_cmd,
+                    stdout=subprocess.PIPE,
+                    stderr=dump_errors
+                )
+                
+                import_proc = subprocess.Popen(
+                    import_cmd,
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.DEVNULL,
+                    stderr=import_errors
+                )
+                
+                # 数据流经传输层中转：统计字节数并按带宽上限限速
+                relay = threading.Thread(
+                    target=self.transport.relay,
+                    args=(dump_proc.stdout, import_proc.stdin, counter),
+                    daemon=True
+                )
+                relay.start()
+                import_proc.wait(timeout=300)
+                dump_proc.wait(timeout=10)
+                relay.join(timeout=10)
+                elapsed = time.time() - start
+                
+                if import_proc.returncode == 0 and dump_proc.returncode == 0:
+                    method = f"mysqldump ({reason})" if reason else 'mysqldump'
+                    stats = {'seconds': round(elapsed, 2), 'strategy': 'full', 'method': method}
+                    stats.update(self.transport.record(table, counter))
+                    if target.primary:
+                        self.table_stats[table] = stats
+                    rate = stats.get('raw_bytes', 0) / 1024 / 1024 / max(elapsed, 0.001)
+                    self.log(f"  同步表: {table}{target.label} ✅ {method} {self.transfer_summary(stats)}, "
+                             f"{rate:.1f} MB/s ({elapsed:.1f}s)")
+                    return True
+                else:
+                    import_errors.seek(0)
+                    dump_errors.seek(0)
+                    error_msg = (import_errors.read().decode(errors='replace').strip()
+                                 or dump_errors.read().decode(errors='replace').strip())
+                    self.log(f"  同步表: {table}{target.label} ❌ {error_msg[:100]}")
+                    return False
+                    
+            except subprocess.TimeoutExpired:
+                dump_proc.kill()
+                import_proc.kill()
+                self.log(f"  同步表: {table}{target.label} ❌ 超时")
+                return False
+            except Exception as e:
+                for proc in (dump_proc, import_proc):
+                    if proc and proc.poll() is None:
+                        proc.kill()
+                self.log(f"  同步表: {table}{target.label} ❌ {e}")
+                return False
+            finally:
+                if dump_proc:
+                    dump_proc.stdout.close()
+                dump_errors.close()
+                import_errors.close()
+    
+    def transfer_summary(self, stats):
+        """传输字节摘要（开启压缩时显示压缩后字节）"""
+        raw = stats.get('raw_bytes', 0) / 1024 / 1024
+        if stats.get('compression', 'none') == 'none':
+            return f"{raw:.1f} MB"
+        wire = stats.get('wire_bytes', 0) / 1024 / 1024
+        return f"{raw:.1f} MB → ~{wire:.1f} MB ({stats['compression']})"
+    
+    def timed_sync_table(self, table, metadata=None):
+        """同步并记录单表耗时，各目标分别记录成功/失败；所有目标都成功才算成功"""
+        start = time.time()
+        self.table_stats.pop(table, None)
+        targets = self.table_targets(table)
+        for target in targets:
+            target.journal.mark_in_flight(table)
         try:
-            dump_proc = subprocess.Popen(
-                dump_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-            
-            import_proc = subprocess.Popen(
-                import_cmd,
-                stdin=dump_proc.stdout,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-            
-            dump_proc.stdout.close()
-            import_output, import_error = import_proc.communicate(timeout=300)
-            
-            if import_proc.returncode == 0:
-                print("✅")
-                return True
+            results = self.sync_table(table)
+        except Exception as e:
+            for target in targets:
+                target.journal.mark_failed(table, e)
+            raise
+        finally:
+            self.table_stats.setdefault(table, {})['seconds'] = round(time.time() - start, 2)
+        for target in targets:
+            if results.get(target.name):
+                checksum = target.journal.mark_done(table)
+                with self.state_lock:
+                    target.last_checksums[table] = checksum
+                    target.save_checksums()
             else:
-                error_msg = import_error.decode().strip()
-                print(f"❌ {error_msg[:100]}")
-                return False
-                
-        except subprocess.TimeoutExpired:
-            dump_proc.kill()
-            import_proc.kill()
-            print("❌ 超时")
-            return False
+                delay = target.journal.mark_failed(table, '同步失败')
+                self.log(f"  ↻ {table}{target.label}: {delay:.0f}s 后重试")
+        if results.get(self.primary.name):
+            try:
+                self.planner.observe(table, self.table_stats[table], (metadata or self.metadata or {}).get(table))
+            except Exception as e:
+                self.log(f"  ⚠️  {table}: 记录同步耗时失败: {e}")
+        return all(results.get(t.name) for t in targets)
+    
+    def plan_tables(self, tables, metadata=None):
+        """为变化的表生成同步计划并输出各方式的表数"""
+        plans = self.planner.plan(tables, metadata if metadata is not None else self.metadata)
+        counts = {}
+        for plan in plans.values():
+            counts[plan['strategy']] = counts.get(plan['strategy'], 0) + 1
+        total = sum(plan['seconds'] for plan in plans.values())
+        print(f"📋 同步计划: {', '.join(f'{s} {n} 个' for s, n in sorted(counts.items()))}"
+              f"，预计 {total:.0f}s")
+        return plans
+    
+    def sync_tables(self, tables, plans=None, metadata=None):
+        """按同步计划中预计耗时最长的表优先同步，返回汇总结果（含本轮各表的统计 table_stats）"""
+        start = time.time()
+        if plans is None:
+            plans = self.plan_tables(tables, metadata)
+        with self.state_lock:
+            self.plans.update(plans)
+        sizes = self.get_table_sizes(tables, metadata)
+        ordered = sorted(tables, key=lambda t: (plans.get(t, {}).get('seconds', 0), sizes.get(t, 0)),
+                         reverse=True)
+        
+        results = {}
+        snapshot = self.open_pass_snapshot(ordered, plans)
+        try:
+            if self.workers == 1 or len(ordered) == 1:
+                for table in ordered:
+                    results[table] = self.timed_sync_table(table, metadata)
+            else:
+                with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                    futures = {pool.submit(self.timed_sync_table, table, metadata): table for table in ordered}
+                    for future in as_completed(futures):
+                        table = futures[future]
+                        try:
+                            results[table] = future.result()
+                        except Exception as e:
+                            self.log(f"  同步表: {table} ❌ {e}")
+                            results[table] = False
+        finally:
+            self.close_pass_snapshot(snapshot)
+            with self.state_lock:
+                for table in ordered:
+                    self.pending.pop(table, None)
+        
+        result = {
+            'total': len(ordered),
+            'success': [t for t in ordered if results.get(t)],
+            'failed': [t for t in ordered if not results.get(t)],
+            'bytes_estimated': sum(sizes.values()),
+            'bytes_planned': sum(plans.get(t, {}).get('bytes', 0) for t in ordered),
+            'snapshot': snapshot.coordinates if snapshot else None,
+            'targets': self.target_status(),
+            'duration': round(time.time() - start, 2),
+            # 各通道的表不重叠，这些表的统计只由本轮写入
+            'table_stats': {t: dict(self.table_stats.get(t, {})) for t in ordered},
+        }
+        with self.state_lock:
+            self.last_result = result
+        return result
+    
+    def target_status(self):
+        """各目标的同步延迟和失败的表数"""
+        status = {}
+        for target in self.targets:
+            counts, failed = target.journal.summary()
+            status[target.name] = {'lag': round(target.journal.lag(), 1), 'failed': len(failed)}
+        return status
+    
+    def record_metrics(self, result, checksum_seconds):
+        """写入指标状态文件和 Prometheus 文件，失败不影响同步"""
+        try:
+            sync_metrics.record_sync(result, result.get('table_stats', {}), checksum_seconds)
         except Exception as e:
-            print(f"❌ {e}")
-            return False
+            print(f"  ⚠️  写入指标失败: {e}")
     
-    def run(self):
-        """执行同步"""
-        pause_file = Path('/opt/mysql-sync/PAUSE_SYNC')
+    def run(self, metadata=None, tables=None, report=None, lane=None):
+        """执行同步（metadata 为常驻进程共享的元数据快照，tables 为调度器选出的表，lane 为其所在通道，
+        report 字典用于返回本轮检测到变化的表、同步结果和各表统计；调度器的多个通道共用一个引擎时
+        只读 report，不读引擎上的字段）"""
+        if lane and tables:
+            with self.state_lock:
+                self.table_lanes.update((table, lane) for table in tables)
+        try:
+            return self.run_pass(metadata, tables, report)
+        finally:
+            if lane and tables:
+                with self.state_lock:
+                    for table in tables:
+                        self.table_lanes.pop(table, None)
+    
+    def run_pass(self, metadata, tables, report):
+        pause_file = SYNC_HOME / 'PAUSE_SYNC'
         if pause_file.exists():
             print("🚫 同步已暂停（数据保护告警）")
             print(f"   查看详情: cat {pause_file}")
@@ -186,26 +701,62 @@ class SmartSyncEngine:
         print(f"🔄 智能同步 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         print("="*70)
         
-        changed_tables = self.find_changed_tables()
+        pass_start = time.time()
+        if metadata is None:
+            # 本轮的元数据快照，后续计划/排序/耗时记录都用这一份
+            conn = self.connect_db('MIDDLE')
+            cursor = conn.cursor()
+            try:
+                metadata = fetch_table_metadata(cursor)
+            finally:
+                cursor.close()
+                conn.close()
+        changed_tables = self.find_changed_tables(metadata, tables)
+        checksum_seconds = time.time() - pass_start
+        if report is not None:
+            report.update(changed=changed_tables, result=None, table_stats={})
         
         if not changed_tables:
             print("\n✅ 没有表需要同步")
+            self.record_metrics({'total': 0, 'success': [], 'failed': [], 'targets': self.target_status(),
+                                 'duration': round(checksum_seconds, 2)}, checksum_seconds)
             return True
         
-        print(f"\n🚀 开始同步 {len(changed_tables)} 个表到Cloud SQL...")
+        print(f"\n🚀 开始同步 {len(changed_tables)} 个表到{'Cloud SQL' if len(self.targets) == 1 else ', '.join(t.name for t in self.targets)}"
+              f" (并发: {self.workers})...")
         
-        success_count = 0
-        for table in changed_tables:
-            if self.sync_table(table):
-                success_count += 1
+        result = self.sync_tables(changed_tables, metadata=metadata)
+        result['duration'] = round(time.time() - pass_start, 2)
+        if report is not None:
+            report.update(result=result, table_stats=result['table_stats'])
+        self.record_metrics(result, checksum_seconds)
+        success_count = len(result['success'])
         
         print(f"\n{'='*70}")
-        print(f"✅ 成功: {success_count}/{len(changed_tables)}")
+        print(f"✅ 成功: {success_count}/{result['total']} (耗时 {result['duration']:.1f}s)")
+        if result['failed']:
+            print(f"❌ 失败: {', '.join(result['failed'])}")
         print("="*70)
         
-        return success_count == len(changed_tables)
+        return success_count == result['total']
+
+    def dry_run(self):
+        """只检测变化并输出同步计划，不同步、不修改任何状态"""
+        print("="*70)
+        print(f"📋 同步计划（dry-run, SYNC_MODE={self.mode}） - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        print("="*70)
+        changed_tables = self.find_changed_tables(dry_run=True)
+        unchanged = [t for t in (self.metadata or {}) if not t.startswith('_') and t not in changed_tables]
+        plans = self.planner.plan(changed_tables, self.metadata) if changed_tables else {}
+        self.planner.print_plan(plans, unchanged)
+        return True
 
 if __name__ == '__main__':
-    engine = SmartSyncEngine()
-    result = engine.run()
+    if '--dry-run' in sys.argv:
+        # 不持有 sync.lock，不能把正在同步的表当作中断处理
+        engine = SmartSyncEngine(recover=False)
+        result = engine.dry_run()
+    else:
+        engine = SmartSyncEngine()
+        result = engine.run()
     sys.exit(0 if result else 1)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+一致性快照 - 让多个连接读取同一时间点的数据
+
+协调连接对相关表加读锁（FLUSH TABLES ... WITH READ LOCK，只阻塞写入几毫秒），
+各工作连接依次 START TRANSACTION WITH CONSISTENT SNAPSHOT 后立即解锁。
+工作连接不放入连接池，用完直接关闭。
+
+PassSnapshot 是一轮同步共用的快照：所有变化的表（包括大表的并行工作线程）都从同一组
+快照连接读取，并记录快照对应的 binlog 位置。MIDDLE 是从库时只暂停复制 SQL 线程
+（STOP SLAVE SQL_THREAD，从库上唯一的写入者）来冻结数据，不锁表；
+不是从库或没有权限时退回对这些表加读锁（SNAPSHOT_FREEZE=lock 时总是加读锁）。
+"""
+
+import os
+import queue
+import threading
+import time
+
+from db_pool import get_pool
+from row_copy import quote_ident
+
+
+def open_snapshot(prefix, count, tables):
+    """返回 count 个处于同一一致性快照中的连接"""
+    pool = get_pool(prefix)
+    conns = [pool.create() for _ in range(count)]
+    lock_conn = pool.create()
+    lock_cursor = lock_conn.cursor()
+    try:
+        names = ', '.join(quote_ident(t) for t in tables)
+        lock_cursor.execute(f"FLUSH TABLES {names} WITH READ LOCK")
+        try:
+            for conn in conns:
+                begin_snapshot(conn)
+        finally:
+            lock_cursor.execute("UNLOCK TABLES")
+    except Exception:
+        close_snapshot(conns)
+        raise
+    finally:
+        lock_cursor.close()
+        lock_conn.close()
+    return conns
+
+
+def begin_snapshot(conn):
+    """在连接上开启只读一致性快照事务"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY")
+    finally:
+        cursor.close()
+
+
+def replica_status(cursor):
+    """SHOW REPLICA/SLAVE STATUS 的一行，非从库返回 None"""
+    for query in ("SHOW REPLICA STATUS", "SHOW SLAVE STATUS"):
+        try:
+            cursor.execute(query)
+            return cursor.fetchone()
+        except Exception:
+            continue
+    return None
+
+
+def binlog_position(cursor):
+    """本机 binlog 位置（未开启 binlog 时返回 None）"""
+    for query in ("SHOW BINARY LOG STATUS", "SHOW MASTER STATUS"):
+        try:
+            cursor.execute(query)
+            row = cursor.fetchone()
+        except Exception:
+            continue
+        if row:
+            return {'file': row['File'], 'position': int(row['Position']),
+                    'gtid': row.get('Executed_Gtid_Set') or None}
+        return None
+    return None
+
+
+def control_sql_thread(cursor, start):
+    action = 'START' if start else 'STOP'
+    try:
+        cursor.execute(f"{action} REPLICA SQL_THREAD")
+    except Exception:
+        cursor.execute(f"{action} SLAVE SQL_THREAD")
+
+
+class SnapshotConnection:
+    """快照连接代理：close() 归还给本轮快照（不回滚，事务要一直保持到本轮结束）"""
+
+    def __init__(self, owner, conn):
+        self._owner = owner
+        self._conn = conn
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._owner.release(self._conn)
+
+    def discard(self):
+        """连接状态不可用（如服务端游标没读完），关闭不再使用"""
+        if not self._released:
+            self._released = True
+            self._owner.release(self._conn, broken=True)
+
+
+class PassSnapshot:
+    """一轮同步共用的一致性快照"""
+
+    def __init__(self, prefix, count, tables, freeze=None):
+        self.prefix = prefix
+        self.tables = list(tables)
+        self.timeout = float(os.getenv('POOL_TIMEOUT', 60))
+        # none：不冻结（源库已没有写入，或没有 RELOAD 权限加读锁，如 Cloud SQL）
+        self.freeze = freeze or os.getenv('SNAPSHOT_FREEZE', 'replica')
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.alive = 0
+        self.coordinates = {}
+        self.open(max(1, count))
+
+    def open(self, count):
+        pool = get_pool(self.prefix)
+        conns = []
+        control = pool.create()
+        cursor = control.cursor()
+        try:
+            for _ in range(count):
+                conns.append(pool.create())
+            start = time.time()
+            replica = replica_status(cursor) if self.freeze == 'replica' else None
+            sql_running = replica and replica.get('Replica_SQL_Running', replica.get('Slave_SQL_Running')) == 'Yes'
+            stopped = locked = False
+            try:
+                if sql_running:
+                    try:
+                        control_sql_thread(cursor, start=False)
+                        stopped = True
+                    except Exception as e:
+                        print(f"  ⚠️  无法暂停复制 SQL 线程（{e}），改为对同步的表加读锁")
+                if not stopped and self.freeze != 'none':
+                    cursor.execute(f"FLUSH TABLES {', '.join(quote_ident(t) for t in self.tables)} WITH READ LOCK")
+                    locked = True
+                # 数据已冻结：此时读到的复制位置与各连接的快照一致
+                if stopped:
+                    replica = replica_status(cursor)
+                    self.coordinates['source'] = {
+                        'file': replica.get('Relay_Source_Log_File', replica.get('Relay_Master_Log_File')),
+                        'position': int(replica.get('Exec_Source_Log_Pos', replica.get('Exec_Master_Log_Pos'))),
+                        'gtid': replica.get('Executed_Gtid_Set') or None,
+                    }
+                binlog = binlog_position(cursor)
+                if binlog:
+                    self.coordinates['binlog'] = binlog
+                for conn in conns:
+                    begin_snapshot(conn)
+            finally:
+                if stopped:
+                    try:
+                        control_sql_thread(cursor, start=True)
+                    except Exception as e:
+                        print(f"  ❌ 复制 SQL 线程未能恢复，请手动执行 START SLAVE SQL_THREAD: {e}")
+                        raise
+                if locked:
+                    cursor.execute("UNLOCK TABLES")
+            self.coordinates['method'] = 'stop_sql_thread' if stopped else 'table_lock' if locked else 'none'
+            self.coordinates['freeze_ms'] = round((time.time() - start) * 1000, 1)
+            self.coordinates['time'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        except Exception:
+            close_snapshot(conns)
+            raise
+        finally:
+            cursor.close()
+            control.close()
+        for conn in conns:
+            self.idle.put(conn)
+        self.alive = len(conns)
+
+    def acquire(self):
+        """取一个快照连接，全部在用时等待其他表归还"""
+        with self.lock:
+            if self.alive == 0:
+                raise RuntimeError("本轮快照的连接已全部失效")
+        try:
+            return SnapshotConnection(self, self.idle.get(timeout=self.timeout))
+        except queue.Empty:
+            raise TimeoutError(f"等待快照连接超时（{self.timeout:.0f}s）")
+
+    def acquire_many(self, count):
+        """并行读取用：至少取一个连接，其余只取当前空闲的，避免多个大表互相等待"""
+        conns = [self.acquire()]
+        while len(conns) < count:
+            try:
+                conns.append(SnapshotConnection(self, self.idle.get_nowait()))
+            except queue.Empty:
+                break
+        return conns
+
+    def release(self, conn, broken=False):
+        if broken:
+            with self.lock:
+                self.alive -= 1
+            try:
+                conn.close()
+            except Exception:
+                pass
+        else:
+            self.idle.put(conn)
+
+    def describe(self):
+        coords = self.coordinates
+        where = coords.get('source') or coords.get('binlog')
+        position = f"{where['file']}:{where['position']}" if where else '未知'
+        method = {'stop_sql_thread': '暂停复制 SQL 线程', 'table_lock': '表读锁'}.get(coords.get('method'), '未冻结')
+        return f"binlog {position}（{method} {coords.get('freeze_ms', 0):.0f}ms）"
+
+    def close(self):
+        """结束快照：关闭所有已归还的连接"""
+        conns = []
+        while True:
+            try:
+                conns.append(self.idle.get_nowait())
+            except queue.Empty:
+                break
+        close_snapshot(conns)
+
+
+def close_snapshot(conns):
+    """结束快照事务并关闭连接"""
+    for conn in conns:
+        try:
+            conn.rollback()
+            conn.close()
+        except Exception:
+            pass
@@ -0,0 +1,537 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+进程内流式全量同步 - 代替 mysqldump | mysql 管道
+
+MIDDLE 端用服务端游标（SSCursor）逐行读取，内存占用与表大小无关；
+CLOUD 端按字节数（SYNC_BATCH_BYTES，需小于 max_allowed_packet）拼多行upsert分批提交，
+每 SYNC_PROGRESS_SECONDS 秒输出一次进度。
+
+SYNC_LOAD_MODE=shadow（默认）时先写入影子表 _<表名>_new，导入期间关闭唯一性/外键检查，
+完成后用 RENAME TABLE 原子替换，读者始终看到完整的旧表或新表，中途失败不影响线上表。
+有外键或被外键引用的表自动改为就地导入（影子表会与原表重名外键约束，RENAME 后引用也不会跟随），
+导入期间只关闭外键检查。
+
+大小超过 SYNC_SPLIT_BYTES 的表按主键切成区间，由最多 SYNC_TABLE_WORKERS 个工作线程
+在同一个一致性快照中并行读取、各自用独立的 CLOUD 连接写入。每个工作线程占用一个
+MIDDLE_MAX_CONCURRENCY / CLOUD_MAX_CONCURRENCY 名额，名额不够时减少线程数，不超过并发上限
+（两个上限默认 SYNC_WORKERS+SYNC_TABLE_WORKERS-1；显式调低时大表可能只有一个线程，日志中会提示）。
+已完成的区间记录在同步状态日志中，失败后保留影子表，重试时只同步剩余区间；
+续传前用区间摘要（chunk_checksum.range_digest）逐个核对已完成的区间，中断期间源表有变化的区间
+先删除再重新复制，换表时影子表与本次快照一致。
+
+配置了多个同步目标（SYNC_TARGETS）时每批只读取、转义一次，由 sync_targets.FanOut
+交给每个目标各自的写入线程，一个目标失败或落后被摘除不影响其他目标。
+
+SYNC_PIPELINE=loaddata 时写入改用 LOAD DATA LOCAL INFILE（见 bulk_load.py），其余流程相同。
+"""
+
+import math
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pymysql
+
+from chunk_checksum import get_int_pk, get_columns, range_digest
+from row_copy import quote_ident
+from bulk_load import bulk_supported, iter_tsv_batches, load_data
+from snapshot import open_snapshot, close_snapshot
+from sync_targets import FanOut
+
+
+class LoadInterrupted(Exception):
+    """并行全量同步中途失败，已完成的区间已记录，下次重试时续传"""
+
+
+class StreamStats:
+    """单表同步统计"""
+
+    def __init__(self, table):
+        self.table = table
+        self.rows = 0
+        self.bytes = 0
+        self.batches = 0
+        self.parallel = False
+        self.method = 'insert'
+        # 多目标同步时写入失败的目标 {目标: 异常}
+        self.failed = {}
+        self.start = time.time()
+
+    @property
+    def elapsed(self):
+        return time.time() - self.start
+
+    def summary(self):
+        rate = self.bytes / 1024 / 1024 / max(self.elapsed, 0.001)
+        method = ' (LOAD DATA)' if self.method == 'loaddata' else ''
+        return f"{self.rows:,} 行, {self.bytes / 1024 / 1024:.1f} MB, {rate:.1f} MB/s{method}"
+
+    def as_dict(self):
+        return {'rows': self.rows, 'bytes': self.bytes, 'batches': self.batches,
+                'seconds': round(self.elapsed, 2), 'method': self.method}
+
+
+def iter_batches(cursor, escape, batch_bytes):
+    """把游标中的行转成 (VALUES片段列表, 字节数) 批次，单批不超过 batch_bytes"""
+    batch, size = [], 0
+    for row in cursor:
+        literal = escape(row)
+        batch.append(literal)
+        size += len(literal.encode(errors='surrogateescape')) + 1
+        if size >= batch_bytes:
+            yield batch, size
+            batch, size = [], 0
+    if batch:
+        yield batch, size
+
+
+def pk_ranges(conn, table, pk, parts):
+    """把 [MIN(pk), MAX(pk)] 等分成 parts 个左闭右开区间"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT MIN({quote_ident(pk)}) AS lo, MAX({quote_ident(pk)}) AS hi "
+                       f"FROM {quote_ident(table)}")
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    if row['lo'] is None:
+        return []
+    lo, hi = int(row['lo']), int(row['hi'])
+    step = max(1, math.ceil((hi - lo + 1) / parts))
+    return [(start, min(start + step, hi + 1)) for start in range(lo, hi + 1, step)]
+
+
+def execute_commit(sql):
+    """写入一批并提交的操作，由各目标的写入线程执行"""
+    def op(conn, target):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql)
+        finally:
+            cursor.close()
+        conn.commit()
+    return op
+
+
+class StreamSyncer:
+    def __init__(self, engine):
+        self.engine = engine
+        self.batch_bytes = int(os.getenv('SYNC_BATCH_BYTES', 4 * 1024 * 1024))
+        self.progress_seconds = float(os.getenv('SYNC_PROGRESS_SECONDS', 10))
+        self.load_mode = os.getenv('SYNC_LOAD_MODE', 'shadow')
+        self.split_bytes = int(os.getenv('SYNC_SPLIT_BYTES', 1024 * 1024 * 1024))
+        self.table_workers = max(1, int(os.getenv('SYNC_TABLE_WORKERS', 4)))
+        self.bulk = engine.pipeline == 'loaddata'
+        self.load_batch_bytes = int(os.getenv('SYNC_LOAD_BATCH_BYTES', 16 * 1024 * 1024))
+
+    def source_ddl(self, middle, table, target_table):
+        """MIDDLE 的建表语句，表名换成 target_table"""
+        cursor = middle.cursor()
+        try:
+            cursor.execute(f"SHOW CREATE TABLE {quote_ident(table)}")
+            ddl = cursor.fetchone()['Create Table']
+        finally:
+            cursor.close()
+        return ddl.replace(f"CREATE TABLE {quote_ident(table)}", f"CREATE TABLE {quote_ident(target_table)}", 1)
+
+    def recreate(self, cloud, target_table, ddl):
+        """在目标库重建目标表（等同 --add-drop-table，与 mysqldump 一样不检查外键，被引用的表也能重建）"""
+        cursor = cloud.cursor()
+        try:
+            cursor.execute("SET SESSION foreign_key_checks = 0")
+            cursor.execute(f"DROP TABLE IF EXISTS {quote_ident(target_table)}")
+            cursor.execute(ddl)
+            cursor.execute("SET SESSION foreign_key_checks = 1")
+        finally:
+            cursor.close()
+
+    def has_foreign_keys(self, middle, table):
+        """表有外键或被其他表的外键引用"""
+        cursor = middle.cursor()
+        try:
+            cursor.execute("SELECT 1 FROM information_schema.REFERENTIAL_CONSTRAINTS "
+                           "WHERE CONSTRAINT_SCHEMA = DATABASE() AND (TABLE_NAME = %s OR REFERENCED_TABLE_NAME = %s) "
+                           "LIMIT 1", (table, table))
+            return cursor.fetchone() is not None
+        finally:
+            cursor.close()
+
+    def shadow_table(self, middle, table):
+        """返回 (影子表名, 是否涉及外键)；就地导入时影子表名为 None"""
+        foreign = self.has_foreign_keys(middle, table)
+        if self.load_mode != 'shadow':
+            return None, foreign
+        if foreign:
+            self.engine.log(f"    … {table}: 有外键或被外键引用，不使用影子表，改为就地导入")
+            return None, foreign
+        return f"_{table}_new", foreign
+
+    def use_bulk(self, middle, table):
+        """本表是否用 LOAD DATA 写入"""
+        if not self.bulk:
+            return False
+        cursor = middle.cursor()
+        try:
+            return bulk_supported(cursor, table)
+        finally:
+            cursor.close()
+
+    def copy_rows(self, middle, fan, table, target_table, stats, where='', args=None):
+        """流式读取 MIDDLE 的行，每批只转义一次，交给所有目标的写入线程写入 target_table"""
+        src = middle.cursor(pymysql.cursors.SSCursor)
+        last_report = time.time()
+        try:
+            src.execute("SET SESSION net_write_timeout = 600")
+            src.execute(f"SELECT * FROM {quote_ident(table)} {where}", args)
+            columns = [d[0] for d in src.description]
+            if stats.method == 'loaddata':
+                batches = ((load_data(target_table, columns, data, rows), rows, len(data))
+                           for data, rows in iter_tsv_batches(src, self.load_batch_bytes))
+            else:
+                batches = self.insert_batches(src, middle.escape, target_table, columns)
+
+            for op, rows, size in batches:
+                # 每个目标各传一份
+                self.engine.transport.throttle(size * max(1, len(fan.live)))
+                fan.submit(op)
+                stats.rows += rows
+                stats.bytes += size
+                stats.batches += 1
+                if time.time() - last_report >= self.progress_seconds:
+                    last_report = time.time()
+                    self.engine.log(f"    … {table}: {stats.summary()}")
+        finally:
+            src.close()
+
+    def insert_batches(self, src, escape, target_table, columns):
+        """多行 upsert 批次 (写入操作, 行数, 字节数)"""
+        cols = ', '.join(quote_ident(c) for c in columns)
+        updates = ', '.join(f"{quote_ident(c)}=VALUES({quote_ident(c)})" for c in columns)
+        prefix = f"INSERT INTO {quote_ident(target_table)} ({cols}) VALUES "
+        suffix = f" ON DUPLICATE KEY UPDATE {updates}"
+        for batch, size in iter_batches(src, escape, self.batch_bytes):
+            yield execute_commit(prefix + ','.join(batch) + suffix), len(batch), size
+
+    def relax_checks(self, cloud, relaxed, unique=True):
+        """影子表无人读取，导入期间可以关闭唯一性和外键检查；就地导入涉及外键的表时只关闭外键检查
+        （父子表各自整表重建，导入顺序不定）"""
+        value = 0 if relaxed else 1
+        cursor = cloud.cursor()
+        try:
+            if unique:
+                cursor.execute(f"SET SESSION unique_checks = {value}, foreign_key_checks = {value}")
+            else:
+                cursor.execute(f"SET SESSION foreign_key_checks = {value}")
+        finally:
+            cursor.close()
+
+    def table_exists(self, cursor, table):
+        cursor.execute("SELECT 1 FROM information_schema.TABLES "
+                       "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", (table,))
+        return cursor.fetchone() is not None
+
+    def swap(self, cloud, table, shadow):
+        """RENAME TABLE 原子替换线上表"""
+        old = f"_{table}_old"
+        cursor = cloud.cursor()
+        try:
+            cursor.execute(f"DROP TABLE IF EXISTS {quote_ident(old)}")
+            if self.table_exists(cursor, table):
+                cursor.execute(f"RENAME TABLE {quote_ident(table)} TO {quote_ident(old)}, "
+                               f"{quote_ident(shadow)} TO {quote_ident(table)}")
+                cursor.execute(f"DROP TABLE {quote_ident(old)}")
+            else:
+                cursor.execute(f"RENAME TABLE {quote_ident(shadow)} TO {quote_ident(table)}")
+        finally:
+            cursor.close()
+
+    def drop_shadow(self, shadow, target='CLOUD'):
+        """失败后清理影子表（用新连接，原连接可能已不可用）"""
+        try:
+            cloud = self.engine.connect_db(target)
+            cursor = cloud.cursor()
+            cursor.execute(f"DROP TABLE IF EXISTS {quote_ident(shadow)}")
+            cursor.close()
+            cloud.close()
+        except Exception as e:
+            self.engine.log(f"  ⚠️  清理影子表 {shadow}（{target}）失败: {e}")
+
+    def sync_table(self, table, parallel=None, targets=None):
+        """全量流式同步到 targets（默认主目标），返回 StreamStats，stats.failed 为写入失败的目标；
+        全部目标失败时抛出异常。parallel 为 True 时（同步计划已判断）直接按主键区间并行，None 时按表大小决定"""
+        targets = targets or [self.engine.primary]
+        if self.table_workers > 1:
+            if parallel is None:
+                parallel = self.engine.get_table_sizes([table]).get(table, 0) >= self.split_bytes
+            if parallel:
+                conn = self.engine.connect_db('MIDDLE')
+                cursor = conn.cursor()
+                try:
+                    pk = get_int_pk(cursor, table)
+                finally:
+                    cursor.close()
+                    conn.close()
+                if pk:
+                    extra = self.reserve_workers(table)
+                    if extra < self.table_workers - 1:
+                        self.engine.log(f"    … {table}: 并发名额不足，只用 {1 + extra}/{self.table_workers} 个线程"
+                                        f"（需要更多线程时提高 MIDDLE_MAX_CONCURRENCY / CLOUD_MAX_CONCURRENCY）")
+                    try:
+                        return self.sync_table_parallel(table, pk, targets, 1 + extra)
+                    finally:
+                        self.release_workers(table, extra)
+        return self.sync_table_serial(table, targets)
+
+    def reserve_workers(self, table):
+        """调用方已占用一个 MIDDLE/CLOUD 名额，其余工作线程各再占一对；只取当前空闲的名额（不等待，
+        避免多个大表互相等待），返回额外占用的名额数"""
+        middle, cloud = self.engine.lane_slots(table)
+        extra = 0
+        while extra < self.table_workers - 1:
+            if not middle.acquire(blocking=False):
+                break
+            if not cloud.acquire(blocking=False):
+                middle.release()
+                break
+            extra += 1
+        return extra
+
+    def release_workers(self, table, extra):
+        middle, cloud = self.engine.lane_slots(table)
+        for _ in range(extra):
+            middle.release()
+            cloud.release()
+
+    def pk_ranges(self, conn, table, pk, parts):
+        return pk_ranges(conn, table, pk, parts)
+
+    def resume_plan(self, snap, table, pk, shadow, target):
+        """检查能否续传：返回 (需要复制的区间 [(lo, hi, 是否先删除)], 已完成的行数)，不能续传返回 None"""
+        journal = target.journal
+        plan = journal.load_plan(table)
+        done = journal.done_chunks(table)
+        if not plan or not done:
+            return None
+        cursor = snap.cursor()
+        try:
+            if plan['pk'] != pk or plan['columns'] != get_columns(cursor, table):
+                return None
+        finally:
+            cursor.close()
+        cloud = self.engine.connect_db(target.name)
+        cursor = cloud.cursor()
+        try:
+            if not self.table_exists(cursor, shadow):
+                return None
+            stale = self.stale_ranges(snap, cursor, table, shadow, pk, plan['columns'], done)
+        finally:
+            cursor.close()
+            cloud.close()
+
+        for lo, hi in stale:
+            done.pop((lo, hi))
+        ranges = [(lo, hi, False) for lo, hi in map(tuple, plan['ranges']) if (lo, hi) not in done and
+                  (lo, hi) not in stale]
+        ranges += [(lo, hi, True) for lo, hi in stale]
+        # 第一次同步之后新增的主键不在原区间内，补上首尾区间
+        bounds = self.pk_ranges(snap, table, pk, 1)
+        if bounds:
+            lo, hi = bounds[0][0], bounds[-1][1]
+            if lo < plan['ranges'][0][0]:
+                ranges.insert(0, (lo, plan['ranges'][0][0], False))
+            if hi > plan['ranges'][-1][1]:
+                ranges.append((plan['ranges'][-1][1], hi, False))
+        return ranges, sum(done.values())
+
+    def stale_ranges(self, snap, cloud_cursor, table, shadow, pk, columns, done):
+        """已完成的区间中与本次快照不一致的（中断期间源表有修改/删除）"""
+        src = snap.cursor()
+        try:
+            stale = [(lo, hi) for lo, hi in sorted(done)
+                     if range_digest(src, table, pk, columns, lo, hi)
+                     != range_digest(cloud_cursor, shadow, pk, columns, lo, hi)]
+        finally:
+            src.close()
+        if stale:
+            self.engine.log(f"    … {table}: {len(stale)}/{len(done)} 个已完成区间在中断期间有变化，重新复制")
+        return stale
+
+    def open_readers(self, table, workers):
+        """并行读取用的快照连接：本轮同步有共享快照时从中取，否则为该表单独建快照"""
+        shared = self.engine.snapshots.get(table)
+        if shared:
+            return shared.acquire_many(workers)
+        return open_snapshot('MIDDLE', workers, [table])
+
+    def close_readers(self, table, conns, ok=True):
+        """共享快照的连接归还（出错的丢弃），单独的快照直接关闭"""
+        if self.engine.snapshots.get(table):
+            for conn in conns:
+                if ok:
+                    conn.close()
+                else:
+                    conn.discard()
+        else:
+            close_snapshot(conns)
+
+    def sync_table_parallel(self, table, pk, targets, workers):
+        """大表按主键区间由 workers 个线程并行同步，所有工作线程读取同一个快照，每个区间读一次写入所有目标"""
+        stats = StreamStats(table)
+        stats.parallel = True
+        failures = {}
+
+        snapshots = self.open_readers(table, workers)
+        try:
+            shadow, foreign = self.shadow_table(snapshots[0], table)
+            target_table = shadow or table
+            if self.use_bulk(snapshots[0], table):
+                stats.method = 'loaddata'
+            # 断点只对单个目标续传；多个目标一起全量时各自的进度不同，重新开始
+            resume = (self.resume_plan(snapshots[0], table, pk, target_table, targets[0])
+                      if len(targets) == 1 else None)
+            if resume:
+                plan, done_rows = resume
+                self.engine.log(f"    … {table}: 从断点续传，已完成 {done_rows:,} 行")
+            else:
+                ddl = self.source_ddl(snapshots[0], table, target_table)
+                setup = FanOut(targets, failures)
+                setup.submit(lambda conn, target: self.recreate(conn, target_table, ddl))
+                setup.close()
+                cursor = snapshots[0].cursor()
+                columns = get_columns(cursor, table)
+                cursor.close()
+                # 每个工作线程分到多个较小区间，避免数据倾斜时个别线程拖尾；区间数按配置的线程数切分，
+                # 续传时与本次实际的线程数无关
+                ranges_plan = self.pk_ranges(snapshots[0], table, pk, self.table_workers * 4)
+                plan = [(lo, hi, False) for lo, hi in ranges_plan]
+                for target in targets:
+                    if target.name not in failures:
+                        target.journal.clear_chunks(table)
+                        target.journal.save_plan(table, {'pk': pk, 'columns': columns, 'ranges': ranges_plan})
+                if len(failures) == len(targets):
+                    setup.raise_first()
+        except Exception:
+            self.close_readers(table, snapshots, ok=False)
+            raise
+
+        ranges = queue.Queue()
+        for item in plan:
+            ranges.put(item)
+        total = ranges.qsize()
+        self.engine.log(f"    … {table}: 并行同步 {total} 个主键区间, {len(snapshots)} 个线程")
+        lock = threading.Lock()
+        failed = threading.Event()
+
+        def chunk_done(lo, hi, rows):
+            # 排在该区间的最后一批之后，由各目标的写入线程记录，只记该目标确实写完的区间
+            return lambda conn, target: target.journal.chunk_done(table, lo, hi, rows)
+
+        def worker(snap):
+            fan = FanOut(targets, failures, local_infile=stats.method == 'loaddata')
+            local = StreamStats(table)
+            local.method = stats.method
+            try:
+                if shadow:
+                    fan.submit(lambda conn, target: self.relax_checks(conn, True))
+                elif foreign:
+                    fan.submit(lambda conn, target: self.relax_checks(conn, True, unique=False))
+                while not failed.is_set():
+                    try:
+                        lo, hi, replace = ranges.get_nowait()
+                    except queue.Empty:
+                        break
+                    where = f"WHERE {quote_ident(pk)} >= %s AND {quote_ident(pk)} < %s"
+                    if replace:
+                        # 续传时核对不一致的区间：先清掉旧行（包括源表已删除的行）
+                        fan.submit(execute_commit(
+                            f"DELETE FROM {quote_ident(target_table)} {where}" % (int(lo), int(hi))))
+                    before = local.rows
+                    self.copy_rows(snap, fan, table, target_table, local, where, (lo, hi))
+                    fan.submit(chunk_done(lo, hi, local.rows - before))
+            except Exception:
+                # 读取失败或所有目标都失败，其余线程不再领取新区间
+                failed.set()
+                raise
+            finally:
+                fan.close()
+                with lock:
+                    stats.rows += local.rows
+                    stats.bytes += local.bytes
+                    stats.batches += local.batches
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(snapshots)) as pool:
+                for future in [pool.submit(worker, snap) for snap in snapshots]:
+                    future.result()
+            if shadow:
+                finish = FanOut(targets, failures)
+                finish.submit(lambda conn, target: self.swap(conn, table, shadow))
+                finish.close()
+            if len(failures) == len(targets):
+                raise next(iter(failures.values()))
+        except Exception as e:
+            # 读取失败时所有目标都中断
+            for target in targets:
+                failures.setdefault(target.name, e)
+        finally:
+            self.close_readers(table, snapshots, ok=not failed.is_set())
+
+        for target in targets:
+            if target.name not in failures:
+                continue
+            done = len(target.journal.done_chunks(table))
+            if done:
+                # 保留影子表和该目标的进度，下次单独重试时只同步剩余区间
+                failures[target.name] = LoadInterrupted(
+                    f"{failures[target.name]}（已完成 {done} 个区间，重试时续传）")
+            elif shadow:
+                self.drop_shadow(shadow, target.name)
+        stats.failed = failures
+        if len(failures) == len(targets):
+            raise next(iter(failures.values()))
+        return stats
+
+    def sync_table_serial(self, table, targets):
+        """单连接读取，写入所有目标"""
+        stats = StreamStats(table)
+        middle = self.engine.read_conn(table)
+        try:
+            shadow, foreign = self.shadow_table(middle, table)
+            target_table = shadow or table
+            if self.use_bulk(middle, table):
+                stats.method = 'loaddata'
+        except Exception:
+            middle.discard()
+            raise
+        fan = FanOut(targets, local_infile=stats.method == 'loaddata')
+        try:
+            ddl = self.source_ddl(middle, table, target_table)
+            fan.submit(lambda conn, target: self.recreate(conn, target_table, ddl))
+            if shadow:
+                fan.submit(lambda conn, target: self.relax_checks(conn, True))
+            elif foreign:
+                fan.submit(lambda conn, target: self.relax_checks(conn, True, unique=False))
+            self.copy_rows(middle, fan, table, target_table, stats)
+            if shadow:
+                fan.submit(lambda conn, target: self.relax_checks(conn, False))
+                fan.submit(lambda conn, target: self.swap(conn, table, shadow))
+        except Exception:
+            # 未读完的服务端游标不能放回池中
+            middle.discard()
+            fan.close()
+            if shadow:
+                for target in targets:
+                    self.drop_shadow(shadow, target.name)
+            raise
+        middle.close()
+        failures = fan.close()
+        if shadow:
+            for name in failures:
+                self.drop_shadow(shadow, name)
+        stats.failed = failures
+        if len(failures) == len(targets):
+            fan.raise_first()
+        return stats
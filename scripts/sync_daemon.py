@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+常驻同步进程 - 在一个进程内调度数据保护检查和智能同步，代替 cron 的 safe_sync.sh
+
+每个周期只读取一次表元数据快照，保护检查和变更检测共用；
+保护检查发现严重问题时本周期不同步，PAUSE_SYNC 仍然生效。
+同步按表调度（见 sync_scheduler.py）：关键表优先、间隔最短，大表在后台线程单独同步，
+不会阻塞关键表（关键表有预留的并发名额 CRITICAL_LANE_SLOTS，扫描 CHECKSUM 时不持有共享状态锁）；
+复制延迟过高时推迟同步。
+与 safe_sync.sh 共用 cache/sync.lock，常驻进程运行时 cron 任务会直接跳过。
+每天 BACKUP_AT 在后台线程创建一次本地备份归档（见 backup_archive.py）。
+启用后应删除 crontab 中 safe_sync.sh、data_protection.py 和每日基线三个任务。
+"""
+
+import fcntl
+import signal
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dotenv import load_dotenv
+
+load_dotenv('/opt/mysql-sync/.env')
+
+# 部署目录，可用 SYNC_HOME 指向其他目录（本地测试/基准测试）
+SYNC_HOME = Path(os.getenv('SYNC_HOME', '/opt/mysql-sync'))
+
+from db_pool import connect_db
+from backup_archive import BackupArchive
+from data_protection import SmartDataProtector
+from smart_sync import SmartSyncEngine
+from sync_scheduler import TableScheduler
+from table_metadata import fetch_table_metadata
+import sync_metrics
+
+LOCK_FILE = SYNC_HOME / 'cache/sync.lock'
+
+
+class SyncDaemon:
+    def __init__(self):
+        self.sync_interval = float(os.getenv('SYNC_INTERVAL_SECONDS', 180))
+        self.protect_interval = float(os.getenv('PROTECT_INTERVAL_SECONDS', 180))
+        # 每天创建新基线的时间（服务器本地时间，与原 cron "0 19 * * *" 一致），留空则不创建
+        self.baseline_at = os.getenv('BASELINE_AT', '19:00')
+        # 每天备份归档的时间，默认在基线之后（UTC+8 凌晨4点），留空则不备份
+        self.backup_at = os.getenv('BACKUP_AT', '20:00')
+
+        self.protector = SmartDataProtector()
+        self.engine = SmartSyncEngine()
+        self.scheduler = TableScheduler(self.engine.cache_dir)
+        self.bulk_thread = None
+        self.backup_thread = None
+        self.last_backup_day = None
+        self.stopping = False
+        self.last_protect = 0
+        self.last_sync = 0
+        self.last_protect_ok = True
+        self.last_baseline_day = None
+
+    def acquire_lock(self):
+        """独占锁，防止多个常驻进程或 cron 任务同时运行"""
+        self.lock_fd = open(LOCK_FILE, 'w')
+        try:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        self.lock_fd.write(str(os.getpid()))
+        self.lock_fd.flush()
+        return True
+
+    def stop(self, signum, frame):
+        print(f"\n⏹️  收到信号 {signum}，当前周期结束后退出")
+        self.stopping = True
+
+    def snapshot(self):
+        """本周期共享的元数据快照"""
+        conn = connect_db('MIDDLE')
+        cursor = conn.cursor()
+        try:
+            return fetch_table_metadata(cursor)
+        finally:
+            cursor.close()
+            conn.close()
+
+    def replication_lag(self):
+        """中间服务器的复制延迟（秒），读取失败或不是从库时为 None"""
+        try:
+            conn = connect_db('MIDDLE')
+            cursor = conn.cursor()
+            try:
+                status = sync_metrics.replication_status(cursor)
+            finally:
+                cursor.close()
+                conn.close()
+        except Exception as e:
+            print(f"  ⚠️  读取复制状态失败: {e}")
+            return None
+        return status['lag'] if status else None
+
+    def sync_lane(self, lane, tables, metadata):
+        """同步一个通道中到期的表，并把结果反馈给调度器"""
+        report = {}
+        try:
+            print(f"🛤️  {lane} 通道: {len(tables)} 个表到期")
+            self.engine.run(metadata, tables, report, lane)
+        except Exception as e:
+            print(f"  ⚠️  {lane} 通道同步失败: {e}")
+        finally:
+            if 'changed' in report:
+                self.scheduler.record(tables, report['changed'], report['result'], report['table_stats'])
+            sys.stdout.flush()
+
+    def sync(self, metadata):
+        lanes = self.scheduler.due(metadata, self.replication_lag())
+        if lanes['bulk']:
+            if self.bulk_thread is not None and self.bulk_thread.is_alive():
+                print(f"⏳ 大表通道仍在同步，{len(lanes['bulk'])} 个表稍后再试")
+            else:
+                self.bulk_thread = threading.Thread(target=self.sync_lane, name='bulk-lane',
+                                                    args=('bulk', lanes['bulk'], metadata))
+                self.bulk_thread.start()
+        for lane in ('critical', 'normal'):
+            if lanes[lane]:
+                self.sync_lane(lane, lanes[lane], metadata)
+
+    def baseline_due(self):
+        if not self.baseline_at:
+            return False
+        now = datetime.now()
+        today = now.date()
+        return now.strftime('%H:%M') >= self.baseline_at and self.last_baseline_day != today
+
+    def backup_due(self):
+        if not self.backup_at:
+            return False
+        now = datetime.now()
+        return now.strftime('%H:%M') >= self.backup_at and self.last_backup_day != now.date()
+
+    def start_backup(self):
+        """在后台线程创建备份，不阻塞同步周期"""
+        if self.backup_thread is not None and self.backup_thread.is_alive():
+            return
+        self.last_backup_day = datetime.now().date()
+
+        def run():
+            try:
+                BackupArchive().run()
+            except Exception as e:
+                print(f"  ⚠️  备份失败: {e}")
+            sys.stdout.flush()
+
+        self.backup_thread = threading.Thread(target=run, name='backup', daemon=True)
+        self.backup_thread.start()
+
+    def cycle(self):
+        """执行一个调度周期"""
+        now = time.time()
+        protect_due = now - self.last_protect >= self.protect_interval
+        if self.backup_due():
+            self.start_backup()
+        # SYNC_INTERVAL_SECONDS 内至少读取一次表列表，发现新表
+        discover_due = now - self.last_sync >= self.sync_interval
+        # 保护检查未通过或已暂停时只按 SYNC_INTERVAL_SECONDS 输出一次提示，不按表间隔频繁唤醒
+        sync_ready = self.last_protect_ok and not self.protector.pause_file.exists()
+        sync_due = discover_due or (sync_ready and self.scheduler.next_due() <= now)
+        if not (protect_due or sync_due or self.baseline_due()):
+            return
+
+        # 外部命令（manage.sh baseline/resume）可能修改了缓存文件，每个周期重新加载
+        self.protector.load_baseline()
+        with self.engine.state_lock:
+            self.engine.load_checksums()
+            self.engine.load_metadata()
+        metadata = self.snapshot()
+
+        if self.baseline_due():
+            self.last_baseline_day = datetime.now().date()
+            try:
+                self.protector.create_baseline()
+            except SystemExit:
+                pass
+
+        if protect_due:
+            self.last_protect = now
+            self.last_protect_ok = self.protector.run_full_check(metadata)
+
+        if sync_due:
+            if discover_due:
+                self.last_sync = now
+            if not self.last_protect_ok:
+                print("🚨 数据保护检查未通过，本周期不同步")
+            else:
+                self.sync(metadata)
+        sys.stdout.flush()
+
+    def run(self):
+        if not self.acquire_lock():
+            print("⚠️  已有同步进程在运行，退出")
+            return False
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        # 启动时以当天已创建基线为准，避免重启即重建基线
+        self.last_baseline_day = datetime.now().date() if self.baseline_due() else None
+        self.last_backup_day = datetime.now().date() if self.backup_due() else None
+        limits = ', '.join(f"{lane} {low:.0f}~{high:.0f}s" for lane, (low, high) in self.scheduler.limits.items())
+        print(f"🚀 同步常驻进程启动 (pid {os.getpid()}) - 同步间隔 {limits}, "
+              f"保护检查间隔 {self.protect_interval:.0f}s")
+
+        while not self.stopping:
+            try:
+                self.cycle()
+            except Exception as e:
+                print(f"  ⚠️  周期执行失败: {e}")
+            for _ in range(5):
+                if self.stopping:
+                    break
+                time.sleep(1)
+        if self.bulk_thread is not None and self.bulk_thread.is_alive():
+            print("⏳ 等待大表通道完成...")
+            self.bulk_thread.join()
+        if self.backup_thread is not None and self.backup_thread.is_alive():
+            print("⏳ 等待备份完成...")
+            self.backup_thread.join()
+        return True
+
+if __name__ == '__main__':
+    daemon = SyncDaemon()
+    result = daemon.run()
+    sys.exit(0 if result else 1)
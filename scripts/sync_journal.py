@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+同步状态日志 - cache/sync_journal.db（SQLite），进程崩溃或同步失败后不丢失待同步的表
+（SYNC_TARGETS 中第一个之外的目标各有一份 sync_journal_<目标>.db）
+
+每个表的状态: pending（检测到变化）→ in_flight（同步中）→ done / failed。
+只有 done 时才更新“已同步校验和”，失败的表按指数退避重试
+（RETRY_BASE_SECONDS 起，每次翻倍，最长 RETRY_MAX_SECONDS）；
+启动时遗留的 in_flight 视为上次进程中断，按失败处理。
+大表并行全量同步的已完成主键区间也记录在这里，重试时从断点续传（RESUME_MAX_HOURS 内有效）。
+pending_since 记录表第一次检测到变化且尚未同步成功的时间，用于计算目标的同步延迟。
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS table_state (
+    table_name TEXT PRIMARY KEY,
+    status     TEXT NOT NULL,
+    checksum   INTEGER,
+    attempts   INTEGER NOT NULL DEFAULT 0,
+    next_retry REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    updated    REAL NOT NULL,
+    pending_since REAL
+);
+CREATE TABLE IF NOT EXISTS load_progress (
+    table_name  TEXT PRIMARY KEY,
+    started     REAL NOT NULL,
+    begin_state TEXT,
+    plan        TEXT
+);
+CREATE TABLE IF NOT EXISTS load_chunks (
+    table_name TEXT NOT NULL,
+    lo         INTEGER NOT NULL,
+    hi         INTEGER NOT NULL,
+    rows       INTEGER NOT NULL,
+    PRIMARY KEY (table_name, lo)
+);
+"""
+
+
+class SyncJournal:
+    def __init__(self, cache_dir, filename='sync_journal.db'):
+        self.path = cache_dir / filename
+        self.retry_base = float(os.getenv('RETRY_BASE_SECONDS', 60))
+        self.retry_max = float(os.getenv('RETRY_MAX_SECONDS', 3600))
+        self.resume_max = float(os.getenv('RESUME_MAX_HOURS', 24)) * 3600
+        self.lock = threading.Lock()
+        # 自动提交，每条语句即一个事务；WAL 模式下写入不阻塞读取
+        self.conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(SCHEMA)
+            # 旧版本创建的库没有 pending_since 列
+            columns = [r['name'] for r in self.conn.execute("PRAGMA table_info(table_state)")]
+            if 'pending_since' not in columns:
+                self.conn.execute("ALTER TABLE table_state ADD COLUMN pending_since REAL")
+
+    @classmethod
+    def open_readonly(cls, path):
+        """只读打开（manage.sh status 等查询用）：不建表、不迁移、不切换 WAL，只能调用查询方法"""
+        journal = cls.__new__(cls)
+        journal.path = path
+        journal.lock = threading.Lock()
+        journal.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=30, check_same_thread=False)
+        journal.conn.row_factory = sqlite3.Row
+        journal.conn.execute("PRAGMA query_only = ON")
+        return journal
+
+    def close(self):
+        self.conn.close()
+
+    def recover(self):
+        """同步进程启动时调用（持有 sync.lock）：遗留的 in_flight 是上次进程中断留下的"""
+        self.execute("UPDATE table_state SET status = 'failed', last_error = '同步进程中断', "
+                     "attempts = attempts + 1, next_retry = 0 WHERE status = 'in_flight'")
+
+    def execute(self, sql, args=()):
+        with self.lock:
+            return self.conn.execute(sql, args).fetchall()
+
+    def get(self, table):
+        rows = self.execute("SELECT * FROM table_state WHERE table_name = ?", (table,))
+        return dict(rows[0]) if rows else None
+
+    def set_status(self, table, status, **fields):
+        names = ['status', 'updated'] + list(fields)
+        values = [status, time.time()] + list(fields.values())
+        self.execute(
+            f"INSERT INTO table_state (table_name, {', '.join(names)}) VALUES (?, {', '.join('?' * len(names))}) "
+            f"ON CONFLICT(table_name) DO UPDATE SET {', '.join(f'{n} = excluded.{n}' for n in names)}",
+            [table] + values)
+
+    def mark_pending(self, table, checksum):
+        """检测到变化，记下本次要同步到的校验和（未同步成功前保留最早的检测时间）"""
+        state = self.get(table)
+        since = state['pending_since'] if state and state['status'] != 'done' else None
+        self.set_status(table, 'pending', checksum=checksum, pending_since=since or time.time())
+
+    def mark_in_flight(self, table):
+        self.set_status(table, 'in_flight')
+
+    def mark_done(self, table):
+        """同步成功，返回应记为已同步的校验和"""
+        state = self.get(table)
+        self.set_status(table, 'done', attempts=0, next_retry=0, last_error=None, pending_since=None)
+        return state['checksum'] if state else None
+
+    def mark_failed(self, table, error):
+        """同步失败，按指数退避安排重试，返回等待秒数"""
+        state = self.get(table) or {}
+        attempts = state.get('attempts', 0) + 1
+        delay = min(self.retry_max, self.retry_base * 2 ** (attempts - 1))
+        self.set_status(table, 'failed', attempts=attempts, next_retry=time.time() + delay,
+                        last_error=str(error)[:500])
+        return delay
+
+    def retry_wait(self, table):
+        """失败的表距下次重试还需等待的秒数"""
+        state = self.get(table)
+        if not state or state['status'] != 'failed':
+            return 0
+        return max(0, state['next_retry'] - time.time())
+
+    def settled(self, table):
+        """上次同步已完成（没有待同步或失败的记录）"""
+        state = self.get(table)
+        return state is None or state['status'] == 'done'
+
+    def resume_state(self, table):
+        """未过期的全量同步断点：返回 (True, 第一次开始时的 begin_state)，没有返回 (False, None)"""
+        rows = self.execute("SELECT started, begin_state FROM load_progress WHERE table_name = ?", (table,))
+        if not rows:
+            return False, None
+        if time.time() - rows[0]['started'] >= self.resume_max:
+            self.clear_load(table)
+            return False, None
+        return True, json.loads(rows[0]['begin_state'])
+
+    def begin_load(self, table, begin_state):
+        """开始一次新的全量同步，记录增量同步的起点（续传时沿用，保证不遗漏中途的变化）"""
+        self.clear_load(table)
+        self.execute("INSERT INTO load_progress (table_name, started, begin_state) VALUES (?, ?, ?)",
+                     (table, time.time(), json.dumps(begin_state, default=str)))
+
+    def load_plan(self, table):
+        rows = self.execute("SELECT plan FROM load_progress WHERE table_name = ?", (table,))
+        return json.loads(rows[0]['plan']) if rows and rows[0]['plan'] else None
+
+    def save_plan(self, table, plan):
+        self.execute("UPDATE load_progress SET plan = ? WHERE table_name = ?", (json.dumps(plan), table))
+
+    def clear_chunks(self, table):
+        self.execute("DELETE FROM load_chunks WHERE table_name = ?", (table,))
+
+    def chunk_done(self, table, lo, hi, rows):
+        self.execute("INSERT OR REPLACE INTO load_chunks (table_name, lo, hi, rows) VALUES (?, ?, ?, ?)",
+                     (table, lo, hi, rows))
+
+    def done_chunks(self, table):
+        """已完成的区间 {(lo, hi): rows}"""
+        return {(r['lo'], r['hi']): r['rows']
+                for r in self.execute("SELECT lo, hi, rows FROM load_chunks WHERE table_name = ?", (table,))}
+
+    def clear_load(self, table):
+        """全量同步结束（或放弃断点）后清除进度，返回之前是否有进度记录"""
+        existed = bool(self.execute("SELECT 1 FROM load_progress WHERE table_name = ?", (table,)))
+        self.execute("DELETE FROM load_chunks WHERE table_name = ?", (table,))
+        self.execute("DELETE FROM load_progress WHERE table_name = ?", (table,))
+        return existed
+
+    def lag(self):
+        """同步延迟：最早一个尚未同步成功的变化已等待的秒数，全部同步完成时为 0"""
+        rows = self.execute("SELECT MIN(pending_since) AS since FROM table_state WHERE status != 'done'")
+        since = rows[0]['since'] if rows else None
+        return max(0.0, time.time() - since) if since else 0.0
+
+    def summary(self):
+        """各状态的表数量和失败的表"""
+        counts = {r['status']: r['n'] for r in self.execute(
+            "SELECT status, COUNT(*) AS n FROM table_state GROUP BY status")}
+        failed = [dict(r) for r in self.execute(
+            "SELECT table_name, attempts, next_retry, last_error FROM table_state "
+            "WHERE status = 'failed' ORDER BY table_name")]
+        return counts, failed
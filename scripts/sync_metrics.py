@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+同步指标 - 记录每轮同步/保护检查的耗时、行数、字节数和复制延迟
+
+状态文件: cache/metrics_state.json（同步和数据保护各写一部分，带文件锁合并）
+Prometheus: METRICS_TEXTFILE（默认 /opt/mysql-sync/metrics/mysql_sync.prom），
+供 node_exporter 的 textfile collector 采集。
+python3 sync_metrics.py status 输出摘要（manage.sh status 使用）。
+"""
+
+import fcntl
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+import sys
+
+SYNC_HOME = Path(os.getenv('SYNC_HOME', '/opt/mysql-sync'))
+STATE_FILE = SYNC_HOME / 'cache' / 'metrics_state.json'
+LOCK_FILE = SYNC_HOME / 'cache' / 'metrics_state.lock'
+
+
+def replication_status(cursor):
+    """读取复制状态，返回 {'lag': 秒或None, 'io': bool, 'sql': bool}，非从库返回None"""
+    for query in ("SHOW REPLICA STATUS", "SHOW SLAVE STATUS"):
+        try:
+            cursor.execute(query)
+            row = cursor.fetchone()
+            break
+        except Exception:
+            row = None
+    if not row:
+        return None
+    lag = row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+    io = row.get('Replica_IO_Running', row.get('Slave_IO_Running'))
+    sql = row.get('Replica_SQL_Running', row.get('Slave_SQL_Running'))
+    return {'lag': int(lag) if lag is not None else None, 'io': io == 'Yes', 'sql': sql == 'Yes'}
+
+
+def load_state():
+    if STATE_FILE.exists():
+        with open(STATE_FILE, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+def update_state(section, data):
+    """合并写入状态文件的一部分，并重新生成 Prometheus 文件；data 可以是函数，
+    在锁内以该部分的旧值调用，返回新值（多个同步通道同时写入时不会丢失对方的表级指标）"""
+    with open(LOCK_FILE, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        state = load_state()
+        state[section] = data(state.get(section, {})) if callable(data) else data
+        tmp = STATE_FILE.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(state, f, indent=2, default=str)
+        tmp.replace(STATE_FILE)
+        write_textfile(state)
+
+
+def prom_line(name, value, labels=None):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        value = int(value)
+    label = ''
+    if labels:
+        label = '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}'
+    return f"mysql_sync_{name}{label} {value}"
+
+
+def write_textfile(state):
+    """按 Prometheus textfile 格式输出所有指标"""
+    path = Path(os.getenv('METRICS_TEXTFILE', SYNC_HOME / 'metrics' / 'mysql_sync.prom'))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    lines = []
+
+    def gauge(name, help_text, samples):
+        samples = [s for s in samples if s is not None]
+        if samples:
+            lines.append(f"# HELP mysql_sync_{name} {help_text}")
+            lines.append(f"# TYPE mysql_sync_{name} gauge")
+            lines.extend(samples)
+
+    sync = state.get('sync', {})
+    tables = sync.get('tables', {})
+    gauge('pass_duration_seconds', 'Duration of the last sync pass',
+          [prom_line('pass_duration_seconds', sync.get('pass_seconds'))])
+    gauge('pass_timestamp_seconds', 'Unix time of the last sync pass',
+          [prom_line('pass_timestamp_seconds', sync.get('timestamp'))])
+    gauge('checksum_duration_seconds', 'Change detection time of the last pass',
+          [prom_line('checksum_duration_seconds', sync.get('checksum_seconds'))])
+    gauge('pass_tables_changed', 'Tables changed in the last pass',
+          [prom_line('pass_tables_changed', sync.get('changed'))])
+    gauge('pass_tables_failed', 'Tables that failed in the last pass',
+          [prom_line('pass_tables_failed', sync.get('failed'))])
+    for key, help_text in (('seconds', 'Last sync duration per table'),
+                           ('rows', 'Rows moved in the last sync per table'),
+                           ('raw_bytes', 'Bytes moved in the last sync per table'),
+                           ('wire_bytes', 'Estimated bytes on the wire in the last sync per table'),
+                           ('success', 'Whether the last sync of the table succeeded'),
+                           ('timestamp', 'Unix time of the last sync per table')):
+        gauge(f'table_{key}', help_text,
+              [prom_line(f'table_{key}', t.get(key), {'table': name}) for name, t in sorted(tables.items())])
+    targets = sync.get('targets') or {}
+    gauge('target_lag_seconds', 'Age of the oldest change not yet synced to each target',
+          [prom_line('target_lag_seconds', t.get('lag'), {'target': name}) for name, t in sorted(targets.items())])
+    gauge('target_tables_failed', 'Tables waiting for retry on each target',
+          [prom_line('target_tables_failed', t.get('failed'), {'target': name})
+           for name, t in sorted(targets.items())])
+
+    protection = state.get('protection', {})
+    gauge('replication_lag_seconds', 'Seconds_Behind_Master of the middle replica',
+          [prom_line('replication_lag_seconds', protection.get('replication_lag'))])
+    gauge('replication_running', 'Replication IO and SQL threads running',
+          [prom_line('replication_running', protection.get('replication_running'))])
+    gauge('protection_duration_seconds', 'Duration of the last protection check',
+          [prom_line('protection_duration_seconds', protection.get('check_seconds'))])
+    gauge('protection_alerts', 'Critical alerts in the last protection check',
+          [prom_line('protection_alerts', protection.get('critical_alerts'))])
+    gauge('paused', 'Whether sync is paused by PAUSE_SYNC',
+          [prom_line('paused', protection.get('paused'))])
+
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    tmp.replace(path)
+
+
+def record_sync(result, table_stats, checksum_seconds):
+    """记录一轮同步的指标；表级指标保留历史最后一次的值"""
+    now = time.time()
+
+    def merge(previous):
+        tables = dict(previous.get('tables', {}))
+        for table in result['success'] + result['failed']:
+            stats = table_stats.get(table, {})
+            tables[table] = {
+                'seconds': stats.get('seconds'),
+                'rows': stats.get('rows'),
+                'raw_bytes': stats.get('raw_bytes', stats.get('bytes')),
+                'wire_bytes': stats.get('wire_bytes'),
+                'method': stats.get('method'),
+                'success': table in result['success'],
+                'timestamp': int(now),
+            }
+        return {
+            'timestamp': int(now),
+            'time': datetime.now().isoformat(),
+            'pass_seconds': result['duration'],
+            'checksum_seconds': round(checksum_seconds, 2),
+            'changed': result['total'],
+            'failed': len(result['failed']),
+            'failed_tables': result['failed'],
+            'snapshot': result.get('snapshot'),
+            'targets': result.get('targets'),
+            'tables': tables,
+        }
+
+    update_state('sync', merge)
+
+
+def record_protection(replication, check_seconds, critical_alerts, paused):
+    """记录一次数据保护检查的指标"""
+    update_state('protection', {
+        'timestamp': int(time.time()),
+        'time': datetime.now().isoformat(),
+        'replication_lag': replication['lag'] if replication else None,
+        'replication_running': (replication['io'] and replication['sql']) if replication else None,
+        'check_seconds': round(check_seconds, 2),
+        'critical_alerts': critical_alerts,
+        'paused': paused,
+    })
+
+
+def print_status():
+    """manage.sh status 使用的摘要"""
+    state = load_state()
+    sync = state.get('sync')
+    if not sync:
+        print("   暂无同步记录")
+    else:
+        print(f"   最近同步: {sync['time'][:19]}  耗时 {sync['pass_seconds']:.1f}s"
+              f"（变更检测 {sync['checksum_seconds']:.1f}s）")
+        print(f"   变化表: {sync['changed']} 个, 失败: {sync['failed']} 个"
+              + (f" ({', '.join(sync['failed_tables'])})" if sync['failed_tables'] else ''))
+        snapshot = sync.get('snapshot')
+        if snapshot:
+            where = snapshot.get('source') or snapshot.get('binlog')
+            if where:
+                print(f"   快照位置: {where['file']}:{where['position']}"
+                      f"（{'主库' if snapshot.get('source') else 'MIDDLE'} binlog）")
+        slowest = sorted(((t, v) for t, v in sync['tables'].items() if v.get('seconds')),
+                         key=lambda item: item[1]['seconds'], reverse=True)[:5]
+        if slowest:
+            print("   最慢的表:")
+            for table, v in slowest:
+                mb = (v.get('raw_bytes') or 0) / 1024 / 1024
+                rows = f"{v['rows']:,} 行, " if v.get('rows') is not None else ''
+                method = f"  [{v['method']}]" if v.get('method') else ''
+                print(f"     {table:<20} {v['seconds']:>7.1f}s  {rows}{mb:.1f} MB, "
+                      f"{mb / v['seconds']:.1f} MB/s{method}")
+
+    # 每个同步目标一个日志：sync_journal.db 为主目标，sync_journal_<目标>.db 为其他目标
+    from sync_journal import SyncJournal
+    for journal_file in sorted((SYNC_HOME / 'cache').glob('sync_journal*.db')):
+        target = journal_file.stem[len('sync_journal_'):].upper()
+        # 只读打开，不与正在运行的同步进程争写锁，也不会创建或迁移日志
+        journal = SyncJournal.open_readonly(journal_file)
+        try:
+            counts, failed = journal.summary()
+            lag = journal.lag()
+        except sqlite3.Error as e:
+            print(f"   同步状态{f'（{target}）' if target else ''}: 读取失败: {e}")
+            continue
+        finally:
+            journal.close()
+        print(f"   同步状态{f'（{target}）' if target else ''}: "
+              + ', '.join(f"{k} {v}" for k, v in sorted(counts.items()))
+              + f", 延迟 {lag:.0f}s")
+        for item in failed:
+            wait = max(0, item['next_retry'] - time.time())
+            print(f"     ❌ {item['table_name']:<20} 第 {item['attempts']} 次失败, {wait:.0f}s 后重试: "
+                  f"{(item['last_error'] or '')[:60]}")
+
+    protection = state.get('protection')
+    if protection:
+        lag = protection.get('replication_lag')
+        print(f"   最近保护检查: {protection['time'][:19]}  复制延迟: "
+              f"{'未知' if lag is None else f'{lag}s'}  严重告警: {protection['critical_alerts']}")
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'status':
+        print_status()
+    else:
+        write_textfile(load_state())
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+同步计划 - 按估算耗时为每个变化的表选择最便宜的同步方式
+
+可选方式：
+  skip      未变化
+  delta     按水位线只同步新增/修改的行（需要有索引的 updated_at 类列或追加型自增主键）
+  chunk     按主键分块比较摘要，只同步变化的块（需要单列整数主键）
+  verify    增量表到期校验：分块比较 MIDDLE 和目标的摘要，修复增量漏掉的行（见 delta_sync.py）
+  parallel  全量，按主键区间并行（大于 SYNC_SPLIT_BYTES 且有整数主键）
+  full      全量
+SYNC_MODE=auto 时在以上方式中按估算耗时选择；delta/chunk/full 时只在该方式和全量之间选择。
+估算依据：information_schema 的 DATA_LENGTH/TABLE_ROWS/AVG_ROW_LENGTH、水位线之后的行数
+（最多数到 PLAN_DELTA_MAX_PERCENT% 的行）、上次分块同步的变化比例，以及每种方式的历史吞吐量
+（cache/sync_planner.json，按表和全局各记一份，没有历史时用 PLAN_DEFAULT_MBPS）。
+全量同步后为下一次增量准备的起点（水位线或分块索引）也由这里决定。
+"""
+
+import json
+import os
+import threading
+
+from chunk_checksum import get_int_pk
+from row_copy import quote_ident
+
+# 没有历史数据时各方式相对全量吞吐量的倍数（分块主要是 MIDDLE 本地扫描，比跨公网传输快）
+DEFAULT_SPEEDUP = {'full': 1, 'parallel': 2.5, 'delta': 1, 'chunk': 4, 'verify': 2}
+# 每个表的固定开销（建表/换表、查询摘要等），秒
+OVERHEAD_SECONDS = {'full': 2, 'parallel': 4, 'delta': 0.5, 'chunk': 1, 'verify': 1}
+# 历史吞吐量的平滑系数
+EWMA = 0.3
+
+
+class SyncPlanner:
+    def __init__(self, engine):
+        self.engine = engine
+        self.history_file = engine.cache_dir / 'sync_planner.json'
+        self.default_rate = float(os.getenv('PLAN_DEFAULT_MBPS', 10)) * 1024 * 1024
+        self.delta_max = float(os.getenv('PLAN_DELTA_MAX_PERCENT', 20)) / 100
+        self.chunk_fraction = float(os.getenv('PLAN_CHUNK_CHANGE_PERCENT', 10)) / 100
+        self.lock = threading.Lock()
+        self.load_history()
+
+    def load_history(self):
+        if self.history_file.exists():
+            with open(self.history_file, 'r') as f:
+                self.history = json.load(f)
+        else:
+            self.history = {'global': {}, 'tables': {}}
+
+    def save_history(self):
+        tmp = self.history_file.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.history, f, indent=2)
+        tmp.replace(self.history_file)
+
+    def candidates(self):
+        mode = self.engine.mode
+        if mode == 'auto':
+            return ('delta', 'chunk', 'full')
+        if mode in ('delta', 'chunk'):
+            return (mode, 'full')
+        return ('full',)
+
+    def rate(self, table, strategy):
+        """该方式的吞吐量（字节/秒）：优先用本表历史，其次全局历史，最后用默认值"""
+        table_rate = self.history['tables'].get(table, {}).get(strategy, {}).get('rate')
+        if table_rate:
+            return table_rate
+        global_rate = self.history['global'].get(strategy)
+        if global_rate:
+            return global_rate
+        return self.default_rate * DEFAULT_SPEEDUP[strategy]
+
+    def indexed(self, cursor, table, column):
+        """列是否为某个索引的第一列（水位线查询才不会全表扫描）"""
+        cursor.execute(
+            "SELECT 1 FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() "
+            "AND TABLE_NAME = %s AND COLUMN_NAME = %s AND SEQ_IN_INDEX = 1 LIMIT 1", (table, column))
+        return cursor.fetchone() is not None
+
+    def count_delta(self, cursor, table, state, limit):
+        """水位线之后的行数，最多数到 limit"""
+        column = state['column']
+        op = '>' if state['kind'] == 'pk' else '>='
+        cursor.execute(
+            f"SELECT COUNT(*) AS cnt FROM (SELECT 1 FROM {quote_ident(table)} "
+            f"WHERE {quote_ident(column)} {op} %s LIMIT {int(limit)}) AS d", (state['mark'],))
+        return int(cursor.fetchone()['cnt'])
+
+    def plan_table(self, cursor, table, meta):
+        """为一个变化的表估算各方式的耗时，返回计划字典"""
+        size = meta.get('data_length', 0)
+        rows = meta.get('table_rows', 0)
+        avg_row = meta.get('avg_row_length') or (size // rows if rows else 0)
+        candidates = self.candidates()
+        options = {}
+        notes = []
+
+        pk = get_int_pk(cursor, table)
+        delta = self.engine.syncers.get('delta')
+        watermark = delta.find_watermark(cursor, table) if delta else None
+        if watermark and watermark[0] == 'timestamp' and not self.indexed(cursor, table, watermark[1]):
+            notes.append(f"水位列 {watermark[1]} 无索引")
+            watermark = None
+
+        # 全量后为下次增量准备的起点
+        seed = None
+        if 'delta' in candidates and watermark:
+            seed = 'delta'
+        elif 'chunk' in candidates and pk:
+            seed = 'chunk'
+
+        streamer = self.engine.streamer
+        full = 'parallel' if pk and streamer.table_workers > 1 and size >= streamer.split_bytes else 'full'
+        options[full] = (size, size / self.rate(table, full) + OVERHEAD_SECONDS[full])
+
+        verify = False
+        if 'delta' in candidates and watermark:
+            state = delta.watermarks.get(table)
+            if delta.needs_full(table):
+                notes.append("水位线缺失或到期，需全量")
+            elif state['column'] != watermark[1]:
+                notes.append("水位列已变化，需全量")
+            elif delta.needs_verify(table):
+                # 增量可能漏掉修改（自增主键水位）或 NULL 时间列的行，到期时必须校验，不参与比较
+                if pk:
+                    verify = True
+                    options['verify'] = (size, size / self.rate(table, 'verify') + OVERHEAD_SECONDS['verify'])
+                    notes.append(f"连续增量 {state.get('deltas', 0)} 次后校验")
+                else:
+                    notes.append("增量到期校验需要整数主键，改为全量")
+            else:
+                limit = max(1000, int(rows * self.delta_max))
+                changed = self.count_delta(cursor, table, state, limit)
+                if changed >= limit:
+                    notes.append(f"水位线之后超过 {limit:,} 行")
+                else:
+                    nbytes = changed * avg_row
+                    options['delta'] = (nbytes, nbytes / self.rate(table, 'delta') + OVERHEAD_SECONDS['delta'])
+
+        chunk = self.engine.syncers.get('chunk')
+        if 'chunk' in candidates and chunk and pk:
+            entry = chunk.index.get(table)
+            if entry and entry['chunk_size'] == chunk.chunk_size and entry['pk'] == pk:
+                fraction = self.history['tables'].get(table, {}).get('chunk', {}).get('fraction',
+                                                                                    self.chunk_fraction)
+                options['chunk'] = (int(size * fraction),
+                                    size / self.rate(table, 'chunk') + OVERHEAD_SECONDS['chunk'])
+            else:
+                notes.append("没有分块索引，需全量")
+
+        strategy = 'verify' if verify else min(options, key=lambda s: options[s][1])
+        nbytes, seconds = options[strategy]
+        return {'strategy': strategy, 'seed': seed, 'bytes': int(nbytes), 'seconds': round(seconds, 1),
+                'size': size, 'rows': rows,
+                'options': {s: round(v[1], 1) for s, v in options.items()}, 'notes': notes}
+
+    def plan(self, tables, metadata=None):
+        """为变化的表生成同步计划 {table: plan}，估算失败的表按全量处理"""
+        metadata = metadata or self.engine.metadata or {}
+        plans = {}
+        conn = self.engine.connect_db('MIDDLE')
+        cursor = conn.cursor()
+        try:
+            for table in tables:
+                try:
+                    plans[table] = self.plan_table(cursor, table, metadata.get(table, {}))
+                except Exception as e:
+                    plans[table] = {'strategy': 'full', 'seed': None, 'bytes': 0, 'seconds': 0,
+                                    'options': {}, 'notes': [f"估算失败: {e}"]}
+        finally:
+            cursor.close()
+            conn.close()
+        return plans
+
+    def observe(self, table, stats, meta):
+        """同步完成后更新该方式的吞吐量"""
+        strategy = stats.get('strategy')
+        seconds = stats.get('seconds')
+        if strategy not in DEFAULT_SPEEDUP or not seconds:
+            return
+        meta = meta or {}
+        if strategy == 'delta':
+            nbytes = (stats.get('rows') or 0) * (meta.get('avg_row_length') or 0)
+        else:
+            # 全量和分块的耗时都与整表大小成正比（分块要扫描全表）
+            nbytes = meta.get('data_length', 0)
+        if nbytes <= 0:
+            return
+        rate = nbytes / max(seconds - OVERHEAD_SECONDS[strategy] / 2, 0.1)
+        with self.lock:
+            entry = self.history['tables'].setdefault(table, {}).setdefault(strategy, {})
+            entry['rate'] = rate if not entry.get('rate') else entry['rate'] * (1 - EWMA) + rate * EWMA
+            entry['seconds'] = seconds
+            if strategy == 'chunk' and stats.get('chunks_total'):
+                entry['fraction'] = round(stats['chunks_changed'] / stats['chunks_total'], 4)
+            current = self.history['global'].get(strategy)
+            self.history['global'][strategy] = rate if not current else current * (1 - EWMA) + rate * EWMA
+            self.save_history()
+
+    def print_plan(self, plans, unchanged):
+        """--dry-run 输出"""
+        print(f"\n{'表':<24} {'方式':<9} {'大小':>10} {'预计传输':>10} {'预计耗时':>9}  备选/说明")
+        for table, plan in sorted(plans.items(), key=lambda item: -item[1]['seconds']):
+            others = ', '.join(f"{s} {v:.0f}s" for s, v in plan['options'].items() if s != plan['strategy'])
+            detail = '; '.join(filter(None, [others] + plan['notes']))
+            print(f"{table:<24} {plan['strategy']:<9} {plan.get('size', 0) / 1024 / 1024:>8.1f}MB "
+                  f"{plan['bytes'] / 1024 / 1024:>8.1f}MB {plan['seconds']:>8.1f}s  {detail}")
+        for table in sorted(unchanged):
+            print(f"{table:<24} {'skip':<9}")
+        total_bytes = sum(p['bytes'] for p in plans.values())
+        total_seconds = sum(p['seconds'] for p in plans.values())
+        workers = self.engine.workers
+        print(f"\n合计: {len(plans)} 个表同步, {len(unchanged)} 个跳过, 预计传输 {total_bytes / 1024 / 1024:.1f} MB, "
+              f"串行 {total_seconds:.0f}s" + (f"（{workers} 并发约 {total_seconds / workers:.0f}s）" if workers > 1 else ''))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+表级同步调度 - 优先通道 + 按变化频率和同步耗时自适应的同步间隔
+
+三个通道，每个通道有自己的最短/最长间隔（SCHED_<通道>_MIN_SECONDS / _MAX_SECONDS）：
+  critical  关键表（默认 data_protection.CRITICAL_TABLES），默认 15~60 秒
+  normal    其他表，默认 SYNC_INTERVAL_SECONDS ~ 900 秒
+  bulk      大表（SCHED_BULK_TABLES 或大于 SCHED_BULK_BYTES），默认 180~1800 秒，由常驻进程在后台线程同步
+每次检查后调整该表的间隔：有变化减半，无变化乘 1.5，且不小于上次同步耗时的 SCHED_COST_FACTOR 倍。
+中间服务器复制延迟超过 SCHED_MAX_LAG_SECONDS 时推迟 normal/bulk 通道，
+超过 SCHED_CRITICAL_MAX_LAG_SECONDS 时关键表也推迟（读到的是旧数据，同步只会增加从库负担）。
+调度状态保存在 cache/sync_schedule.json。
+"""
+
+import json
+import os
+import threading
+import time
+
+from data_protection import CRITICAL_TABLES
+
+LANES = ('critical', 'normal', 'bulk')
+
+
+def table_set(name, default):
+    return {t.strip() for t in os.getenv(name, default).split(',') if t.strip()}
+
+
+class TableScheduler:
+    def __init__(self, cache_dir):
+        self.state_file = cache_dir / 'sync_schedule.json'
+        normal_min = float(os.getenv('SYNC_INTERVAL_SECONDS', 180))
+        defaults = {'critical': (15, 60), 'normal': (normal_min, max(normal_min, 900)), 'bulk': (180, 1800)}
+        self.limits = {}
+        for lane, (low, high) in defaults.items():
+            low = float(os.getenv(f'SCHED_{lane.upper()}_MIN_SECONDS', low))
+            high = float(os.getenv(f'SCHED_{lane.upper()}_MAX_SECONDS', high))
+            self.limits[lane] = (low, max(low, high))
+        self.critical_tables = table_set('SCHED_CRITICAL_TABLES', ','.join(sorted(CRITICAL_TABLES)))
+        self.bulk_tables = table_set('SCHED_BULK_TABLES', 'quota_data')
+        self.bulk_bytes = int(os.getenv('SCHED_BULK_BYTES', 256 * 1024 * 1024))
+        self.cost_factor = float(os.getenv('SCHED_COST_FACTOR', 5))
+        self.max_lag = float(os.getenv('SCHED_MAX_LAG_SECONDS', 300))
+        self.critical_max_lag = float(os.getenv('SCHED_CRITICAL_MAX_LAG_SECONDS', 1800))
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if self.state_file.exists():
+            with open(self.state_file, 'r') as f:
+                self.state = json.load(f)
+        else:
+            self.state = {}
+
+    def save(self):
+        tmp = self.state_file.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        tmp.replace(self.state_file)
+
+    def lane(self, table, meta):
+        if table in self.critical_tables:
+            return 'critical'
+        size = (meta or {}).get('data_length', 0) + (meta or {}).get('index_length', 0)
+        if table in self.bulk_tables or size >= self.bulk_bytes:
+            return 'bulk'
+        return 'normal'
+
+    def next_due(self):
+        """最早到期的时间（没有调度状态时为0，立即执行）"""
+        with self.lock:
+            return min((entry['next_due'] for entry in self.state.values()), default=0)
+
+    def due(self, metadata, lag=None):
+        """按通道返回到期的表 {lane: [table]}；新出现的表立即到期"""
+        now = time.time()
+        lanes = {lane: [] for lane in LANES}
+        with self.lock:
+            for table in list(self.state):
+                if table not in metadata:
+                    del self.state[table]
+            for table, meta in sorted(metadata.items()):
+                if table.startswith('_'):
+                    continue
+                lane = self.lane(table, meta)
+                entry = self.state.setdefault(table, {'interval': self.limits[lane][0], 'next_due': 0})
+                if entry.get('lane') != lane:
+                    # 通道变化（如表变大）时间隔按新通道重新约束
+                    entry['lane'] = lane
+                    entry['interval'] = min(max(entry['interval'], self.limits[lane][0]), self.limits[lane][1])
+                if entry['next_due'] <= now:
+                    lanes[lane].append(table)
+                    # 先按最短间隔占位：执行中、被推迟或同步已暂停的表不会每个周期都到期
+                    entry['next_due'] = now + self.limits[lane][0]
+            self.save()
+
+        if lag is not None:
+            deferred = 0
+            for lane in LANES:
+                limit = self.critical_max_lag if lane == 'critical' else self.max_lag
+                if lag > limit:
+                    deferred += len(lanes[lane])
+                    lanes[lane] = []
+            if deferred:
+                print(f"⏳ 复制延迟 {lag}s，推迟同步 {deferred} 个表")
+        return lanes
+
+    def record(self, tables, changed, result, table_stats):
+        """根据检查结果调整间隔：有变化缩短，无变化延长，同步失败的表按最短间隔重试"""
+        now = time.time()
+        failed = set(result['failed']) if result else set()
+        with self.lock:
+            for table in tables:
+                entry = self.state.get(table)
+                if entry is None:
+                    continue
+                low, high = self.limits[entry['lane']]
+                interval = entry['interval']
+                if table in changed:
+                    interval = max(low, interval / 2)
+                    entry['last_changed'] = now
+                    seconds = table_stats.get(table, {}).get('seconds')
+                    if seconds is not None and table not in failed:
+                        entry['cost'] = seconds
+                else:
+                    interval = min(high, interval * 1.5)
+                interval = min(high, max(interval, entry.get('cost', 0) * self.cost_factor))
+                entry['interval'] = round(interval, 1)
+                entry['last_checked'] = now
+                entry['next_due'] = now + (low if table in failed else interval)
+            self.save()
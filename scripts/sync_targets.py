@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多目标同步 - 从 MIDDLE 读一次，同时写入 SYNC_TARGETS 中的所有目标
+
+SYNC_TARGETS 为逗号分隔的连接前缀（默认 CLOUD，每个前缀对应 .env 中的 <前缀>_HOST/_USER/_PASS/_DB）。
+第一个目标沿用原来的状态文件名，其余目标的已同步校验和、同步日志、水位线和分块索引
+各存一份带 _<目标> 后缀的文件，各自判断是否需要同步、各自失败重试，互不影响。
+
+全量同步时读取端只读取、转义一次，每个目标一个写入线程和一个有界队列（FANOUT_QUEUE_BATCHES 批）；
+读取端因某个目标的队列已满而等待、同时其他目标已空闲的时间累计超过 FANOUT_STALL_SECONDS 秒时，
+把这个目标摘除（本次记为失败，按重试间隔单独重试），其余目标继续，慢目标不会拖住整个同步。
+只有一个目标或所有目标一样慢时不会摘除。结束时等待写入线程写完队列，连续 FANOUT_STALL_SECONDS 秒
+没有处理完任何操作（卡在网络上）的目标同样摘除，不会无限等待。
+"""
+
+import json
+import os
+import queue
+import threading
+
+from db_pool import get_pool
+from sync_journal import SyncJournal
+
+# 读取端等待写入队列的检查间隔，秒
+WAIT_STEP = 0.5
+
+
+def target_names():
+    """SYNC_TARGETS 中的目标前缀，第一个为主目标"""
+    names = [t.strip().upper() for t in os.getenv('SYNC_TARGETS', 'CLOUD').split(',') if t.strip()]
+    return names or ['CLOUD']
+
+
+class SyncTarget:
+    """一个同步目标：已同步校验和、同步日志和增量同步状态"""
+
+    def __init__(self, cache_dir, name, primary=False):
+        self.name = name
+        self.primary = primary
+        self.suffix = '' if primary else f"_{name.lower()}"
+        # 输出里只给非主目标加标注，单目标时与原来一致
+        self.label = '' if primary else f" → {name}"
+        # table_checksums.json 只保存同步成功时的校验和；待同步/失败/重试状态在同步日志中
+        self.checksum_file = cache_dir / f'table_checksums{self.suffix}.json'
+        self.journal = SyncJournal(cache_dir, f'sync_journal{self.suffix}.db')
+        self.syncers = {}
+        self.load_checksums()
+
+    def load_checksums(self):
+        """加载上次的表校验和"""
+        if self.checksum_file.exists():
+            with open(self.checksum_file, 'r') as f:
+                self.last_checksums = json.load(f)
+        else:
+            self.last_checksums = {}
+
+    def save_checksums(self):
+        """保存校验和（先写临时文件再替换，中途崩溃不会留下半个文件）"""
+        tmp = self.checksum_file.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.last_checksums, f, indent=2)
+        tmp.replace(self.checksum_file)
+
+
+class TargetWriter:
+    """一个目标的写入线程：按顺序执行读取端放入队列的操作 op(conn, target)"""
+
+    def __init__(self, target, depth, failures, options):
+        self.target = target
+        self.options = options
+        self.failures = failures
+        self.queue = queue.Queue(maxsize=depth)
+        # 其他目标空等这个目标的累计秒数
+        self.lagged = 0.0
+        # 已处理（执行或丢弃）的操作数，close 时据此判断写入线程是否还在推进
+        self.done = 0
+        self.conn = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    @property
+    def failed(self):
+        return self.target.name in self.failures
+
+    def fail(self, error):
+        self.failures.setdefault(self.target.name, error)
+
+    def run(self):
+        try:
+            # 写入连接会改会话变量（关闭检查），不放回连接池
+            self.conn = get_pool(self.target.name).create(**self.options)
+        except Exception as e:
+            self.fail(e)
+        while True:
+            op = self.queue.get()
+            if op is None:
+                break
+            # 失败后继续取出剩余的操作（丢弃），读取端不会因队列满而卡住
+            if not self.failed:
+                try:
+                    op(self.conn, self.target)
+                except Exception as e:
+                    self.fail(e)
+            self.done += 1
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+
+    def put(self, op, fan):
+        while not self.failed:
+            try:
+                self.queue.put(op, timeout=WAIT_STEP)
+                return True
+            except queue.Full:
+                if any(w is not self and not w.failed and w.queue.empty() for w in fan.writers):
+                    self.lagged += WAIT_STEP
+                    if self.lagged >= fan.stall:
+                        self.fail(TimeoutError(f"落后其他目标累计 {self.lagged:.0f}s，本次摘除"))
+        return False
+
+    def close(self, timeout):
+        """等写完队列中的操作；连续 timeout 秒没有处理完任何操作（卡在网络上）时记为失败、不再等待，
+        该目标本次摘除"""
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            self.fail(TimeoutError("写入线程无响应"))
+            return
+        done, idle = self.done, 0.0
+        while True:
+            self.thread.join(WAIT_STEP)
+            if not self.thread.is_alive():
+                return
+            if self.done != done:
+                done, idle = self.done, 0.0
+                continue
+            idle += WAIT_STEP
+            if idle >= timeout:
+                self.fail(TimeoutError(f"写入线程 {idle:.0f}s 无进展，本次摘除"))
+                return
+
+
+class FanOut:
+    """把同一份数据的写入操作分发给多个目标；failures 为 {目标: 异常}，可在多个 FanOut 间共享，
+    options 为写入连接的额外参数（LOAD DATA 需要 local_infile=True）"""
+
+    def __init__(self, targets, failures=None, **options):
+        self.stall = float(os.getenv('FANOUT_STALL_SECONDS', 60))
+        depth = max(1, int(os.getenv('FANOUT_QUEUE_BATCHES', 8)))
+        self.failures = failures if failures is not None else {}
+        self.writers = [TargetWriter(t, depth, self.failures, options) for t in targets
+                        if t.name not in self.failures]
+
+    @property
+    def live(self):
+        return [w for w in self.writers if not w.failed]
+
+    def submit(self, op):
+        """交给每个仍在写入的目标；全部目标都已失败时抛出第一个目标的异常，读取端停止"""
+        if not self.live:
+            self.raise_first()
+        for writer in self.live:
+            writer.put(op, self)
+        if not self.live:
+            self.raise_first()
+
+    def raise_first(self):
+        if self.failures:
+            raise next(iter(self.failures.values()))
+        raise RuntimeError("没有可写入的目标")
+
+    def close(self):
+        for writer in self.writers:
+            writer.close(self.stall)
+        return self.failures
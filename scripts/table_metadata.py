@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+表元数据快照 - 一次查询读取 information_schema.TABLES，作为变更检测的预筛选
+"""
+
+# UPDATE_TIME 可信的存储引擎（InnoDB 在 5.7+ 维护 UPDATE_TIME，重启后为NULL）
+RELIABLE_ENGINES = {'InnoDB', 'MyISAM'}
+
+
+def fetch_table_metadata(cursor):
+    """返回当前库所有基础表的元数据 {table: {...}}"""
+    try:
+        # MySQL 8 默认缓存统计信息24小时，必须关闭缓存才能看到最新值
+        cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+    except Exception:
+        pass
+
+    cursor.execute(
+        "SELECT TABLE_NAME, ENGINE, UPDATE_TIME, TABLE_ROWS, AVG_ROW_LENGTH, "
+        "DATA_LENGTH, INDEX_LENGTH, AUTO_INCREMENT "
+        "FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_TYPE = 'BASE TABLE'"
+    )
+    metadata = {}
+    for row in cursor.fetchall():
+        metadata[row['TABLE_NAME']] = {
+            'engine': row['ENGINE'],
+            'update_time': row['UPDATE_TIME'].isoformat() if row['UPDATE_TIME'] else None,
+            'table_rows': int(row['TABLE_ROWS'] or 0),
+            'avg_row_length': int(row['AVG_ROW_LENGTH'] or 0),
+            'data_length': int(row['DATA_LENGTH'] or 0),
+            'index_length': int(row['INDEX_LENGTH'] or 0),
+            'auto_increment': int(row['AUTO_INCREMENT']) if row['AUTO_INCREMENT'] is not None else None,
+        }
+    return metadata
+
+
+def metadata_reliable(meta):
+    """元数据能否用来判断表未变化"""
+    return meta.get('engine') in RELIABLE_ENGINES and meta.get('update_time') is not None
+
+
+def metadata_fingerprint(meta):
+    """用于比较的元数据指纹"""
+    return [meta.get('update_time'), meta.get('table_rows'),
+            meta.get('data_length'), meta.get('auto_increment')]
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+同步传输层 - MIDDLE → Cloud SQL 跨公网链路的压缩、限速和流量统计
+
+SYNC_COMPRESSION:
+  none      不压缩（进程内流式同步可用）
+  protocol  MySQL协议zlib压缩（mysql --compress）
+  zstd      MySQL协议zstd压缩（mysql --compression-algorithms=zstd，需8.0.18+）
+PyMySQL 不支持协议压缩，开启压缩时全量同步改走 mysql 客户端管道，由本模块中转数据流（启动时告警）。
+压缩后字节按抽样压缩估算；zstd 模式下没有安装 zstandard 时改用 zlib 估算并告警，估算值偏大。
+SYNC_BANDWIDTH_MBPS 限制所有同步线程合计的出口带宽（按压缩后字节估算，0为不限速）。
+每个表的原始字节和压缩后字节（抽样压缩估算）记录在 cache/transfer_stats.json。
+"""
+
+import json
+import os
+import threading
+import time
+import zlib
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_BYTES = 64 * 1024
+# 每 N 个数据块抽样压缩一个来估算压缩率
+SAMPLE_EVERY = 8
+
+
+class TransferCounter:
+    """单表传输字节统计"""
+
+    def __init__(self, mode, level):
+        self.mode = mode
+        self.raw_bytes = 0
+        self.sampled_raw = 0
+        self.sampled_wire = 0
+        self.chunks = 0
+        if mode == 'zstd' and zstandard is not None:
+            self.compress = zstandard.ZstdCompressor(level=level).compress
+        elif mode in ('protocol', 'zstd'):
+            self.compress = lambda data: zlib.compress(data, 6)
+        else:
+            self.compress = None
+
+    @property
+    def ratio(self):
+        if not self.compress or not self.sampled_raw:
+            return 1.0
+        return self.sampled_wire / self.sampled_raw
+
+    @property
+    def wire_bytes(self):
+        return int(self.raw_bytes * self.ratio)
+
+    def add(self, data):
+        self.raw_bytes += len(data)
+        if self.compress and self.chunks % SAMPLE_EVERY == 0:
+            self.sampled_raw += len(data)
+            self.sampled_wire += len(self.compress(data))
+        self.chunks += 1
+
+    def add_size(self, nbytes):
+        """只计数不抽样（未压缩的链路）"""
+        self.raw_bytes += nbytes
+
+
+class Transport:
+    def __init__(self, cache_dir):
+        self.mode = os.getenv('SYNC_COMPRESSION', 'none')
+        if self.mode not in ('none', 'protocol', 'zstd'):
+            print(f"⚠️  未知的 SYNC_COMPRESSION={self.mode}，按 none 处理", flush=True)
+            self.mode = 'none'
+        if self.mode == 'zstd' and zstandard is None:
+            print("⚠️  SYNC_COMPRESSION=zstd 但未安装 zstandard，压缩后字节改用 zlib 估算"
+                  "（pip install zstandard）", flush=True)
+        self.zstd_level = int(os.getenv('SYNC_ZSTD_LEVEL', 3))
+        self.rate = float(os.getenv('SYNC_BANDWIDTH_MBPS', 0)) * 1024 * 1024 / 8
+        self.stats_file = cache_dir / 'transfer_stats.json'
+        self.lock = threading.Lock()
+        self.tokens = self.rate
+        self.last_refill = time.time()
+
+    @property
+    def compressed(self):
+        return self.mode in ('protocol', 'zstd')
+
+    def client_args(self):
+        """mysql 客户端的压缩参数"""
+        if self.mode == 'protocol':
+            return ['--compress']
+        if self.mode == 'zstd':
+            return ['--compression-algorithms=zstd', f'--zstd-compression-level={self.zstd_level}']
+        return []
+
+    def counter(self):
+        return TransferCounter(self.mode, self.zstd_level)
+
+    def throttle(self, nbytes):
+        """令牌桶限速，所有线程共享带宽"""
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.rate, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            self.tokens -= nbytes
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+    def relay(self, src, dst, counter):
+        """把 src 的数据流转发到 dst，同时统计和限速；结束后关闭 dst"""
+        try:
+            while True:
+                data = src.read(CHUNK_BYTES)
+                if not data:
+                    break
+                counter.add(data)
+                self.throttle(len(data) * counter.ratio)
+                dst.write(data)
+        except (BrokenPipeError, ValueError):
+            # 导入端已退出（失败或超时被终止），由调用方根据返回码处理
+            pass
+        finally:
+            try:
+                dst.close()
+            except Exception:
+                pass
+
+    def record(self, table, counter):
+        """记录单表传输统计，返回写入 table_stats 的字段"""
+        entry = {'compression': self.mode, 'raw_bytes': counter.raw_bytes,
+                 'wire_bytes': counter.wire_bytes}
+        with self.lock:
+            stats = {}
+            if self.stats_file.exists():
+                with open(self.stats_file, 'r') as f:
+                    stats = json.load(f)
+            total = stats.get(table, {})
+            stats[table] = dict(
+                entry,
+                updated=datetime.now().isoformat(),
+                total_raw_bytes=total.get('total_raw_bytes', 0) + counter.raw_bytes,
+                total_wire_bytes=total.get('total_wire_bytes', 0) + counter.wire_bytes,
+            )
+            with open(self.stats_file, 'w') as f:
+                json.dump(stats, f, indent=2)
+        return entry
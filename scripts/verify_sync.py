@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据一致性校验 - 按主键区间比较 MIDDLE 和 Cloud SQL 的行摘要，定位不一致的区间
+
+用法:
+  python3 verify_sync.py            校验所有同步表
+  python3 verify_sync.py --repair   校验并重新同步不一致的区间
+  python3 verify_sync.py 表名 ...    只校验指定表
+
+两端的分块摘要并行计算，不一致的块二分到 VERIFY_MIN_RANGE 个主键以内；
+为排除同步途中的正常差异，最终区间会在 VERIFY_RECHECK_SECONDS 秒后复核一次。
+每次查询之间休眠 VERIFY_SLEEP_MS 毫秒，降低对两端服务器的压力。
+修复时持有与 safe_sync.sh / smart_sync 相同的 cache/sync.lock，同步进程（或常驻进程）运行中不修复，
+避免与整表重载、换表同时写同一个表。
+报告写入 logs/verify_report.json。
+"""
+
+import fcntl
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dotenv import load_dotenv
+
+load_dotenv('/opt/mysql-sync/.env')
+
+# 部署目录，可用 SYNC_HOME 指向其他目录（本地测试/基准测试）
+SYNC_HOME = Path(os.getenv('SYNC_HOME', '/opt/mysql-sync'))
+
+from db_pool import connect_db
+from chunk_checksum import get_int_pk, get_columns, chunk_digests, range_digest, row_hash_sql, copy_range
+from row_copy import quote_ident
+from table_metadata import fetch_table_metadata
+
+
+class SyncVerifier:
+    def __init__(self, source='MIDDLE', target='CLOUD'):
+        self.source = source
+        self.target = target
+        self.report_file = SYNC_HOME / 'logs/verify_report.json'
+        self.pause_file = SYNC_HOME / 'PAUSE_SYNC'
+        self.lock_file = SYNC_HOME / 'cache/sync.lock'
+        self.chunk_size = int(os.getenv('VERIFY_CHUNK_SIZE', 100000))
+        self.min_range = int(os.getenv('VERIFY_MIN_RANGE', 1000))
+        self.sleep = float(os.getenv('VERIFY_SLEEP_MS', 20)) / 1000
+        self.recheck_seconds = float(os.getenv('VERIFY_RECHECK_SECONDS', 10))
+        self.executor = ThreadPoolExecutor(max_workers=2)
+
+    def both(self, func, *args):
+        """在两端并行执行同一个查询函数，返回 (源结果, 目标结果)"""
+        def run(prefix):
+            conn = connect_db(prefix)
+            cursor = conn.cursor()
+            try:
+                return func(cursor, *args)
+            finally:
+                cursor.close()
+                conn.close()
+        futures = [self.executor.submit(run, self.source), self.executor.submit(run, self.target)]
+        result = tuple(f.result() for f in futures)
+        time.sleep(self.sleep)
+        return result
+
+    def table_digest(self, cursor, table, columns):
+        """无整数主键的表只比较整表摘要"""
+        cursor.execute(
+            f"SELECT COUNT(*) AS cnt, COALESCE(BIT_XOR({row_hash_sql(columns)}), 0) AS digest "
+            f"FROM {quote_ident(table)}"
+        )
+        row = cursor.fetchone()
+        return f"{row['cnt']}:{row['digest']}"
+
+    def bisect(self, table, pk, columns, lo, hi, found):
+        """二分定位不一致的区间"""
+        if hi - lo <= self.min_range:
+            found.append([lo, hi])
+            return
+        mid = (lo + hi) // 2
+        for a, b in ((lo, mid), (mid, hi)):
+            src, dst = self.both(range_digest, table, pk, columns, a, b)
+            if src != dst:
+                self.bisect(table, pk, columns, a, b, found)
+
+    def verify_table(self, table):
+        """校验单个表，返回结果字典"""
+        start = time.time()
+        (pk, columns), (cloud_pk, cloud_columns) = self.both(
+            lambda cursor, t: (get_int_pk(cursor, t), get_columns(cursor, t)), table)
+        if not cloud_columns:
+            return {'table': table, 'status': 'missing'}
+        if columns != cloud_columns:
+            return {'table': table, 'status': 'schema_mismatch'}
+
+        if pk is None:
+            src, dst = self.both(self.table_digest, table, columns)
+            status = 'ok' if src == dst else 'mismatch'
+            return {'table': table, 'status': status, 'ranges': [] if status == 'ok' else ['*'],
+                    'seconds': round(time.time() - start, 1)}
+
+        src, dst = self.both(chunk_digests, table, pk, columns, self.chunk_size)
+        suspects = sorted(int(c) for c in set(src) | set(dst) if src.get(c) != dst.get(c))
+        ranges = []
+        for chunk in suspects:
+            lo = chunk * self.chunk_size
+            self.bisect(table, pk, columns, lo, lo + self.chunk_size, ranges)
+
+        if ranges and self.recheck_seconds:
+            # 复核：同步途中的差异在下一轮同步后会消失
+            time.sleep(self.recheck_seconds)
+            ranges = [r for r in ranges if len(set(self.both(range_digest, table, pk, columns, *r))) > 1]
+
+        return {'table': table, 'status': 'ok' if not ranges else 'mismatch', 'pk': pk,
+                'chunks': len(src), 'ranges': ranges, 'seconds': round(time.time() - start, 1)}
+
+    def repair(self, result):
+        """重新同步不一致的主键区间（持有 sync.lock，同步进程运行中则跳过）"""
+        lock_fd = open(self.lock_file, 'a')
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_fd.close()
+            print("     🚫 同步进程正在运行（sync.lock），不执行修复")
+            return
+        try:
+            middle = connect_db(self.source)
+            cloud = connect_db(self.target)
+            try:
+                rows = 0
+                for lo, hi in result['ranges']:
+                    rows += copy_range(middle, cloud, result['table'], result['pk'], lo, hi)
+                print(f"     🔧 已修复 {len(result['ranges'])} 个区间, {rows:,} 行")
+            finally:
+                middle.close()
+                cloud.close()
+        finally:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+            lock_fd.close()
+
+    def run(self, tables=None, repair=False):
+        print("="*70)
+        print(f"🔍 数据一致性校验 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        print("="*70)
+
+        if repair and self.pause_file.exists():
+            print("🚫 同步已暂停（数据保护告警），不执行修复")
+            repair = False
+
+        if not tables:
+            conn = connect_db(self.source)
+            cursor = conn.cursor()
+            try:
+                tables = sorted(t for t in fetch_table_metadata(cursor) if not t.startswith('_'))
+            finally:
+                cursor.close()
+                conn.close()
+
+        results = []
+        for table in tables:
+            try:
+                result = self.verify_table(table)
+            except Exception as e:
+                result = {'table': table, 'status': 'error', 'error': str(e)}
+            results.append(result)
+
+            if result['status'] == 'ok':
+                print(f"  ✓ {table}: 一致 ({result.get('seconds', 0)}s)")
+            elif result['status'] == 'mismatch':
+                shown = ', '.join(f"[{r[0]}, {r[1]})" if isinstance(r, list) else r for r in result['ranges'][:5])
+                more = f" 等{len(result['ranges'])}个" if len(result['ranges']) > 5 else ''
+                print(f"  ❌ {table}: 不一致区间 {shown}{more}")
+                if repair and result.get('pk'):
+                    self.repair(result)
+            else:
+                print(f"  ⚠️  {table}: {result['status']} {result.get('error', '')}")
+
+        with open(self.report_file, 'w') as f:
+            json.dump({'time': datetime.now().isoformat(), 'results': results}, f, indent=2)
+
+        bad = [r for r in results if r['status'] != 'ok']
+        print(f"\n{'='*70}")
+        print(f"✅ 一致: {len(results) - len(bad)}/{len(results)}  报告: {self.report_file}")
+        print("="*70)
+        return not bad
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    repair = '--repair' in args
+    tables = [a for a in args if not a.startswith('--')]
+    verifier = SyncVerifier()
+    result = verifier.run(tables, repair)
+    sys.exit(0 if result else 1)